@@ -50,9 +50,17 @@ class Output:
             raise TypeError('Object of type  %s is not JSON serializable' % obj.__class__.__name__)
 
     @classmethod
-    def dump_dict(cls, data):
-        # todo 使用其他方式来转换spec
-        return json.loads(json.dumps(data, default=cls.json_encoder))
+    def dump_dict(cls, data, default=None):
+        """Convert the spec to JSON compatible data in a single pass.
+
+        The embedded `Output` objects are replaced with their specs by reference, since the specs have been
+        converted when the `Output` objects are created, the nested outputs are not converted repeatedly.
+        The spec is serialized only once when it is sent to client.
+
+        :param callable default: Like the ``default`` parameter of `json.dumps()` , called with the objects that
+            can't be converted, should return a convertible version of the object or raise a `TypeError` .
+        """
+        return _normalize_spec(data, default)
 
     @classmethod
     def safely_destruct(cls, obj):
@@ -176,6 +184,41 @@ class OutputList(UserList):
             o.__del__()  # lgtm [py/explicit-call-to-delete]
 
 
+def _json_key(key):
+    # convert the dict key in the same way as `json.dumps()`
+    if isinstance(key, str):
+        return key
+    if key is True or key is False or key is None:
+        return json.dumps(key)
+    if isinstance(key, (int, float)):
+        return float.__repr__(key) if isinstance(key, float) else int.__repr__(key)
+    raise TypeError('keys must be str, int, float, bool or None, not %s' % key.__class__.__name__)
+
+
+def _normalize_spec(obj, default=None):
+    """Convert the output spec to JSON compatible data, see `Output.dump_dict()`"""
+    cls = type(obj)
+    if cls is str or cls is int or cls is float or cls is bool or obj is None:
+        return obj
+    if cls is dict:
+        return {k if type(k) is str else _json_key(k): _normalize_spec(v, default) for k, v in obj.items()}
+    if cls is list or cls is tuple:
+        return [_normalize_spec(v, default) for v in obj]
+    if isinstance(obj, Output):
+        return obj.embed_data()
+    if isinstance(obj, OutputList):
+        return [_normalize_spec(v, default) for v in obj.data]
+    if isinstance(obj, (str, int, float)):
+        return obj
+    if isinstance(obj, dict):
+        return {_json_key(k): _normalize_spec(v, default) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize_spec(v, default) for v in obj]
+    if default is not None:
+        return _normalize_spec(default(obj), default)
+    raise TypeError('Object of type %s is not JSON serializable' % obj.__class__.__name__)
+
+
 def safely_destruct_output_when_exp(content_param):
     """装饰器生成: 异常时安全释放 Output 对象
 
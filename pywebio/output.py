@@ -77,6 +77,9 @@ Functions list
 |                    | `popup`:sup:`*†`          | Show popup                                                 |
 |                    +---------------------------+------------------------------------------------------------+
 |                    | `close_popup`             | Close the current popup window.                            |
+|                    +---------------------------+------------------------------------------------------------+
+|                    | | `batch`:sup:`†`         | Send the outputs to browser as a whole                     |
+|                    | | `batched`               |                                                            |
 +--------------------+---------------------------+------------------------------------------------------------+
 | Layout and Style   | `put_row`:sup:`*†`        | Use row layout to output content                           |
 |                    +---------------------------+------------------------------------------------------------+
@@ -202,6 +205,8 @@ Other Interactions
 .. autofunction:: toast
 .. autofunction:: popup
 .. autofunction:: close_popup
+.. autofunction:: batch
+.. autofunction:: batched
 
 .. _style_and_layout:
 
@@ -217,8 +222,8 @@ Layout and Style
 import copy
 import html
 import io
-import json
 import logging
+import os
 import string
 from base64 import b64encode
 from collections.abc import Mapping, Sequence
@@ -234,7 +239,8 @@ except ImportError:
 
 from .io_ctrl import output_register_callback, send_msg, Output, \
     safely_destruct_output_when_exp, OutputList, scope2dom
-from .session import get_current_session, download
+from .session import get_current_session
+from .session.file_store import file_store
 from .utils import random_str, iscoroutinefunction, check_dom_name_value
 
 try:
@@ -250,7 +256,8 @@ __all__ = ['Position', 'OutputPosition', 'remove', 'scroll_to', 'put_tabs', 'put
            'close_popup', 'put_widget', 'put_collapse', 'put_link', 'put_scrollable', 'style', 'put_column',
            'put_row', 'put_grid', 'span', 'put_progressbar', 'set_progressbar', 'put_processbar', 'set_processbar',
            'put_loading', 'output', 'toast', 'get_scope', 'put_info', 'put_error', 'put_warning', 'put_success',
-           'put_datatable', 'datatable_update', 'datatable_insert', 'datatable_remove', 'JSFunction']
+           'put_datatable', 'datatable_update', 'datatable_insert', 'datatable_remove', 'JSFunction',
+           'batch', 'batched']
 
 
 # popup size
@@ -927,14 +934,17 @@ def put_image(src: Union[str, bytes, PILImage], format: str = None, title: str =
     return put_html(tag, scope=scope, position=position)
 
 
-def put_file(name: str, content: bytes, label: str = None, scope: str = None,
+def put_file(name: str, content: Union[bytes, os.PathLike], label: str = None, scope: str = None,
              position: int = OutputPosition.BOTTOM) -> Output:
     """Output a link to download a file
 
     To show a link with the file name on the browser. When click the link, the browser automatically downloads the file.
 
     :param str name: File name downloaded as
-    :param content: File content. It is a bytes-like object
+    :param content: File content. It is a bytes-like object, or a file path in ``pathlib.Path`` (or other
+       ``os.PathLike`` object). ``str`` is not accepted to avoid mistaking the text content for file path.
+       The content is served by the backend server until the session closes,
+       the file path is read only when the link is clicked, so it's recommended for large file.
     :param str label: The label of the download link, which is the same as the file name by default.
     :param int scope, position: Those arguments have the same meaning as for `put_text()`
 
@@ -947,11 +957,15 @@ def put_file(name: str, content: bytes, label: str = None, scope: str = None,
         content = open('./some-file', 'rb').read()  # ..doc-only
         content = open('README.md', 'rb').read()    # ..demo-only
         put_file('hello-world.txt', content, 'download me')
+
+    .. versionchanged:: 1.9
+       Support ``os.PathLike`` file path ``content``.
     """
     if label is None:
         label = name
+    token = file_store.add(get_current_session(), name, content)
     output = put_buttons(buttons=[label], link_style=True,
-                         onclick=[lambda: download(name, content)],
+                         onclick=[lambda: send_msg('download', spec=dict(name=name, token=token))],
                          scope=scope, position=position)
     return output
 
@@ -1672,9 +1686,9 @@ def put_datatable(
             )
         raise TypeError
 
-    field_args = json.loads(json.dumps(field_args, default=json_encoder))
-    path_args = json.loads(json.dumps(path_args, default=json_encoder))
-    grid_args = json.loads(json.dumps(grid_args, default=json_encoder))
+    field_args = Output.dump_dict(field_args, default=json_encoder)
+    path_args = Output.dump_dict(path_args, default=json_encoder)
+    grid_args = Output.dump_dict(grid_args, default=json_encoder)
 
     if isinstance(column_order, (list, tuple)):
         column_order = {k: None for k in column_order}
@@ -2181,3 +2195,76 @@ class use_scope_:
             return coro_wrapper
         else:
             return wrapper
+
+
+def batch():
+    """Collect the outputs in the ``with`` block and send them to browser as a whole.
+    Can be used as context manager and decorator.
+
+    Normally, each output function call is handed to the server backend as soon as it is called.
+    In ``batch()`` , the output commands of current task (such as ``put_xxx()`` , `clear()` , `use_scope()` ,
+    ``run_js()`` ) are collected and handed to the backend as one unit when leaving the block,
+    so the backend sends them in a single message and the browser applies them in one go.
+    It reduces the overhead of the applications that produce many outputs in a short time.
+
+    The collected outputs are also sent before current task waits for user, such as calling the input functions
+    in ``batch()`` . The nested ``batch()`` has no effect, the outputs are sent when leaving the outermost one.
+
+    :Usage:
+
+    ::
+
+        with batch():
+            for i in range(1000):
+                put_text(i)
+
+        @batched
+        def show_table(rows):
+            clear('table')
+            for row in rows:
+                put_row(row, scope='table')
+
+    .. versionadded:: 1.9
+    """
+    return batch_()
+
+
+class batch_:
+    def __init__(self):
+        self.session = None
+        self.outermost = False
+
+    def __enter__(self):
+        self.session = get_current_session()
+        self.outermost = self.session.start_batch()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.outermost:
+            self.session.end_batch()
+        return False  # Propagate Exception
+
+    def __call__(self, func):
+        """decorator implement"""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with batch_():
+                return func(*args, **kwargs)
+
+        @wraps(func)
+        async def coro_wrapper(*args, **kwargs):
+            with batch_():
+                return await func(*args, **kwargs)
+
+        if iscoroutinefunction(func):
+            return coro_wrapper
+        else:
+            return wrapper
+
+
+def batched(func):
+    """Decorator version of `batch()` , send the outputs of the function to browser as a whole.
+
+    .. versionadded:: 1.9
+    """
+    return batch()(func)
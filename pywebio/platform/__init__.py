@@ -141,6 +141,7 @@ Other
 --------------
 .. autofunction:: pywebio.config
 .. autofunction:: pywebio.platform.run_event_loop
+.. autofunction:: pywebio.platform.set_json_codec
 
 """
 
@@ -148,6 +149,7 @@ from .adaptor.http import run_event_loop
 from .page import config
 from .page import seo
 from .path_deploy import path_deploy_http, path_deploy
+from .utils import set_json_codec
 from .tornado import start_server
 from . import tornado
 
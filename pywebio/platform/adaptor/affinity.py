@@ -0,0 +1,384 @@
+"""
+Session affinity for the HTTP based backends deployed in multiple processes
+
+The session state of PyWebIO lives in the process memory. To run one HTTP deployment in multiple worker processes
+(for example, ``uWSGI --processes n`` ), each worker listens on a Unix socket ``<socket_dir>/<pid>.sock`` ,
+and the session id minted by a worker is prefixed with the pid of the worker. When the request of a session lands on
+another worker, it is forwarded to the owner worker over the Unix socket.
+
+The requests to create new session are handled by the worker that receives them, so a request is only forwarded to
+a worker that has minted the session id, and therefore is listening on its socket. The socket directory is created
+with mode ``0o700`` , and must only be accessible by the user running the workers, since the forwarded requests carry
+the headers and client IP as they are.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import stat
+import threading
+from typing import Dict, Optional
+
+from .http import HttpContext
+from ..utils import json_dumps
+
+logger = logging.getLogger(__name__)
+
+# The URL parameters used by HttpHandler, only these parameters are forwarded to the owner worker
+FORWARDED_URL_PARAMETERS = ('app', 'ack', 'seq', 'sse', 'session', 'file', '_pywebio_cdn')
+
+_frame_header = struct.Struct('>I')
+
+
+def _write_frame(file, data: bytes):
+    file.write(_frame_header.pack(len(data)) + data)
+    file.flush()
+
+
+def _read_frame(file) -> bytes:
+    header = file.read(_frame_header.size)
+    if len(header) < _frame_header.size:
+        raise EOFError
+    size, = _frame_header.unpack(header)
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+async def _read_frame_async(reader: asyncio.StreamReader) -> bytes:
+    size, = _frame_header.unpack(await reader.readexactly(_frame_header.size))
+    return await reader.readexactly(size)
+
+
+def _to_bytes(data) -> bytes:
+    return data.encode('utf8') if isinstance(data, str) else bytes(data)
+
+
+class _Headers(dict):
+    """Case-insensitive header dict"""
+
+    def __init__(self, headers: Dict[str, str]):
+        super().__init__((k.lower(), v) for k, v in headers.items())
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class ForwardedHttpContext(HttpContext):
+    """The context of the request forwarded from another worker
+
+    ``request_obj()`` returns a dict with ``method`` , ``headers`` , ``params`` , ``ip`` and ``backend`` keys,
+    since the request object of web framework can't be passed across processes.
+    """
+    forwarded = True
+
+    def __init__(self, request: Dict, body: bytes):
+        self.request = request
+        self.body = body
+        self.headers = _Headers(request['headers'])
+        self.backend_name = request['backend']
+
+        self.status = 200
+        self.response_headers = {}
+        self.content = b''
+        self.stream = None
+
+    def request_obj(self):
+        return self.request
+
+    def request_method(self):
+        return self.request['method']
+
+    def request_headers(self):
+        return self.headers
+
+    def request_url_parameter(self, name, default=None):
+        return self.request['params'].get(name, default)
+
+    def request_body(self):
+        return self.body
+
+    def set_header(self, name, value):
+        self.response_headers[name] = value
+
+    def set_status(self, status: int):
+        self.status = status
+
+    def set_content(self, content, json_type=False):
+        if json_type:
+            self.set_header('content-type', 'application/json')
+            content = json_dumps(content)
+        self.content = _to_bytes(content)
+
+    def set_event_stream(self, stream):
+        self.set_header('content-type', 'text/event-stream')
+        self.stream = stream
+
+    def get_response(self):
+        return self
+
+    def get_client_ip(self):
+        return self.request['ip']
+
+    def response_frame(self) -> bytes:
+        return json.dumps(dict(status=self.status, headers=self.response_headers,
+                               stream=self.stream is not None)).encode('utf8')
+
+
+class _ForwardedRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        affinity: SessionAffinity = self.server.affinity
+        try:
+            request = json.loads(_read_frame(self.rfile))
+            body = _read_frame(self.rfile)
+        except EOFError:
+            return
+
+        context = ForwardedHttpContext(request, body)
+        affinity.handler.handle_request(context)
+        try:
+            _write_frame(self.wfile, context.response_frame())
+            if context.stream is None:
+                _write_frame(self.wfile, context.content)
+                return
+            for chunk in context.stream:
+                _write_frame(self.wfile, _to_bytes(chunk))
+            _write_frame(self.wfile, b'')
+        except OSError:  # the forwarding worker closed the connection
+            pass
+        finally:
+            if context.stream is not None:
+                context.stream.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SessionAffinity:
+    """Route the requests of HttpHandler to the worker process that owns the session"""
+
+    def __init__(self, handler, socket_dir: str):
+        """
+        :param HttpHandler handler: The handler to process the forwarded requests
+        :param str socket_dir: The directory to place the Unix sockets of workers, must be shared by all workers
+        """
+        self.handler = handler
+        self.socket_dir = socket_dir
+        self._listening_pid = None  # the process that is listening on socket, the handler may be created before fork
+        self._lock = threading.Lock()
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        st = os.stat(socket_dir)
+        if st.st_uid != os.geteuid() or stat.S_IMODE(st.st_mode) & 0o077:
+            raise ValueError("The `affinity_socket_dir` %r must be owned by current user and not be accessible by "
+                             "others (mode 0o700)" % socket_dir)
+
+    @property
+    def worker_id(self) -> str:
+        return str(os.getpid())
+
+    def mint_session_id(self, client_session_id: str) -> str:
+        """Make the session id that encodes the current worker"""
+        return '%s.%s' % (self.worker_id, client_session_id)
+
+    def socket_path(self, worker_id) -> str:
+        return os.path.join(self.socket_dir, '%s.sock' % worker_id)
+
+    def route(self, context: HttpContext) -> Optional[str]:
+        """Return the owner worker id when the request should be forwarded, otherwise return None"""
+        if getattr(context, 'forwarded', False):
+            return None
+
+        sid = context.request_headers().get('webio-session-id') or context.request_url_parameter('session')
+        if not sid:
+            return None
+
+        # the new session is created by current worker. When the client resends the creation request to another
+        # worker before receiving the response, the other worker creates a session too, the client keeps the one
+        # in the response it receives, and the other one expires.
+        if sid.startswith('NEW-') or '.' not in sid:
+            return None
+
+        owner = sid.split('.', 1)[0]
+        return None if owner == self.worker_id else owner
+
+    def _prepare_socket_path(self):
+        path = self.socket_path(self.worker_id)
+        if os.path.exists(path):  # left by a dead process with the same pid
+            os.unlink(path)
+        atexit.register(lambda: os.path.exists(path) and os.unlink(path))
+        return path
+
+    def listen(self):
+        """Start to accept the forwarded requests in current process, used by `HttpHandler.handle_request()`"""
+        if self._listening_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listening_pid == os.getpid():
+                return
+            server = _UnixServer(self._prepare_socket_path(), _ForwardedRequestHandler)
+            server.affinity = self
+            threading.Thread(target=server.serve_forever, daemon=True, name='pywebio-affinity').start()
+            self._listening_pid = os.getpid()
+
+    async def listen_async(self):
+        """Start to accept the forwarded requests in current event loop,
+        used by `HttpHandler.handle_request_async()`"""
+        if self._listening_pid == os.getpid():
+            return
+        self._listening_pid = os.getpid()
+        await asyncio.start_unix_server(self._serve_async, path=self._prepare_socket_path())
+
+    async def _serve_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await _read_frame_async(reader))
+            body = await _read_frame_async(reader)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+
+        context = ForwardedHttpContext(request, body)
+        await self.handler.handle_request_async(context)
+
+        def write(data):
+            writer.write(_frame_header.pack(len(data)) + data)
+
+        try:
+            write(context.response_frame())
+            if context.stream is None:
+                write(context.content)
+            else:
+                async for chunk in context.stream:
+                    write(_to_bytes(chunk))
+                    await writer.drain()
+                write(b'')
+            await writer.drain()
+        except OSError:
+            pass
+        finally:
+            if context.stream is not None:
+                await context.stream.aclose()
+            writer.close()
+
+    @staticmethod
+    def _request_frames(context: HttpContext):
+        params = {}
+        for name in FORWARDED_URL_PARAMETERS:
+            value = context.request_url_parameter(name)
+            if value is not None:
+                params[name] = value
+        request = dict(method=context.request_method(), headers=dict(context.request_headers().items()),
+                       params=params, ip=context.get_client_ip(), backend=context.backend_name)
+        return json.dumps(request).encode('utf8'), _to_bytes(context.request_body() or b'')
+
+    @staticmethod
+    def _apply_response(context: HttpContext, response: Dict):
+        context.set_status(response['status'])
+        for name, value in response['headers'].items():
+            context.set_header(name, value)
+
+    def _unreachable(self, owner, e):
+        logger.warning('Unable to forward request to worker %s: %s', owner, e)
+        if isinstance(e, ConnectionRefusedError):  # the owner worker is dead
+            try:
+                os.unlink(self.socket_path(owner))
+            except OSError:
+                pass
+
+    def forward(self, context: HttpContext, owner: str) -> bool:
+        """Forward the request to the owner worker and write the response to ``context`` .
+
+        :return: Whether the request is forwarded. Return ``False`` when the owner worker is unreachable.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path(owner))
+        except OSError as e:
+            sock.close()
+            self._unreachable(owner, e)
+            return False
+
+        file = sock.makefile('rwb')
+        try:
+            for frame in self._request_frames(context):
+                _write_frame(file, frame)
+            response = json.loads(_read_frame(file))
+            self._apply_response(context, response)
+        except BaseException:
+            file.close()
+            sock.close()
+            raise
+
+        if not response['stream']:
+            try:
+                context.set_content(_read_frame(file))
+            finally:
+                file.close()
+                sock.close()
+            return True
+
+        def stream():
+            try:
+                while True:
+                    chunk = _read_frame(file)
+                    if not chunk:
+                        return
+                    yield chunk
+            except (EOFError, OSError):
+                pass
+            finally:
+                file.close()
+                sock.close()
+
+        context.set_event_stream(stream())
+        return True
+
+    async def forward_async(self, context: HttpContext, owner: str) -> bool:
+        """Asynchronous version of `forward()`"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path(owner))
+        except OSError as e:
+            self._unreachable(owner, e)
+            return False
+
+        try:
+            for frame in self._request_frames(context):
+                writer.write(_frame_header.pack(len(frame)) + frame)
+            response = json.loads(await _read_frame_async(reader))
+            self._apply_response(context, response)
+        except BaseException:
+            writer.close()
+            raise
+
+        if not response['stream']:
+            try:
+                context.set_content(await _read_frame_async(reader))
+            finally:
+                writer.close()
+            return True
+
+        async def stream():
+            try:
+                while True:
+                    chunk = await _read_frame_async(reader)
+                    if not chunk:
+                        return
+                    yield chunk
+            except (asyncio.IncompleteReadError, OSError):
+                pass
+            finally:
+                writer.close()
+
+        context.set_event_stream(stream())
+        return True
@@ -2,15 +2,20 @@
 本模块提供基于Http轮训的后端通用类和函数
 
 .. attention::
-    PyWebIO 的会话状态保存在进程内，基于HTTP的会话不支持多进程部署的后端服务
+    PyWebIO 的会话状态保存在进程内，基于HTTP的会话默认不支持多进程部署的后端服务
     比如使用 ``uWSGI`` 部署后端服务，并使用 ``--processes n`` 选项设置了多进程；
     或者使用 ``nginx`` 等反向代理将流量负载到多个后端副本上。
 
+    在同一主机上的多进程部署可以使用 ``affinity_socket_dir`` 参数开启会话亲和，
+    落到非会话所属进程的请求会通过 Unix socket 转发给会话所属进程。
+    见 :mod:`pywebio.platform.adaptor.affinity`
+
 """
 import asyncio
 import fnmatch
-import json
+import heapq
 import logging
+import os
 import threading
 import time
 from contextlib import contextmanager
@@ -18,10 +23,11 @@ from typing import Dict, Optional, List
 from collections import deque
 
 from ..page import make_applications, render_page
-from ..utils import deserialize_binary_event
-from ...session import CoroutineBasedSession, ThreadBasedSession, register_session_implement_for_target
+from ..utils import deserialize_binary_event, json_dumps, json_loads, prepare_file_response, event_loop_factory
+from ...session import CoroutineBasedSession, ProcessBasedSession, ThreadBasedSession, \
+    register_session_implement_for_target
 from ...session.base import get_session_info_from_headers, Session
-from ...utils import random_str, LRUDict, isgeneratorfunction, iscoroutinefunction, check_webio_js
+from ...utils import random_str, isgeneratorfunction, iscoroutinefunction, check_webio_js
 
 
 class HttpContext:
@@ -78,6 +84,28 @@ class HttpContext:
         """
         pass
 
+    def set_event_stream(self, stream):
+        """Set the response to a ``text/event-stream`` streaming response. Used in Server-Sent Events transport.
+
+        :param stream: An iterator of str chunks when the request is handled by `HttpHandler.handle_request()`,
+            or an async iterator when handled by `HttpHandler.handle_request_async()`.
+
+        The backends that don't support streaming response don't need to implement this method.
+        """
+        raise NotImplementedError
+
+    def set_file(self, file, length):
+        """Set the response content to the ``length`` bytes from the current position of the binary file object.
+        The file should be closed after the response is sent.
+
+        The default implementation reads the content in memory,
+        the backends that support streaming response can override this method.
+        """
+        try:
+            self.set_content(file.read(length))
+        finally:
+            file.close()
+
     def get_response(self):
         """获取当前的响应对象，用于在视图函数中返回
         Get the current response object"""
@@ -94,12 +122,25 @@ _event_loop = None
 
 
 class ReliableTransport:
-    def __init__(self, session: Session, message_window: int = 4):
+    def __init__(self, session: Session = None, message_window: int = 4, history_size: int = 0):
+        """
+        :param session: The session this transport serves, can be attached later by setting ``transport.session``.
+            Use `ReliableTransport.notify` as the ``on_task_command`` of the session to wake up the waiting requests.
+        :param message_window: Max message count in the window that the client haven't acknowledged
+        :param history_size: Max count of the messages kept after they are acknowledged.
+            Streaming transport treats the messages as acknowledged once they are written,
+            the history is used to resend them when the stream is dropped before the client receive them.
+        """
         self.session = session
         self.messages = deque()
         self.window_size = message_window
         self.min_msg_id = 0  # the id of the first message in the window
         self.finished_event_id = -1  # the id of the last finished event
+        self.history = deque(maxlen=history_size)  # the latest acknowledged messages, the last one's id is min_msg_id-1
+        self.stream_cnt = 0  # the count of event streams attached to this transport
+
+        self._lock = threading.Lock()  # protect `messages` and `min_msg_id`, requests may be handled in threads
+        self._waiters = []  # callbacks to wake up the requests waiting for new commands
 
     @staticmethod
     def close_message(ack):
@@ -122,13 +163,11 @@ class ReliableTransport:
 
         return submit_cnt
 
-    def get_response(self, ack=0):
-        """
-        ack num is the number of messages that the client has received.
-        response is a list of messages that the client should receive, along with their min id `seq`.
-        """
+    def _update_window(self, ack):
+        """Drop the acknowledged messages and move the new commands of session into the window.
+        Must be called with `self._lock` held"""
         while ack >= self.min_msg_id and self.messages:
-            self.messages.popleft()
+            self.history.append(self.messages.popleft())
             self.min_msg_id += 1
 
         if len(self.messages) < self.window_size:
@@ -136,11 +175,199 @@ class ReliableTransport:
             if msgs:
                 self.messages.append(msgs)
 
-        return dict(
-            commands=list(self.messages),
-            seq=self.min_msg_id,
-            ack=self.finished_event_id
-        )
+    def get_response(self, ack=0):
+        """
+        ack num is the number of messages that the client has received.
+        response is a list of messages that the client should receive, along with their min id `seq`.
+        """
+        with self._lock:
+            self._update_window(ack)
+            return dict(
+                commands=list(self.messages),
+                seq=self.min_msg_id,
+                ack=self.finished_event_id
+            )
+
+    def get_stream_messages(self, last_id):
+        """Get all the messages after ``last_id`` for a streaming client, and treat them as acknowledged.
+
+        :return: list of messages, the id of the first one is ``last_id + 1``.
+            ``None`` if some messages after ``last_id`` are not in history anymore.
+        """
+        with self._lock:
+            self._update_window(last_id)
+            first_history_id = self.min_msg_id - len(self.history)
+            if last_id + 1 < first_history_id:
+                return None
+
+            msgs = list(self.history)[last_id + 1 - first_history_id:]
+            while self.messages:
+                msgs.extend(self.messages)
+                self._update_window(self.min_msg_id + len(self.messages) - 1)
+            return msgs
+
+    def has_unacked_messages(self, ack) -> bool:
+        """Whether there are messages that the client with ``ack`` haven't received"""
+        with self._lock:
+            self._update_window(ack)
+            return bool(self.messages)
+
+    def notify(self, session=None):
+        """Wake up all the requests waiting for new commands.
+        Called by session when there are new commands, may be called in any thread"""
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter()
+
+    def _add_waiter(self, waiter):
+        with self._lock:
+            self._waiters.append(waiter)
+
+    def _remove_waiter(self, waiter):
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def wait_new_commands(self, ack, timeout, linger=0):
+        """Block until there are messages the client haven't received, or ``timeout`` seconds elapsed
+
+        :param float linger: After new commands arrive, keep waiting until there are no more commands within
+            ``linger`` seconds, so the commands produced in a burst can be sent in one response.
+            The total waiting time is still bounded by ``timeout``.
+        """
+        deadline = time.monotonic() + timeout
+        event = threading.Event()
+        self._add_waiter(event.set)
+        # register waiter before checking, so that the notification after the check won't be lost
+        notified = self.has_unacked_messages(ack) or event.wait(timeout)
+        self._remove_waiter(event.set)
+
+        while notified and linger:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = threading.Event()
+            self._add_waiter(event.set)
+            notified = event.wait(min(linger, remaining))
+            self._remove_waiter(event.set)
+
+    async def wait_new_commands_async(self, ack, timeout, linger=0):
+        """Coroutine version of `ReliableTransport.wait_new_commands()`"""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        def add_waiter():
+            future = loop.create_future()
+
+            def wakeup():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            self._add_waiter(wakeup)
+            return future, wakeup
+
+        future, wakeup = add_waiter()
+        notified = self.has_unacked_messages(ack)
+        if not notified:
+            await asyncio.wait([future], timeout=timeout)
+            notified = future.done()
+        self._remove_waiter(wakeup)
+
+        while notified and linger:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            future, wakeup = add_waiter()
+            await asyncio.wait([future], timeout=min(linger, remaining))
+            notified = future.done()
+            self._remove_waiter(wakeup)
+
+
+class SessionExpiryScheduler:
+    """Remove the expired sessions in a background thread
+
+    The scheduler keeps a min-heap of ``(deadline, session_id)``. The request handlers only need to refresh the
+    last active time of session in ``last_active`` dict, when a deadline is reached, the scheduler checks the last
+    active time of the session and pushes the session back to heap with a new deadline if it has been active.
+    """
+
+    def __init__(self, last_active: Dict[str, float], on_expire, cleanup_interval):
+        """
+        :param last_active: WebIOSessionID -> last active timestamp
+        :param on_expire: the callback to remove the expired session, receives the session id
+            and the event loop passed to `add()`
+        :param cleanup_interval: the minimal interval in seconds between two cleanings
+        """
+        self.last_active = last_active
+        self.on_expire = on_expire
+        self.cleanup_interval = cleanup_interval
+        self.expired_total = 0  # count of the sessions removed due to expiration
+
+        self._heap = []  # (deadline, session_id, expire_seconds, event_loop)
+        self._cond = threading.Condition()
+        self._last_clean_ts = 0
+        self._pid = None
+        self._ensure_running()
+
+    def _ensure_running(self):
+        # the scheduler may be created before the server forks worker processes, and threads don't survive fork
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._heap = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True, name='pywebio-session-expiry').start()
+
+    def add(self, sid, expire_seconds, loop=None):
+        """Start tracking the expiration of a new session
+
+        :param loop: the event loop the session runs in, the session will be closed in this loop
+        """
+        self._ensure_running()
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + expire_seconds, sid, expire_seconds, loop))
+            if self._heap[0][1] == sid:  # the earliest deadline changed
+                self._cond.notify()
+
+    def _next_wakeup(self):
+        if not self._heap:
+            return None
+        return max(self._heap[0][0], self._last_clean_ts + self.cleanup_interval)
+
+    def _pop_expired(self):
+        """Pop the expired sessions from heap, must be called with `self._cond` held"""
+        now = time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, sid, expire_seconds, loop = heapq.heappop(self._heap)
+            active_ts = self.last_active.get(sid)
+            if active_ts is None:  # session has been removed
+                continue
+            if active_ts + expire_seconds > now:  # the session was active after the deadline was set
+                heapq.heappush(self._heap, (active_ts + expire_seconds, sid, expire_seconds, loop))
+            else:
+                expired.append((sid, loop))
+        return expired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    wakeup = self._next_wakeup()
+                    if wakeup is not None and wakeup <= time.time():
+                        break
+                    self._cond.wait(None if wakeup is None else wakeup - time.time())
+                expired = self._pop_expired()
+                self._last_clean_ts = time.time()
+
+            if expired:
+                logger.debug("removing %d expired sessions", len(expired))
+            for sid, loop in expired:
+                try:
+                    self.on_expire(sid, loop)
+                except Exception:
+                    logger.exception('Error when removing expired session %s', sid)
+                self.expired_total += 1
 
 
 # todo: use lock to avoid thread race condition
@@ -154,42 +381,55 @@ class HttpHandler:
     """
     _webio_sessions = {}  # WebIOSessionID -> WebIOSession()
     _webio_transports = {}  # WebIOSessionID -> ReliableTransport(), type: Dict[str, ReliableTransport]
-    _webio_expire = LRUDict()  # WebIOSessionID -> last active timestamp. In increasing order of last active time
-    _webio_expire_lock = threading.Lock()
+    _webio_expire = {}  # WebIOSessionID -> last active timestamp
+    _expiry_scheduler = None  # type: SessionExpiryScheduler
+    _expiry_scheduler_lock = threading.Lock()
 
-    _last_check_session_expire_ts = 0  # Timestamp of the last check session validation
-
-    # After processing the POST request, wait for WAIT_MS_ON_POST milliseconds before generate response
+    # After processing the POST request, wait for the session to produce output before generate response.
+    # The response is sent once the session has produced output and then been idle for COALESCE_MS_ON_POST
+    # milliseconds, or WAIT_MS_ON_POST milliseconds elapsed.
     WAIT_MS_ON_POST = 100
+    COALESCE_MS_ON_POST = 5
+
+    # Interval to send keep-alive comment in Server-Sent Events stream, the expiration time of session is also
+    # refreshed at this interval
+    EVENT_STREAM_KEEPALIVE_SECONDS = 15
+    # The count of written messages kept for resuming a dropped event stream
+    EVENT_STREAM_HISTORY_SIZE = 16
 
     DEFAULT_SESSION_EXPIRE_SECONDS = 600  # Default session expiration time
     DEFAULT_SESSIONS_CLEANUP_INTERVAL = 300  # Default interval for clearing expired sessions (in seconds)
 
-    @classmethod
-    def _remove_expired_sessions(cls, session_expire_seconds):
-        """清除当前会话列表中的过期会话"""
-        logger.debug("removing expired sessions")
-        while cls._webio_expire:
-            sid, active_ts = cls._webio_expire.popitem(last=False)  # 弹出最不活跃的session info
-
-            if time.time() - active_ts < session_expire_seconds:
-                # this session is not expired
-                cls._webio_expire[sid] = active_ts
-                cls._webio_expire.move_to_end(sid, last=False)
-                break
+    @property
+    def active_sessions(self) -> int:
+        """Count of the current alive sessions"""
+        return len(type(self)._webio_sessions)
 
-            # clean this session
-            logger.debug("session %s expired" % sid)
-            session = cls._webio_sessions.get(sid)
-            if session:
-                session.close(nonblock=True)
-                del cls._webio_sessions[sid]
-                del cls._webio_transports[sid]
+    @property
+    def expired_total(self) -> int:
+        """Count of the sessions removed due to expiration since the server started"""
+        return type(self)._expiry_scheduler.expired_total
+
+    @classmethod
+    def _remove_expired_session(cls, sid, loop=None):
+        """清除过期会话. Called in the thread of session expiry scheduler"""
+        logger.debug("session %s expired" % sid)
+        session = cls._webio_sessions.get(sid)
+        cls._remove_webio_session(sid)
+        if session is None:
+            return
+        if loop is not None:  # coroutine based session need to be closed in its event loop
+            loop.call_soon_threadsafe(session.close, True)
+        else:
+            session.close(nonblock=True)
 
     @classmethod
     def _remove_webio_session(cls, sid):
         cls._webio_sessions.pop(sid, None)
         cls._webio_expire.pop(sid, None)
+        transport = cls._webio_transports.pop(sid, None)
+        if transport:
+            transport.notify()  # release the pending long polling requests
 
     def _process_cors(self, context: HttpContext):
         """Handling cross-domain requests: check the source of the request and set headers"""
@@ -201,40 +441,150 @@ class HttpHandler:
             context.set_header('Access-Control-Expose-Headers', 'webio-session-id')
             context.set_header('Access-Control-Max-Age', str(1440 * 60))
 
-    def interval_cleaning(self):
-        # clean up at intervals
-        cls = type(self)
-        need_clean = False
+    def handle_request(self, context: HttpContext):
+        if self.affinity is not None:
+            self.affinity.listen()
+            owner = self.affinity.route(context)
+            if owner is not None and self.affinity.forward(context, owner):
+                return context.get_response()
 
-        if time.time() - cls._last_check_session_expire_ts > self.session_cleanup_interval:
-            with cls._webio_expire_lock:
-                if time.time() - cls._last_check_session_expire_ts > self.session_cleanup_interval:
-                    cls._last_check_session_expire_ts = time.time()
-                    need_clean = True
+        if context.request_url_parameter('file'):
+            return self._serve_file(context)
 
-        if need_clean:
-            cls._remove_expired_sessions(self.session_expire_seconds)
+        if self.server_sent_events and context.request_url_parameter('sse'):
+            transport = self._prepare_event_stream(context)
+            if transport:
+                sid, last_id = self._event_stream_args(context)
+                context.set_event_stream(self._event_stream(sid, transport, last_id))
+            return context.get_response()
 
-    def handle_request(self, context: HttpContext):
         try:
-            with self.handle_request_context(context) as sleep_dur:
-                if sleep_dur:
-                    time.sleep(sleep_dur)
+            with self.handle_request_context(context) as (transport, wait_args):
+                transport.wait_new_commands(**wait_args)
         except RuntimeError:
             pass
 
         return context.get_response()
 
     async def handle_request_async(self, context: HttpContext):
+        if self.affinity is not None:
+            await self.affinity.listen_async()
+            owner = self.affinity.route(context)
+            if owner is not None and await self.affinity.forward_async(context, owner):
+                return context.get_response()
+
+        if context.request_url_parameter('file'):
+            return self._serve_file(context)
+
+        if self.server_sent_events and context.request_url_parameter('sse'):
+            transport = self._prepare_event_stream(context)
+            if transport:
+                sid, last_id = self._event_stream_args(context)
+                context.set_event_stream(self._event_stream_async(sid, transport, last_id))
+            return context.get_response()
+
         try:
-            with self.handle_request_context(context) as sleep_dur:
-                if sleep_dur:
-                    await asyncio.sleep(sleep_dur)
+            with self.handle_request_context(context) as (transport, wait_args):
+                await transport.wait_new_commands_async(**wait_args)
         except RuntimeError:
             pass
 
         return context.get_response()
 
+    @staticmethod
+    def _serve_file(context: HttpContext):
+        """Serve the file in file store, see :mod:`pywebio.session.file_store`"""
+        status, headers, file, start, length = prepare_file_response(context.request_url_parameter('file'),
+                                                                     context.request_headers())
+        context.set_status(status)
+        for name, value in headers.items():
+            context.set_header(name, value)
+        if file is not None:
+            context.set_file(file.open(start), length)
+        return context.get_response()
+
+    def _prepare_event_stream(self, context: HttpContext) -> Optional[ReliableTransport]:
+        """Check the Server-Sent Events request and set the response headers.
+
+        :return: the transport of the session. ``None`` if the request is invalid, and the response has been set.
+        """
+        if _event_loop:
+            asyncio.set_event_loop(_event_loop)
+
+        if context.request_headers().get('Origin'):
+            self._process_cors(context)
+
+        sid = context.request_url_parameter('session', '')
+        transport = type(self)._webio_transports.get(sid)
+        if context.request_method() != 'GET' or transport is None:
+            context.set_status(404)  # EventSource won't reconnect on non-200 response
+            return None
+
+        context.set_header('Cache-Control', 'no-cache')
+        context.set_header('X-Accel-Buffering', 'no')  # disable response buffering in nginx
+        return transport
+
+    @staticmethod
+    def _event_stream_args(context: HttpContext):
+        # when EventSource reconnects, the browser sends the last received event id in `Last-Event-ID` header
+        last_id = context.request_headers().get('Last-Event-ID') or context.request_url_parameter('ack', -1)
+        return context.request_url_parameter('session'), int(last_id)
+
+    def _event_stream_chunk(self, sid, transport: ReliableTransport, last_id):
+        """Make the Server-Sent Events data of the new messages of the stream
+
+        :return: ``(chunk, last_id, finished)``
+        """
+        cls = type(self)
+        msgs = transport.get_stream_messages(last_id)
+        if msgs is None:  # the messages can't be resumed
+            return 'data: %s\n\n' % json_dumps(ReliableTransport.close_message(last_id)), last_id, True
+
+        if not msgs:
+            chunk = ': keepalive\n\n'
+        else:
+            seq = last_id + 1
+            last_id += len(msgs)
+            chunk = 'id: %s\ndata: %s\n\n' % (last_id, json_dumps(dict(commands=msgs, seq=seq)))
+
+        session = cls._webio_sessions.get(sid)
+        if session is None or session.closed():
+            self._remove_webio_session(sid)
+            return chunk, last_id, True
+
+        cls._webio_expire[sid] = time.time()
+        return chunk, last_id, False
+
+    def _event_stream(self, sid, transport: ReliableTransport, last_id):
+        transport.stream_cnt += 1
+        try:
+            while True:
+                chunk, last_id, finished = self._event_stream_chunk(sid, transport, last_id)
+                yield chunk
+                if finished:
+                    return
+                transport.wait_new_commands(last_id, self.EVENT_STREAM_KEEPALIVE_SECONDS,
+                                            linger=self.COALESCE_MS_ON_POST / 1000.0)
+        finally:
+            transport.stream_cnt -= 1
+
+    async def _event_stream_async(self, sid, transport: ReliableTransport, last_id):
+        transport.stream_cnt += 1
+        try:
+            while True:
+                chunk, last_id, finished = self._event_stream_chunk(sid, transport, last_id)
+                yield chunk
+                if finished:
+                    return
+                await transport.wait_new_commands_async(last_id, self.EVENT_STREAM_KEEPALIVE_SECONDS,
+                                                        linger=self.COALESCE_MS_ON_POST / 1000.0)
+        finally:
+            transport.stream_cnt -= 1
+
+    def _post_wait_args(self, ack):
+        cls = type(self)
+        return dict(ack=ack, timeout=cls.WAIT_MS_ON_POST / 1000.0, linger=cls.COALESCE_MS_ON_POST / 1000.0)
+
     def get_cdn(self, context):
         if self.cdn is True and context.request_url_parameter('_pywebio_cdn', '') == 'false':
             return False
@@ -244,13 +594,17 @@ class HttpHandler:
         try:
             if context.request_headers().get('content-type') == 'application/octet-stream':
                 return [deserialize_binary_event(context.request_body())]
-            return json.loads(context.request_body())
+            return json_loads(context.request_body())
         except Exception:
             return []
 
     @contextmanager
     def handle_request_context(self, context: HttpContext):
-        """called when every http request"""
+        """called when every http request
+
+        The context yields a ``(transport, wait_args)`` tuple when the request need to wait before generating
+        response, the caller should wait by ``transport.wait_new_commands(**wait_args)``.
+        """
         cls = type(self)
 
         if _event_loop:
@@ -275,16 +629,21 @@ class HttpHandler:
         # 对首页HTML的请求
         if 'webio-session-id' not in request_headers:
             app = self.app_loader(context)
-            html = render_page(app, protocol='http', cdn=self.get_cdn(context))
+            html = render_page(app, protocol='http', cdn=self.get_cdn(context),
+                               language=request_headers.get('Accept-Language', ''))
             context.set_content(html)
             return context.get_response()
 
         ack = int(context.request_url_parameter('ack', 0))
         webio_session_id = request_headers['webio-session-id']
         new_request = False
+        new_session_created = False
         if webio_session_id.startswith('NEW-'):
             new_request = True
             webio_session_id = webio_session_id[4:]
+            if self.affinity is not None:
+                webio_session_id = self.affinity.mint_session_id(webio_session_id)
+                context.set_header('webio-session-id', webio_session_id)  # client will use the minted id
 
         if new_request and webio_session_id not in cls._webio_sessions:  # 初始请求，创建新 Session
             if context.request_method() == 'POST':  # 不能在POST请求中创建Session，防止CSRF攻击
@@ -301,12 +660,19 @@ class HttpHandler:
 
             if iscoroutinefunction(application) or isgeneratorfunction(application):
                 session_cls = CoroutineBasedSession
+            elif ProcessBasedSession.accepts(application):
+                session_cls = ProcessBasedSession
             else:
                 session_cls = ThreadBasedSession
-            webio_session = session_cls(application, session_info=session_info)
+            transport = ReliableTransport(history_size=cls.EVENT_STREAM_HISTORY_SIZE if self.server_sent_events else 0)
+            webio_session = session_cls(application, session_info=session_info, on_task_command=transport.notify)
+            transport.session = webio_session
             cls._webio_sessions[webio_session_id] = webio_session
-            cls._webio_transports[webio_session_id] = ReliableTransport(webio_session)
-            yield cls.WAIT_MS_ON_POST / 1000.0  # <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <---
+            cls._webio_transports[webio_session_id] = transport
+            cls._webio_expire[webio_session_id] = time.time()
+            loop = asyncio.get_event_loop() if session_cls is CoroutineBasedSession else None
+            cls._expiry_scheduler.add(webio_session_id, self.session_expire_seconds, loop)
+            new_session_created = True
         elif webio_session_id not in cls._webio_sessions:  # WebIOSession deleted
             close_msg = ReliableTransport.close_message(ack)
             context.set_content(close_msg, json_type=True)
@@ -316,21 +682,33 @@ class HttpHandler:
             # this is because the response for the previous new session request has not been received by the client,
             # and the client has sent a new request with the same session id.
             webio_session = cls._webio_sessions[webio_session_id]
+            transport = cls._webio_transports[webio_session_id]
 
-        if context.request_method() == 'POST':  # client push event
+        if new_session_created:
+            # wait for the first output of the new session
+            yield transport, self._post_wait_args(ack)  # <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <---
+        elif context.request_method() == 'POST':  # client push event
             seq = int(context.request_url_parameter('seq', 0))
             event_data = self.read_event_data(context)
-            submit_cnt = cls._webio_transports[webio_session_id].push_event(event_data, seq)
-            if submit_cnt > 0:
-                yield type(self).WAIT_MS_ON_POST / 1000.0  # <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <---
-        elif context.request_method() == 'GET':  # client pull messages
-            pass
+            submit_cnt = transport.push_event(event_data, seq)
+            if submit_cnt > 0 and not transport.stream_cnt:  # the output will be pushed by event stream if attached
+                # wait for the session to respond the events, so the output can be sent in this response
+                yield transport, self._post_wait_args(ack)  # <--- <--- <--- <--- <--- <--- <--- <--- <--- <--- <---
+        elif context.request_method() == 'GET' and self.long_poll_timeout:  # client pull messages
+            # long polling: hold the request until there are new messages or timeout
+            cls._webio_expire[webio_session_id] = time.time()
+            yield transport, dict(ack=ack, timeout=self.long_poll_timeout)  # <--- <--- <--- <--- <--- <--- <---
+            if webio_session_id not in cls._webio_sessions:  # session expired during waiting
+                context.set_content(ReliableTransport.close_message(ack), json_type=True)
+                return context.get_response()
 
         cls._webio_expire[webio_session_id] = time.time()
 
-        self.interval_cleaning()
-
-        resp = cls._webio_transports[webio_session_id].get_response(ack)
+        resp = transport.get_response(ack)
+        if self.long_poll_timeout:
+            resp['long_poll'] = True  # tell client to send next pull request immediately after receiving response
+        if self.server_sent_events:
+            resp['sse'] = True  # tell client to receive messages via Server-Sent Events
         context.set_content(resp, json_type=True)
 
         if webio_session.closed():
@@ -342,12 +720,19 @@ class HttpHandler:
                  cdn=True,
                  session_expire_seconds=None,
                  session_cleanup_interval=None,
-                 allowed_origins=None, check_origin=None):
+                 allowed_origins=None, check_origin=None,
+                 long_poll_timeout=0, server_sent_events=False,
+                 affinity_socket_dir=None):
         """Get the view function for running PyWebIO applications in Web framework.
         The view communicates with the client by HTTP protocol.
 
         :param callable app_loader: PyWebIO app factory, which receives the HttpContext instance as the parameter.
             Can not use `app_loader` and `applications` at the same time.
+        :param int long_poll_timeout: The max seconds to hold a pull request of client when there is no new message.
+            Set to ``0`` (default) to disable long polling, then the client pulls messages at fixed interval.
+        :param bool server_sent_events: Whether to push messages to client via Server-Sent Events stream.
+        :param str affinity_socket_dir: Enable session affinity for multi-process deployment and set the directory
+            to place the Unix sockets of worker processes. See :mod:`pywebio.platform.adaptor.affinity`
 
         The rest arguments of the constructor have the same meaning as for :func:`pywebio.platform.flask.start_server()`
         """
@@ -359,6 +744,20 @@ class HttpHandler:
         self.check_origin = check_origin
         self.session_expire_seconds = session_expire_seconds or cls.DEFAULT_SESSION_EXPIRE_SECONDS
         self.session_cleanup_interval = session_cleanup_interval or cls.DEFAULT_SESSIONS_CLEANUP_INTERVAL
+        self.long_poll_timeout = long_poll_timeout or 0
+        self.server_sent_events = server_sent_events
+        self.affinity = None
+        if affinity_socket_dir:
+            from .affinity import SessionAffinity
+            self.affinity = SessionAffinity(self, affinity_socket_dir)
+
+        with cls._expiry_scheduler_lock:
+            if cls._expiry_scheduler is None:
+                cls._expiry_scheduler = SessionExpiryScheduler(cls._webio_expire, cls._remove_expired_session,
+                                                               self.session_cleanup_interval)
+            else:
+                cls._expiry_scheduler.cleanup_interval = min(cls._expiry_scheduler.cleanup_interval,
+                                                             self.session_cleanup_interval)
 
         assert applications is not None or app_loader is not None
         if applications is not None:
@@ -380,17 +779,19 @@ class HttpHandler:
             )
 
 
-def run_event_loop(debug=False):
+def run_event_loop(debug=False, loop='asyncio'):
     """run asyncio event loop
 
     See also: :ref:`Integration coroutine-based session with Web framework <coroutine_web_integration>`
 
     :param debug: Set the debug mode of the event loop.
        See also: https://docs.python.org/3/library/asyncio-dev.html#asyncio-debug-mode
+    :param str loop: The event loop implementation, ``'asyncio'`` or ``'uvloop'`` .
+       See the ``loop`` parameter of :func:`pywebio.platform.tornado.start_server`
     """
     global _event_loop
     CoroutineBasedSession.event_loop_thread_id = threading.current_thread().ident
-    _event_loop = asyncio.new_event_loop()
+    _event_loop = (event_loop_factory(loop) or asyncio.new_event_loop)()
     _event_loop.set_debug(debug)
     asyncio.set_event_loop(_event_loop)
     _event_loop.run_forever()
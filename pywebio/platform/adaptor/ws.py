@@ -1,14 +1,14 @@
 import abc
 import asyncio
-import json
 import logging
-import time
 import typing
-from typing import Dict, Optional
+from collections import deque
+from typing import Dict, List, Optional
 
-from ...session import CoroutineBasedSession, Session, ThreadBasedSession
-from ...utils import LRUDict, iscoroutinefunction, isgeneratorfunction, random_str
-from ..utils import deserialize_binary_event
+from ...session import CoroutineBasedSession, ProcessBasedSession, Session, ThreadBasedSession
+from ...utils import iscoroutinefunction, isgeneratorfunction, random_str, approx_size
+from ..utils import deserialize_binary_event, json_loads, msgpack_available, msgpack_dumps, backpressure_options, \
+    reconnect_buffer_options, worker_id_prefix
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 # used to store global state when reconnect enabled
 class _reconnect_state:
     # used to clean up session
-    detached_sessions = LRUDict()  # session_id -> detached timestamp. In increasing order of the time
+    detached_sessions: Dict[str, asyncio.TimerHandle] = {}  # session_id -> the timer to expire the session
 
     # unclosed and unexpired session
     # used to clean up session
@@ -29,6 +29,9 @@ class _reconnect_state:
     # used to get the active conn in session's callbacks
     active_connections: Dict[str, 'WebSocketConnection'] = {}  # session_id -> WSHandler
 
+    # the latest messages sent to client, used to resend the messages lost in the dropped connection
+    replay_buffers: Dict[str, 'ReplayBuffer'] = {}  # session_id -> ReplayBuffer
+
     expire_second = 0
 
 
@@ -36,45 +39,102 @@ def set_expire_second(sec):
     _reconnect_state.expire_second = max(_reconnect_state.expire_second, sec)
 
 
-def clean_expired_sessions():
-    while _reconnect_state.detached_sessions:
-        session_id, detached_ts = _reconnect_state.detached_sessions.popitem(last=False)  # 弹出最早过期的session
+def detached_session_count() -> int:
+    """The number of sessions which are waiting for the client to reconnect"""
+    return len(_reconnect_state.detached_sessions)
 
-        if time.time() < detached_ts + _reconnect_state.expire_second:
-            # this session is not expired
-            _reconnect_state.detached_sessions[session_id] = detached_ts  # restore
-            _reconnect_state.detached_sessions.move_to_end(session_id, last=False)  # move to head
-            break
 
-        # clean this session
-        logger.debug("session %s expired" % session_id)
-        _reconnect_state.active_connections.pop(session_id, None)
-        _reconnect_state.session_will_messages.pop(session_id, None)
-        session = _reconnect_state.unclosed_sessions.pop(session_id, None)
-        if session:
-            session.close(nonblock=True)
+def expire_session(session_id):
+    """Clean up the detached session when the client doesn't reconnect in time"""
+    _reconnect_state.detached_sessions.pop(session_id, None)
+    logger.debug("session %s expired" % session_id)
+    _reconnect_state.active_connections.pop(session_id, None)
+    _reconnect_state.session_will_messages.pop(session_id, None)
+    _reconnect_state.replay_buffers.pop(session_id, None)
+    session = _reconnect_state.unclosed_sessions.pop(session_id, None)
+    if session:
+        session.close(nonblock=True)
 
 
-_session_clean_task_started = False
+def _attach_session(session_id):
+    timer = _reconnect_state.detached_sessions.pop(session_id, None)
+    if timer is not None:
+        timer.cancel()
 
 
-async def session_clean_task():
-    global _session_clean_task_started
-    if _session_clean_task_started or not _reconnect_state.expire_second:
-        return
+class ReplayBuffer:
+    """Number the messages sent to client and keep the latest ones
 
-    _session_clean_task_started = True
-    logger.debug("Start session cleaning task")
-    while True:
-        try:
-            clean_expired_sessions()
-        except Exception:
-            logger.exception("Error when clean expired sessions")
+    Each message is marked with an increasing ``seq`` field. When the client reconnects,
+    it sends back the ``seq`` of the last message it received, and the messages after it are resent.
+
+    The oldest messages are evicted when there are more than ``max_messages`` messages or ``max_bytes`` bytes
+    in buffer. The chunks of `download() <pywebio.session.download>` are not kept, since they are large and can't
+    be sent again, a marker is kept instead to tell the client that the download is interrupted.
+    """
 
-        await asyncio.sleep(_reconnect_state.expire_second // 2)
+    def __init__(self, max_messages=1000, max_bytes=4 * 1024 * 1024):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = deque()
+        self.sizes = deque()  # the approximate size of each message in buffer
+        self.total_bytes = 0
+        self.next_seq = 0
+
+    @staticmethod
+    def _replay_message(msg: dict) -> dict:
+        spec = msg.get('spec')
+        if msg['command'] == 'download' and isinstance(spec, dict) and 'id' in spec:  # the chunk of download
+            return dict(command='download', seq=msg['seq'], spec=dict(id=spec['id'], name=spec['name'], aborted=True))
+        return msg
+
+    def record(self, msgs: List[dict]) -> List[dict]:
+        for msg in msgs:
+            msg['seq'] = self.next_seq
+            self.next_seq += 1
+            msg = self._replay_message(msg)
+            size = approx_size(msg)
+            self.messages.append(msg)
+            self.sizes.append(size)
+            self.total_bytes += size
+        while self.messages and (len(self.messages) > self.max_messages or self.total_bytes > self.max_bytes):
+            self.messages.popleft()
+            self.total_bytes -= self.sizes.popleft()
+        return msgs
+
+    def since(self, seq: int) -> Optional[List[dict]]:
+        """Return the messages after ``seq``, ``None`` if some of them are not in buffer anymore"""
+        first_seq = self.next_seq - len(self.messages)
+        if seq + 1 < first_seq:
+            return None
+        return list(self.messages)[max(seq + 1 - first_seq, 0):]
 
 
 class WebSocketConnection(abc.ABC):
+    # Whether to send messages in MessagePack binary frames, negotiated by the `protocol` query argument
+    msgpack = False
+
+    # The size of the messages which are handed to the transport but not written to socket yet, in bytes
+    buffered_bytes = 0
+    max_buffered_bytes = 0
+    # Called when a buffered message is written to socket
+    on_buffer_drain: typing.Optional[typing.Callable[[], None]] = None
+
+    def _track_buffer(self, size: int, future):
+        """Count the message of ``size`` bytes in ``buffered_bytes`` until the ``future`` of sending it is done.
+        Used by the implementations of ``write_message()``"""
+        self.buffered_bytes += size
+        self.max_buffered_bytes = max(self.max_buffered_bytes, self.buffered_bytes)
+
+        def done(future):
+            self.buffered_bytes -= size
+            if not future.cancelled() and future.exception() is not None:  # mostly because the connection closed
+                logger.debug("Error in sending message via websocket: %r", future.exception())
+            if self.on_buffer_drain:
+                self.on_buffer_drain()
+
+        future.add_done_callback(done)
+
     @abc.abstractmethod
     def get_query_argument(self, name) -> typing.Optional[str]:
         pass
@@ -84,9 +144,19 @@ class WebSocketConnection(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def write_message(self, message: dict):
+    def write_message(self, message: typing.Union[dict, list, bytes]):
+        """Send a frame to client.
+        The frame is a command dict or a list of command dicts which sent in JSON text frame,
+        or bytes which sent in binary frame"""
         pass
 
+    def send_message(self, message: typing.Union[dict, list]):
+        """Serialize the message with the negotiated protocol and send it to client"""
+        if self.msgpack:
+            self.write_message(msgpack_dumps(message))
+        else:
+            self.write_message(message)
+
     @abc.abstractmethod
     def closed(self) -> bool:
         return False
@@ -107,52 +177,83 @@ class WebSocketHandler:
     connection: WebSocketConnection
     reconnectable: bool
 
-    def __init__(self, connection: WebSocketConnection, application, reconnectable: bool, ioloop=None):
+    def __init__(self, connection: WebSocketConnection, application, reconnectable: bool, ioloop=None,
+                 backpressure: dict = None, reconnect_buffer: dict = None):
+        """
+        :param dict backpressure: The backpressure options, returned by `backpressure_options()`
+        :param dict reconnect_buffer: The size of the buffer to resend the messages lost in reconnection,
+            returned by `reconnect_buffer_options()`
+        """
         logger.debug("WebSocket opened")
         self.connection = connection
         self.reconnectable = reconnectable
         self.session_id = connection.get_query_argument('session')
         self.ioloop = ioloop or asyncio.get_event_loop()
+        self.backpressure = backpressure or backpressure_options(None)
+        connection.msgpack = connection.get_query_argument('protocol') == 'msgpack' and msgpack_available()
+        connection.on_buffer_drain = self._on_buffer_drain
+        self._flush_scheduled = False
+        self._flush_deferred = False  # the flush is deferred since the transport buffer is full
+        self.deferred_flushes = 0
 
         if self.session_id in ('NEW', None):  # 初始请求，创建新 Session
             self._init_session(application)
             if reconnectable:
                 _reconnect_state.active_connections[self.session_id] = self.connection
                 _reconnect_state.unclosed_sessions[self.session_id] = self.session
+                _reconnect_state.replay_buffers[self.session_id] = ReplayBuffer(
+                    **(reconnect_buffer or reconnect_buffer_options(None)))
                 # set session id to client, so the client can send it back to server to recover a session when it
                 # resumes form a connection lost
-                connection.write_message(dict(command='set_session_id', spec=self.session_id))
+                connection.send_message(dict(command='set_session_id', spec=self.session_id))
         elif self.session_id not in _reconnect_state.unclosed_sessions:  # session is expired
             bye_msg = dict(command='close_session')
             for m in _reconnect_state.session_will_messages.get(self.session_id, [bye_msg]):
                 try:
-                    connection.write_message(m)
+                    connection.send_message(m)
                 except Exception:
                     logger.exception("Error in sending message via websocket")
         else:  # resumes form a connection lost
             self.session = _reconnect_state.unclosed_sessions[self.session_id]
-            _reconnect_state.detached_sessions.pop(self.session_id, None)
+            _attach_session(self.session_id)
             _reconnect_state.active_connections[self.session_id] = connection
-            # send the latest messages to client
-            self._send_msg_to_client()
-
+            # the session reports to current handler from now on, so that the flush deferred by the full buffer
+            # of the lost connection resumes when the buffer of current connection drains
+            self.session.rebind_backend(on_task_command=self._send_msg_to_client,
+                                        on_session_close=self._close_from_session)
+            # resend the messages lost in the dropped connection, then send the latest messages to client
+            if self._resend_lost_messages():
+                self._send_msg_to_client()
+
+        # keep the queue for metrics, since the session is detached from handler when closed
+        self._command_queue = getattr(self.session, 'unhandled_task_msgs', None)
         logger.debug('session id: %s' % self.session_id)
 
     def _init_session(self, application):
         session_info = self.connection.make_session_info()
-        self.session_id = random_str(24)
+        self.session_id = worker_id_prefix() + random_str(24)
 
+        queue_options = dict(command_queue_policy=self.backpressure['policy'],
+                             command_queue_size=self.backpressure['max_queued'])
         if iscoroutinefunction(application) or isgeneratorfunction(application):
             self.session = CoroutineBasedSession(
                 application, session_info=session_info,
                 on_task_command=self._send_msg_to_client,
-                on_session_close=self._close_from_session)
+                on_session_close=self._close_from_session,
+                loop=self.ioloop, event_loop_thread=CoroutineBasedSession.pick_event_loop_thread(),
+                **queue_options)
+        elif ProcessBasedSession.accepts(application):
+            self.session = ProcessBasedSession(
+                application, session_info=session_info,
+                on_task_command=self._send_msg_to_client,
+                on_session_close=self._close_from_session,
+                loop=self.ioloop, **queue_options)
         else:
             self.session = ThreadBasedSession(
                 application, session_info=session_info,
                 on_task_command=self._send_msg_to_client,
                 on_session_close=self._close_from_session,
-                loop=self.ioloop)
+                loop=self.ioloop, **queue_options)
 
     def _get_active_connection(self) -> Optional[WebSocketConnection]:
         # when reconnect enabled, the active connection for this session is in _reconnect_state.active_connections,
@@ -165,42 +266,155 @@ class WebSocketHandler:
         return conn
 
     def _send_msg_to_client(self, session: Session = None):
+        """Schedule to send the messages of session in the next event loop iteration,
+        so that the messages produced in one loop iteration are coalesced into one frame"""
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        self.ioloop.call_soon(self._flush_msg_to_client, session or self.session)
+
+    def _flush_msg_to_client(self, session: Session = None, force=False):
+        """
+        :param bool force: Send the messages even if the transport buffer is full
+        """
+        self._flush_scheduled = False
         conn = self._get_active_connection()
         session = session or self.session
 
-        if not conn or conn.closed():
+        if not conn or conn.closed() or session is None:
+            return
+
+        if not force and self._buffer_full(conn):
+            # keep the messages in session until the client catches up,
+            # the queue policy of session decides what to do when there are too many messages
+            if not self._flush_deferred:
+                self.deferred_flushes += 1
+            self._flush_deferred = True
             return
+        self._flush_deferred = False
 
-        for msg in session.get_task_commands():
+        msgs = session.get_task_commands()
+        if not msgs:
+            return
+        self._write_messages(conn, self._number_messages(msgs))
+
+    def _number_messages(self, msgs: List[dict]) -> List[dict]:
+        replay = _reconnect_state.replay_buffers.get(self.session_id) if self.reconnectable else None
+        return replay.record(msgs) if replay else msgs
+
+    def _resend_lost_messages(self) -> bool:
+        """Resend the messages lost in reconnection.
+
+        :return: ``False`` when some lost messages are not in replay buffer anymore, the session is closed in this case
+        """
+        replay = _reconnect_state.replay_buffers.get(self.session_id)
+        seq = self.connection.get_query_argument('seq')
+        if replay is None or seq is None:
+            return True
+        try:
+            seq = int(seq)
+        except ValueError:
+            return True
+        msgs = replay.since(seq)
+        if msgs is None:
+            logger.warning("Some messages of session %s lost in reconnection are not in replay buffer anymore, "
+                           "close the session", self.session_id)
+            self._close_out_of_sync_session()
+            return False
+        if msgs:
+            logger.debug("Resend %d messages to session %s", len(msgs), self.session_id)
+            self._write_messages(self.connection, msgs)
+        return True
+
+    def _close_out_of_sync_session(self):
+        """Close the session whose page can't catch up with it, and tell the user to reload the page"""
+        self.session.get_task_commands()  # the page is out of sync, drop the messages not sent yet
+        language = self.session.internal_save['info'].get('user_language', '')
+        if 'zh' in language:
+            content = "与服务器的连接中断时丢失了部分消息，请刷新页面"
+        else:
+            content = "Some messages were lost while the connection was interrupted, please reload the page"
+        self._write_messages(self.connection, [
+            dict(command='toast', spec=dict(content=content, duration=0, position='center', color='#e53935',
+                                            callback_id=None)),
+            dict(command='close_session'),
+        ])
+        self.connection.close()
+        self.reconnectable = False  # the session ends with this connection, keep no messages for reconnection
+        expire_session(self.session_id)
+
+    def _write_messages(self, conn: WebSocketConnection, msgs: List[dict]):
+        try:
+            conn.send_message(msgs[0] if len(msgs) == 1 else msgs)
+            return
+        except TypeError:
+            if len(msgs) == 1:
+                self._log_serialization_error(msgs[0])
+                return
+        except Exception:
+            logger.exception("Error in sending message via websocket")
+            return
+
+        # some message in the batch can't be serialized, send them one by one to only drop the bad ones
+        for msg in msgs:
             try:
-                conn.write_message(msg)
-            except TypeError as e:
-                logger.exception('Data serialization error: %s\n'
-                                 'This may be because you pass the wrong type of parameter to the function'
-                                 ' of PyWebIO.\nData content: %s', e, msg)
+                conn.send_message(msg)
+            except TypeError:
+                self._log_serialization_error(msg)
             except Exception:
                 logger.exception("Error in sending message via websocket")
 
+    def _buffer_full(self, conn: WebSocketConnection) -> bool:
+        max_size = self.backpressure['max_buffered_size']
+        return bool(max_size) and conn.buffered_bytes >= max_size
+
+    def _on_buffer_drain(self):
+        conn = self._get_active_connection()
+        if self._flush_deferred and conn is not None and not self._buffer_full(conn):
+            self._send_msg_to_client()
+
+    def metrics(self) -> dict:
+        """The backpressure metrics of the session"""
+        queue = self._command_queue
+        return dict(
+            buffered_bytes=self.connection.buffered_bytes,
+            max_buffered_bytes=self.connection.max_buffered_bytes,
+            deferred_flushes=self.deferred_flushes,
+            queued_commands=queue.qsize() if queue is not None else 0,
+            max_queued_commands=getattr(queue, 'peak_size', 0),
+            queued_bytes=getattr(queue, 'queued_bytes', 0),
+            max_queued_bytes=getattr(queue, 'peak_bytes', 0),
+            dropped_commands=getattr(queue, 'dropped', 0),
+            collapsed_commands=getattr(queue, 'collapsed', 0),
+        )
+
+    @staticmethod
+    def _log_serialization_error(msg):
+        logger.exception('Data serialization error\n'
+                         'This may be because you pass the wrong type of parameter to the function'
+                         ' of PyWebIO.\nData content: %s', msg)
+
     def _close_from_session(self):
         conn = self._get_active_connection()
         if conn and not conn.closed():
-            self._send_msg_to_client()
+            self._flush_msg_to_client(force=True)
             conn.close()
         elif self.reconnectable:  # no active connection, and reconnect is enabled
-            _reconnect_state.session_will_messages[self.session_id] = self.session.get_task_commands()
+            msgs = self._number_messages(self.session.get_task_commands())
+            _reconnect_state.session_will_messages[self.session_id] = msgs
         self.session = None
 
     def send_client_data(self, data):
         if isinstance(data, bytes):
             event = deserialize_binary_event(data)
         else:
-            event = json.loads(data)
+            event = json_loads(data)
         if event is None:
             return
         self.session.send_client_event(event)
 
     def notify_connection_lost(self):
-        logger.debug("WebSocket closed")
+        logger.debug("WebSocket closed, backpressure metrics: %s", self.metrics())
         if not self.reconnectable and self.session:
             # when the connection lost is caused by `on_session_close()`, it's OK to close the session here though.
             # because the `session.close()` is reentrant
@@ -210,4 +424,6 @@ class WebSocketHandler:
 
         _reconnect_state.active_connections.pop(self.session_id, None)
         if self.session_id in _reconnect_state.unclosed_sessions:
-            _reconnect_state.detached_sessions[self.session_id] = time.time()
+            _attach_session(self.session_id)  # in case of the previous timer is not cancelled
+            _reconnect_state.detached_sessions[self.session_id] = self.ioloop.call_later(
+                _reconnect_state.expire_second, expire_session, self.session_id)
@@ -1,6 +1,5 @@
 import asyncio
 import fnmatch
-import json
 import logging
 import os
 import typing
@@ -14,9 +13,12 @@ from .adaptor import ws as ws_adaptor
 from .page import make_applications, render_page
 from .remote_access import start_remote_access_service
 from .tornado import open_webbrowser_on_server_started
-from .utils import cdn_validation, print_listen_address
-from ..session import register_session_implement_for_target, Session
+from .utils import cdn_validation, print_listen_address, json_dumps, websocket_compression_options, \
+    backpressure_options, reconnect_buffer_options, prepare_file_response, stored_file_headers, set_json_codec, \
+    set_thread_pool, set_process_pool, event_loop_factory, limit_server_window_bits, DeflateMeter
+from ..session import register_session_implement_for_target, Session, CoroutineBasedSession
 from ..session.base import get_session_info_from_headers
+from ..session.file_store import file_store
 from ..utils import get_free_port, STATIC_PATH, parse_file_size
 
 logger = logging.getLogger(__name__)
@@ -44,10 +46,11 @@ def _is_same_site(origin, host):
 
 class WebSocketConnection(ws_adaptor.WebSocketConnection):
 
-    def __init__(self, ws: web.WebSocketResponse, http: web.Request, ioloop):
+    def __init__(self, ws: web.WebSocketResponse, http: web.Request, ioloop, meter: DeflateMeter = None):
         self.ws = ws
         self.http = http
         self.ioloop = ioloop
+        self.meter = meter  # measure the compression ratio for debug log
 
     def get_query_argument(self, name) -> typing.Optional[str]:
         return self.http.query.getone(name, None)
@@ -60,9 +63,15 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         session_info['protocol'] = 'websocket'
         return session_info
 
-    def write_message(self, message: dict):
-        msg_str = json.dumps(message)
-        self.ioloop.create_task(self.ws.send_str(msg_str))
+    def write_message(self, message: typing.Union[dict, list, bytes]):
+        if isinstance(message, bytes):
+            task = self.ioloop.create_task(self.ws.send_bytes(message))
+        else:
+            message = json_dumps(message)
+            task = self.ioloop.create_task(self.ws.send_str(message))
+        if self.meter:
+            self.meter.feed(message if isinstance(message, bytes) else message.encode('utf8'))
+        self._track_buffer(len(message), task)
 
     def closed(self) -> bool:
         return self.ws.closed
@@ -71,18 +80,38 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         self.ioloop.create_task(self.ws.close())
 
 
-def _webio_handler(applications, cdn, websocket_settings, reconnect_timeout=0, check_origin_func=_is_same_site):
+def _file_response(request: web.Request, token):
+    """Serve the file in file store, see :mod:`pywebio.session.file_store`"""
+    file = file_store.get(token)
+    if file is not None and file.path is not None and os.path.isfile(file.path):
+        # FileResponse supports Range requests and sends the file by `sendfile()`
+        return web.FileResponse(file.path, headers=stored_file_headers(file))
+
+    status, headers, file, start, length = prepare_file_response(token, request.headers)
+    body = None
+    if file is not None:
+        with file.open(start) as f:
+            body = f.read(length)
+    headers.pop('Content-Length', None)  # set by aiohttp according to body
+    return web.Response(status=status, headers=headers, body=body)
+
+
+def _webio_handler(applications, cdn, websocket_settings, reconnect_timeout=0, check_origin_func=_is_same_site,
+                   compression=None, backpressure=None, reconnect_buffer=None):
     """
     :param dict applications: dict of `name -> task function`
     :param bool/str cdn: Whether to load front-end static resources from CDN
     :param callable check_origin_func: check_origin_func(origin, host) -> bool
+    :param dict compression: The options of permessage-deflate compression, returned by
+       `websocket_compression_options()`. ``None`` if the compression is disabled.
+    :param dict backpressure: The backpressure options, returned by `backpressure_options()`
+    :param dict reconnect_buffer: The reconnect buffer options, returned by `reconnect_buffer_options()`
     :return: aiohttp Request Handler
     """
     ws_adaptor.set_expire_second(reconnect_timeout)
 
     async def wshandle(request: web.Request):
         ioloop = asyncio.get_event_loop()
-        asyncio.get_event_loop().create_task(ws_adaptor.session_clean_task())
 
         origin = request.headers.get('origin')
         if origin and not check_origin_func(origin=origin, host=request.host):
@@ -93,21 +122,36 @@ def _webio_handler(applications, cdn, websocket_settings, reconnect_timeout=0, c
             if request.query.getone('test', ''):
                 return web.Response(text="")
 
+            if request.query.getone('file', ''):
+                return _file_response(request, request.query.getone('file'))
+
             app_name = request.query.getone('app', 'index')
             app = applications.get(app_name) or applications['index']
             no_cdn = cdn is True and request.query.getone('_pywebio_cdn', '') == 'false'
-            html = render_page(app, protocol='ws', cdn=False if no_cdn else cdn)
+            html = render_page(app, protocol='ws', cdn=False if no_cdn else cdn,
+                               language=request.headers.get('Accept-Language', ''))
             return web.Response(body=html, content_type='text/html')
 
         ws = web.WebSocketResponse(**websocket_settings)
-        await ws.prepare(request)
+        handshake_request = request
+        if compression and 'window_bits' in compression:
+            # aiohttp uses the `server_max_window_bits` offered by client
+            headers = request.headers.copy()
+            limit_server_window_bits(headers, compression['window_bits'])
+            handshake_request = request.clone(headers=headers)
+        await ws.prepare(handshake_request)
 
         app_name = request.query.getone('app', 'index')
         application = applications.get(app_name) or applications['index']
 
-        conn = WebSocketConnection(ws, request, ioloop)
+        meter = None
+        if ws.compress and logger.isEnabledFor(logging.DEBUG):
+            # aiohttp compresses the messages in the fastest level, `ws.compress` is the agreed window bits
+            meter = DeflateMeter(level=1, window_bits=15 if ws.compress is True else ws.compress)
+        conn = WebSocketConnection(ws, request, ioloop, meter)
         handler = ws_adaptor.WebSocketHandler(
-            connection=conn, application=application, reconnectable=bool(reconnect_timeout), ioloop=ioloop
+            connection=conn, application=application, reconnectable=bool(reconnect_timeout), ioloop=ioloop,
+            backpressure=backpressure, reconnect_buffer=reconnect_buffer
         )
 
         # see: https://github.com/aio-libs/aiohttp/issues/1768
@@ -119,6 +163,8 @@ def _webio_handler(applications, cdn, websocket_settings, reconnect_timeout=0, c
                     raise asyncio.CancelledError()
         finally:
             handler.notify_connection_lost()
+            if meter:
+                meter.log(logger)
 
         return ws
 
@@ -126,7 +172,8 @@ def _webio_handler(applications, cdn, websocket_settings, reconnect_timeout=0, c
 
 
 def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=None, check_origin=None,
-                  max_payload_size='200M', websocket_settings=None):
+                  max_payload_size='200M', websocket_settings=None, websocket_compression=True, backpressure='block',
+                  reconnect_buffer=None):
     """Get the `Request Handler <https://docs.aiohttp.org/en/stable/web_quickstart.html#aiohttp-web-handler>`_ coroutine for running PyWebIO applications in aiohttp.
     The handler communicates with the browser by WebSocket protocol.
 
@@ -142,6 +189,9 @@ def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=N
 
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
     websocket_settings.setdefault('max_msg_size', max_payload_size)
+    # aiohttp doesn't support to set the level and memory level of the compression, nor to skip the small messages
+    compression = websocket_compression_options(websocket_compression, backend='aiohttp', supported=('window_bits',))
+    websocket_settings.setdefault('compress', compression is not None)
 
     cdn = cdn_validation(cdn, 'error')
 
@@ -153,7 +203,9 @@ def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=N
     return _webio_handler(applications=applications, cdn=cdn,
                           check_origin_func=check_origin_func,
                           reconnect_timeout=reconnect_timeout,
-                          websocket_settings=websocket_settings)
+                          websocket_settings=websocket_settings, compression=compression,
+                          backpressure=backpressure_options(backpressure),
+                          reconnect_buffer=reconnect_buffer_options(reconnect_buffer))
 
 
 def static_routes(prefix='/'):
@@ -176,12 +228,21 @@ def start_server(applications, port=0, host='', debug=False,
                  auto_open_webbrowser=False,
                  max_payload_size='200M',
                  websocket_settings=None,
+                 websocket_compression=True,
+                 backpressure='block',
+                 reconnect_buffer=None,
+                 json_codec='auto',
+                 thread_pool=None, asyncio_task=False, loop='asyncio', event_loop_threads=0, process_pool=None,
                  **aiohttp_settings):
     """Start a aiohttp server to provide the PyWebIO application as a web service.
 
 
     :param dict websocket_settings: The  parameters passed to the constructor of ``aiohttp.web.WebSocketResponse``.
        For details, please refer: https://docs.aiohttp.org/en/stable/web_reference.html#websocketresponse
+    :param bool/dict websocket_compression: Whether to enable the permessage-deflate compression of WebSocket messages,
+       the default is ``True``. Only the ``window_bits`` option in dict form
+       (see :func:`pywebio.platform.tornado.start_server`) is supported by aiohttp, the other options are ignored
+       with a warning.
     :param aiohttp_settings: Additional keyword arguments passed to the constructor of ``aiohttp.web.Application``.
        For details, please refer: https://docs.aiohttp.org/en/stable/web_reference.html#application
 
@@ -196,10 +257,19 @@ def start_server(applications, port=0, host='', debug=False,
         port = get_free_port()
 
     cdn = cdn_validation(cdn, 'warn')
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
+    loop_factory = event_loop_factory(loop)
+    if loop_factory:
+        asyncio.set_event_loop(loop_factory())
+    CoroutineBasedSession.set_event_loop_threads(event_loop_threads, loop_factory)
 
     handler = webio_handler(applications, cdn=cdn, allowed_origins=allowed_origins, reconnect_timeout=reconnect_timeout,
                             check_origin=check_origin, max_payload_size=max_payload_size,
-                            websocket_settings=websocket_settings)
+                            websocket_settings=websocket_settings, websocket_compression=websocket_compression,
+                            backpressure=backpressure, reconnect_buffer=reconnect_buffer)
 
     app = web.Application(**aiohttp_settings)
     app.router.add_routes([web.get('/', handler)])
@@ -219,4 +289,5 @@ def start_server(applications, port=0, host='', debug=False,
     if remote_access:
         start_remote_access_service(local_port=port)
 
-    web.run_app(app, host=host, port=port)
+    run_app_options = dict(loop=asyncio.get_event_loop()) if loop_factory else {}
+    web.run_app(app, host=host, port=port, **run_app_options)
@@ -1,16 +1,16 @@
-import json
 import logging
 import os
 import threading
 
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, StreamingHttpResponse, FileResponse
 
 from . import page
-from ..session import Session
+from ..session import CoroutineBasedSession, Session
 from .adaptor.http import HttpContext, HttpHandler, run_event_loop
 from .remote_access import start_remote_access_service
 from .page import make_applications
-from .utils import cdn_validation, print_listen_address
+from .utils import cdn_validation, print_listen_address, json_dumps, iter_file, file_to_eof, set_json_codec, \
+    set_thread_pool, set_process_pool
 from ..utils import STATIC_PATH, iscoroutinefunction, isgeneratorfunction, get_free_port, parse_file_size
 
 logger = logging.getLogger(__name__)
@@ -59,10 +59,28 @@ class DjangoHttpContext(HttpContext):
         # self.response.content accept str and byte
         if json_type:
             self.set_header('content-type', 'application/json')
-            self.response.content = json.dumps(content)
+            self.response.content = json_dumps(content)
         else:
             self.response.content = content
 
+    def set_event_stream(self, stream):
+        response = StreamingHttpResponse(stream, status=self.response.status_code, content_type='text/event-stream')
+        for name, value in self.response.items():
+            if name.lower() != 'content-type':
+                response[name] = value
+        self.response = response
+
+    def set_file(self, file, length):
+        # the WSGI server may send the rest of the file by `sendfile()` in `wsgi.file_wrapper`
+        if file_to_eof(file, length):
+            response = FileResponse(file)
+        else:
+            response = StreamingHttpResponse(iter_file(file, length))
+        response.status_code = self.response.status_code
+        for name, value in self.response.items():
+            response[name] = value
+        self.response = response
+
     def get_response(self):
         """获取当前的响应对象，用于在私图函数中返回"""
         return self.response
@@ -75,7 +93,8 @@ class DjangoHttpContext(HttpContext):
 def webio_view(applications, cdn=True,
                session_expire_seconds=None,
                session_cleanup_interval=None,
-               allowed_origins=None, check_origin=None):
+               allowed_origins=None, check_origin=None,
+               long_poll_timeout=0, server_sent_events=False, affinity_socket_dir=None):
     """Get the view function for running PyWebIO applications in Django.
     The view communicates with the browser by HTTP protocol.
 
@@ -85,7 +104,9 @@ def webio_view(applications, cdn=True,
     handler = HttpHandler(applications=applications, cdn=cdn,
                           session_expire_seconds=session_expire_seconds,
                           session_cleanup_interval=session_cleanup_interval,
-                          allowed_origins=allowed_origins, check_origin=check_origin)
+                          allowed_origins=allowed_origins, check_origin=check_origin,
+                          long_poll_timeout=long_poll_timeout, server_sent_events=server_sent_events,
+                          affinity_socket_dir=affinity_socket_dir)
 
     from django.views.decorators.csrf import csrf_exempt
 
@@ -106,10 +127,19 @@ def wsgi_app(applications, cdn=True,
              allowed_origins=None, check_origin=None,
              session_expire_seconds=None,
              session_cleanup_interval=None,
-             debug=False, max_payload_size='200M', **django_options):
+             debug=False, max_payload_size='200M', long_poll_timeout=0, server_sent_events=False,
+             affinity_socket_dir=None, **django_options):
     """Get the Django WSGI app for running PyWebIO applications.
 
-    The arguments of ``wsgi_app()`` have the same meaning as for :func:`pywebio.platform.django.start_server`
+    The arguments of ``wsgi_app()`` have the same meaning as for :func:`pywebio.platform.django.start_server`,
+    except:
+
+    :param str affinity_socket_dir: Enable session affinity and set the directory to place the Unix sockets
+       of worker processes. Use it when the WSGI app is served by multiple processes on the same host
+       (for example, ``uWSGI --processes n``), the requests landing on the worker that doesn't own the session
+       are forwarded to the owner worker. See :mod:`pywebio.platform.adaptor.affinity` for details.
+       The directory is created with mode ``0o700`` if not exists, and must only be accessible by the user
+       running the workers.
     """
     global urlpatterns
 
@@ -160,7 +190,10 @@ def wsgi_app(applications, cdn=True,
         session_expire_seconds=session_expire_seconds,
         session_cleanup_interval=session_cleanup_interval,
         allowed_origins=allowed_origins,
-        check_origin=check_origin
+        check_origin=check_origin,
+        long_poll_timeout=long_poll_timeout,
+        server_sent_events=server_sent_events,
+        affinity_socket_dir=affinity_socket_dir
     )
 
     urlpatterns = [
@@ -178,7 +211,9 @@ def start_server(applications, port=8080, host='', cdn=True,
                  allowed_origins=None, check_origin=None,
                  session_expire_seconds=None,
                  session_cleanup_interval=None,
-                 debug=False, max_payload_size='200M', **django_options):
+                 debug=False, max_payload_size='200M', long_poll_timeout=0, server_sent_events=False,
+                 json_codec='auto', thread_pool=None, asyncio_task=False, process_pool=None,
+                 **django_options):
     """Start a Django server to provide the PyWebIO application as a web service.
 
     :param bool debug: Django debug mode.
@@ -196,17 +231,23 @@ def start_server(applications, port=8080, host='', cdn=True,
         host = '0.0.0.0'
 
     max_payload_size = parse_file_size(max_payload_size)
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
     app = wsgi_app(applications, cdn=cdn, static_dir=static_dir, allowed_origins=allowed_origins,
                    check_origin=check_origin, session_expire_seconds=session_expire_seconds,
                    session_cleanup_interval=session_cleanup_interval,
-                   debug=debug, max_payload_size=max_payload_size, **django_options)
+                   debug=debug, max_payload_size=max_payload_size, long_poll_timeout=long_poll_timeout,
+                   server_sent_events=server_sent_events, **django_options)
 
     print_listen_address(host, port)
 
     if remote_access:
         start_remote_access_service(local_port=port)
 
-    use_tornado_wsgi = os.environ.get('PYWEBIO_DJANGO_WITH_TORNADO', True)
+    # tornado's WSGIContainer buffers the whole response body, which breaks the Server-Sent Events stream
+    use_tornado_wsgi = os.environ.get('PYWEBIO_DJANGO_WITH_TORNADO', not server_sent_events)
     if use_tornado_wsgi:
         import tornado.wsgi
         container = tornado.wsgi.WSGIContainer(app)
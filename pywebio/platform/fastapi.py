@@ -7,7 +7,7 @@ from functools import partial
 import uvicorn
 from starlette.applications import Starlette
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, FileResponse, Response
 from starlette.routing import Route, WebSocketRoute, Mount
 from starlette.websockets import WebSocket, WebSocketState
 from starlette.websockets import WebSocketDisconnect
@@ -16,9 +16,12 @@ from . import page
 from .page import make_applications, render_page
 from .remote_access import start_remote_access_service
 from .tornado import open_webbrowser_on_server_started
-from .utils import cdn_validation, OriginChecker, print_listen_address
-from ..session import register_session_implement_for_target, Session
+from .utils import cdn_validation, OriginChecker, print_listen_address, json_dumps, websocket_compression_options, \
+    backpressure_options, reconnect_buffer_options, prepare_file_response, stored_file_headers, set_json_codec, \
+    set_thread_pool, set_process_pool, event_loop_factory
+from ..session import register_session_implement_for_target, Session, CoroutineBasedSession
 from ..session.base import get_session_info_from_headers
+from ..session.file_store import file_store
 from ..utils import get_free_port, STATIC_PATH, strip_space, parse_file_size
 
 logger = logging.getLogger(__name__)
@@ -42,8 +45,13 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         session_info['protocol'] = 'websocket'
         return session_info
 
-    def write_message(self, message: dict):
-        self.ioloop.create_task(self.ws.send_json(message))
+    def write_message(self, message: typing.Union[dict, list, bytes]):
+        if isinstance(message, bytes):
+            task = self.ioloop.create_task(self.ws.send_bytes(message))
+        else:
+            message = json_dumps(message)
+            task = self.ioloop.create_task(self.ws.send_text(message))
+        self._track_buffer(len(message), task)
 
     def closed(self) -> bool:
         return self.ws.application_state == WebSocketState.DISCONNECTED
@@ -52,7 +60,22 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         self.ioloop.create_task(self.ws.close())
 
 
-def _webio_routes(applications, cdn, check_origin_func, reconnect_timeout):
+def _file_response(request: Request, token):
+    """Serve the file in file store, see :mod:`pywebio.session.file_store`"""
+    file = file_store.get(token)
+    if file is not None and file.path is not None and os.path.isfile(file.path):
+        # FileResponse supports Range requests and conditional requests
+        return FileResponse(file.path, headers=stored_file_headers(file))
+
+    status, headers, file, start, length = prepare_file_response(token, request.headers)
+    body = b''
+    if file is not None:
+        with file.open(start) as f:
+            body = f.read(length)
+    return Response(content=body, status_code=status, headers=headers)
+
+
+def _webio_routes(applications, cdn, check_origin_func, reconnect_timeout, backpressure=None, reconnect_buffer=None):
     """
     :param dict applications: dict of `name -> task function`
     :param bool/str cdn: Whether to load front-end static resources from CDN
@@ -70,15 +93,18 @@ def _webio_routes(applications, cdn, check_origin_func, reconnect_timeout):
         if request.query_params.get('test'):
             return HTMLResponse(content="")
 
+        if request.query_params.get('file'):
+            return _file_response(request, request.query_params.get('file'))
+
         app_name = request.query_params.get('app', 'index')
         app = applications.get(app_name) or applications['index']
         no_cdn = cdn is True and request.query_params.get('_pywebio_cdn', '') == 'false'
-        html = render_page(app, protocol='ws', cdn=False if no_cdn else cdn)
+        html = render_page(app, protocol='ws', cdn=False if no_cdn else cdn,
+                           language=request.headers.get('Accept-Language', ''))
         return HTMLResponse(content=html)
 
     async def websocket_endpoint(websocket: WebSocket):
         ioloop = asyncio.get_event_loop()
-        asyncio.get_event_loop().create_task(ws_adaptor.session_clean_task())
 
         await websocket.accept()
 
@@ -87,7 +113,8 @@ def _webio_routes(applications, cdn, check_origin_func, reconnect_timeout):
 
         conn = WebSocketConnection(websocket, ioloop)
         handler = ws_adaptor.WebSocketHandler(
-            connection=conn, application=application, reconnectable=bool(reconnect_timeout), ioloop=ioloop
+            connection=conn, application=application, reconnectable=bool(reconnect_timeout), ioloop=ioloop,
+            backpressure=backpressure, reconnect_buffer=reconnect_buffer
         )
 
         while True:
@@ -110,7 +137,8 @@ def _webio_routes(applications, cdn, check_origin_func, reconnect_timeout):
     ]
 
 
-def webio_routes(applications, cdn=True, reconnect_timeout=0, allowed_origins=None, check_origin=None):
+def webio_routes(applications, cdn=True, reconnect_timeout=0, allowed_origins=None, check_origin=None,
+                 backpressure='block', reconnect_buffer=None):
     """Get the FastAPI/Starlette routes for running PyWebIO applications.
 
     The API communicates with the browser using WebSocket protocol.
@@ -142,7 +170,8 @@ def webio_routes(applications, cdn=True, reconnect_timeout=0, allowed_origins=No
         check_origin_func = lambda origin, host: OriginChecker.is_same_site(origin, host) or check_origin(origin)
 
     return _webio_routes(applications=applications, cdn=cdn, check_origin_func=check_origin_func,
-                         reconnect_timeout=reconnect_timeout)
+                         reconnect_timeout=reconnect_timeout, backpressure=backpressure_options(backpressure),
+                         reconnect_buffer=reconnect_buffer_options(reconnect_buffer))
 
 
 def start_server(applications, port=0, host='', cdn=True, reconnect_timeout=0,
@@ -150,10 +179,21 @@ def start_server(applications, port=0, host='', cdn=True, reconnect_timeout=0,
                  allowed_origins=None, check_origin=None,
                  auto_open_webbrowser=False,
                  max_payload_size='200M',
+                 websocket_compression=True,
+                 backpressure='block',
+                 reconnect_buffer=None,
+                 json_codec='auto',
+                 thread_pool=None, asyncio_task=False, loop='asyncio', event_loop_threads=0, process_pool=None,
                  **uvicorn_settings):
     """Start a FastAPI/Starlette server using uvicorn to provide the PyWebIO application as a web service.
 
     :param bool debug: Boolean indicating if debug tracebacks should be returned on errors.
+    :param bool/dict websocket_compression: Whether to enable the permessage-deflate compression of WebSocket messages,
+       the default is ``True``. uvicorn doesn't support to tune the compression,
+       so the options in dict form (see :func:`pywebio.platform.tornado.start_server`) are ignored with a warning.
+    :param str loop: The event loop implementation, see :func:`pywebio.platform.tornado.start_server` .
+       uvicorn uses uvloop by default if it's installed, so ``'asyncio'`` (default) leaves the choice to uvicorn,
+       and ``'uvloop'`` is the same as passing ``loop='uvloop'`` to ``uvicorn.run()`` .
     :param uvicorn_settings: Additional keyword arguments passed to ``uvicorn.run()``.
        For details, please refer: https://www.uvicorn.org/settings/
 
@@ -161,10 +201,17 @@ def start_server(applications, port=0, host='', cdn=True, reconnect_timeout=0,
 
     .. versionadded:: 1.3
     """
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
+    loop_factory = event_loop_factory(loop)
+    CoroutineBasedSession.set_event_loop_threads(event_loop_threads, loop_factory)
 
     app = asgi_app(applications, cdn=cdn, reconnect_timeout=reconnect_timeout,
                    static_dir=static_dir, debug=debug,
-                   allowed_origins=allowed_origins, check_origin=check_origin)
+                   allowed_origins=allowed_origins, check_origin=check_origin, backpressure=backpressure,
+                   reconnect_buffer=reconnect_buffer)
 
     if auto_open_webbrowser:
         asyncio.get_event_loop().create_task(open_webbrowser_on_server_started('127.0.0.1', port))
@@ -183,12 +230,17 @@ def start_server(applications, port=0, host='', cdn=True, reconnect_timeout=0,
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
     uvicorn_settings = uvicorn_settings or {}
     uvicorn_settings.setdefault('ws_max_size', max_payload_size)
+    # uvicorn only supports to enable or disable the compression, and enables it by default
+    if websocket_compression_options(websocket_compression, backend='uvicorn', supported=()) is None:
+        uvicorn_settings.setdefault('ws_per_message_deflate', False)
+    if loop_factory:
+        uvicorn_settings.setdefault('loop', 'uvloop')
 
     uvicorn.run(app, host=host, port=port, **uvicorn_settings)
 
 
 def asgi_app(applications, cdn=True, reconnect_timeout=0, static_dir=None, debug=False, allowed_origins=None,
-             check_origin=None):
+             check_origin=None, backpressure='block', reconnect_buffer=None):
     """Get the starlette/Fastapi ASGI app for running PyWebIO applications.
 
     Use :func:`pywebio.platform.fastapi.webio_routes` if you prefer handling static files yourself.
@@ -223,7 +275,8 @@ def asgi_app(applications, cdn=True, reconnect_timeout=0, static_dir=None, debug
     if cdn is False:
         cdn = 'pywebio_static'
     routes = webio_routes(applications, cdn=cdn, reconnect_timeout=reconnect_timeout,
-                          allowed_origins=allowed_origins, check_origin=check_origin)
+                          allowed_origins=allowed_origins, check_origin=check_origin, backpressure=backpressure,
+                          reconnect_buffer=reconnect_buffer)
     if static_dir:
         routes.append(Mount('/static', app=StaticFiles(directory=static_dir), name="static"))
     routes.append(Mount('/pywebio_static', app=StaticFiles(directory=STATIC_PATH), name="pywebio_static"))
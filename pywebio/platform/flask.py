@@ -1,20 +1,21 @@
 """
 Flask backend
 """
-import json
 import logging
 import os
 import threading
 
 import werkzeug
+from werkzeug.wsgi import wrap_file
 from flask import Flask, request, send_from_directory, Response
 
 from . import page
 from .adaptor.http import HttpContext, HttpHandler, run_event_loop
 from .page import make_applications
 from .remote_access import start_remote_access_service
-from .utils import cdn_validation, print_listen_address
-from ..session import Session
+from .utils import cdn_validation, print_listen_address, json_dumps, iter_file, file_to_eof, set_json_codec, \
+    set_thread_pool, set_process_pool
+from ..session import CoroutineBasedSession, Session
 from ..utils import STATIC_PATH, iscoroutinefunction, isgeneratorfunction
 from ..utils import get_free_port, parse_file_size
 
@@ -64,10 +65,20 @@ class FlaskHttpContext(HttpContext):
         # self.response.data accept str and bytes
         if json_type:
             self.set_header('content-type', 'application/json')
-            self.response.data = json.dumps(content)
+            self.response.data = json_dumps(content)
         else:
             self.response.data = content
 
+    def set_event_stream(self, stream):
+        self.response = Response(stream, status=self.response.status_code, headers=self.response.headers,
+                                 mimetype='text/event-stream')
+
+    def set_file(self, file, length):
+        # the WSGI server may send the rest of the file by `sendfile()` in `wsgi.file_wrapper`
+        body = wrap_file(request.environ, file) if file_to_eof(file, length) else iter_file(file, length)
+        self.response = Response(body, status=self.response.status_code, headers=self.response.headers,
+                                 direct_passthrough=True)
+
     def get_response(self):
         """获取当前的响应对象，用于在私图函数中返回"""
         return self.response
@@ -80,7 +91,8 @@ class FlaskHttpContext(HttpContext):
 def webio_view(applications, cdn=True,
                session_expire_seconds=None,
                session_cleanup_interval=None,
-               allowed_origins=None, check_origin=None):
+               allowed_origins=None, check_origin=None,
+               long_poll_timeout=0, server_sent_events=False, affinity_socket_dir=None):
     """Get the view function for running PyWebIO applications in Flask.
     The view communicates with the browser by HTTP protocol.
 
@@ -92,7 +104,9 @@ def webio_view(applications, cdn=True,
     handler = HttpHandler(applications=applications, cdn=cdn,
                           session_expire_seconds=session_expire_seconds,
                           session_cleanup_interval=session_cleanup_interval,
-                          allowed_origins=allowed_origins, check_origin=check_origin)
+                          allowed_origins=allowed_origins, check_origin=check_origin,
+                          long_poll_timeout=long_poll_timeout, server_sent_events=server_sent_events,
+                          affinity_socket_dir=affinity_socket_dir)
 
     def view_func():
         context = FlaskHttpContext()
@@ -107,10 +121,19 @@ def wsgi_app(applications, cdn=True,
              allowed_origins=None, check_origin=None,
              session_expire_seconds=None,
              session_cleanup_interval=None,
-             max_payload_size='200M'):
+             max_payload_size='200M',
+             long_poll_timeout=0, server_sent_events=False, affinity_socket_dir=None):
     """Get the Flask WSGI app for running PyWebIO applications.
 
-    The arguments of ``wsgi_app()`` have the same meaning as for :func:`pywebio.platform.flask.start_server`
+    The arguments of ``wsgi_app()`` have the same meaning as for :func:`pywebio.platform.flask.start_server`,
+    except:
+
+    :param str affinity_socket_dir: Enable session affinity and set the directory to place the Unix sockets
+       of worker processes. Use it when the WSGI app is served by multiple processes on the same host
+       (for example, ``uWSGI --processes n``), the requests landing on the worker that doesn't own the session
+       are forwarded to the owner worker. See :mod:`pywebio.platform.adaptor.affinity` for details.
+       The directory is created with mode ``0o700`` if not exists, and must only be accessible by the user
+       running the workers.
     """
     cdn = cdn_validation(cdn, 'warn')
 
@@ -123,7 +146,10 @@ def wsgi_app(applications, cdn=True,
         session_expire_seconds=session_expire_seconds,
         session_cleanup_interval=session_cleanup_interval,
         allowed_origins=allowed_origins,
-        check_origin=check_origin
+        check_origin=check_origin,
+        long_poll_timeout=long_poll_timeout,
+        server_sent_events=server_sent_events,
+        affinity_socket_dir=affinity_socket_dir
     ), methods=['GET', 'POST', 'OPTIONS'])
 
     app.add_url_rule('/<path:p>', 'pywebio_static', lambda p: send_from_directory(STATIC_PATH, p))
@@ -138,6 +164,10 @@ def start_server(applications, port=8080, host='', cdn=True,
                  session_cleanup_interval=None,
                  debug=False,
                  max_payload_size='200M',
+                 long_poll_timeout=0,
+                 server_sent_events=False,
+                 json_codec='auto',
+                 thread_pool=None, asyncio_task=False, process_pool=None,
                  **flask_options):
     """Start a Flask server to provide the PyWebIO application as a web service.
 
@@ -148,6 +178,17 @@ def start_server(applications, port=8080, host='', cdn=True,
     :param bool debug: Flask debug mode.
        If enabled, the server will automatically reload for code changes.
     :param int/str max_payload_size: Max size of a request body which Flask can accept.
+    :param int long_poll_timeout: Enable long polling and set the max seconds that the server holds a client's pull
+       request when there is no new message. With long polling, the messages of session are pushed to browser as soon
+       as they are produced instead of waiting for the next pull, at the cost of one pending request (which occupies
+       a worker thread in WSGI servers) per session. Default is ``0``, which means use fixed interval pulling.
+    :param bool server_sent_events: Whether to push messages to browser via a
+       `Server-Sent Events <https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events>`_ stream.
+       It provides push latency close to WebSocket in the networks where WebSocket is not available.
+       The browser keeps one streaming response (which occupies a worker thread in WSGI servers) open
+       and still sends the events by POST requests.
+       The browser falls back to pulling when the event stream can't be established.
+       Default is ``False``.
     :param flask_options: Additional keyword arguments passed to the ``flask.Flask.run``.
        For details, please refer: https://flask.palletsprojects.com/en/1.1.x/api/#flask.Flask.run
 
@@ -159,9 +200,14 @@ def start_server(applications, port=8080, host='', cdn=True,
     if port == 0:
         port = get_free_port()
 
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
     app = wsgi_app(applications, cdn=cdn, static_dir=static_dir, allowed_origins=allowed_origins,
                    check_origin=check_origin, session_expire_seconds=session_expire_seconds,
-                   session_cleanup_interval=session_cleanup_interval, max_payload_size=max_payload_size)
+                   session_cleanup_interval=session_cleanup_interval, max_payload_size=max_payload_size,
+                   long_poll_timeout=long_poll_timeout, server_sent_events=server_sent_events)
 
     print_listen_address(host, port)
 
@@ -9,6 +9,8 @@ from os import path, environ
 from tornado import template
 
 from ..__version__ import __version__ as version
+from ..session.processbased import ProcessBasedSession
+from ..session.threadbased import ThreadBasedSession, WAITING_SCOPE, waiting_content
 from ..utils import isgeneratorfunction, iscoroutinefunction, get_function_name, get_function_doc, \
     get_function_attr, STATIC_PATH
 
@@ -29,12 +31,13 @@ _here_dir = path.dirname(path.abspath(__file__))
 _index_page_tpl = template.Template(open(path.join(_here_dir, 'tpl', 'index.html'), encoding='utf8').read())
 
 
-def render_page(app, protocol, cdn):
+def render_page(app, protocol, cdn, language=''):
     """渲染前端页面的HTML框架, 支持SEO
 
     :param callable app: PyWebIO app
     :param str protocol: 'ws'/'http'
     :param bool/str cdn: Whether to use CDN, also accept string as custom CDN URL
+    :param str language: The ``Accept-Language`` header of request, used in the waiting message
     :return: bytes content of rendered page
     """
     assert protocol in ('ws', 'http')
@@ -52,11 +55,22 @@ def render_page(app, protocol, cdn):
     check_theme(theme)
 
     return _index_page_tpl.generate(title=meta.title or 'PyWebIO Application', description=meta.description,
-                                    protocol=protocol, script=True, content='', base_url=base_url, version=version,
+                                    protocol=protocol, script=True, content=waiting_page_content(app, language),
+                                    base_url=base_url, version=version,
                                     js_file=meta.js_file or [], js_code=meta.js_code, css_style=meta.css_style,
                                     css_file=meta.css_file or [], theme=theme, manifest=manifest)
 
 
+def waiting_page_content(app, language=''):
+    """The initial content of page when the thread-based session of the app has to wait for a free worker
+    of `ThreadBasedSession.main_task_pool` or `ProcessBasedSession.process_pool`,
+    the content is removed when the session starts"""
+    pool = ProcessBasedSession.process_pool if ProcessBasedSession.accepts(app) else ThreadBasedSession.main_task_pool
+    if pool is None or iscoroutinefunction(app) or isgeneratorfunction(app) or not pool.busy():
+        return ''
+    return '<div id="%s">%s</div>' % (WAITING_SCOPE[1:], waiting_content(language))
+
+
 @lru_cache(maxsize=64)
 def check_theme(theme):
     """check theme file existence"""
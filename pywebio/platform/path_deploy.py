@@ -1,4 +1,5 @@
 import ast
+import asyncio
 import os.path
 from contextlib import contextmanager
 from functools import partial
@@ -12,7 +13,7 @@ from .adaptor.http import HttpHandler
 from .page import make_applications
 from .tornado import webio_handler, set_ioloop
 from .tornado_http import TornadoHttpContext
-from .utils import cdn_validation, print_listen_address
+from .utils import cdn_validation, print_listen_address, set_json_codec, set_thread_pool, event_loop_factory
 from ..session import register_session_implement, CoroutineBasedSession, ThreadBasedSession, Session
 from ..utils import get_free_port, STATIC_PATH, parse_file_size
 
@@ -220,8 +221,9 @@ def path_deploy(base, port=0, host='',
                 reconnect_timeout=0,
                 cdn=True, debug=False,
                 allowed_origins=None, check_origin=None,
-                max_payload_size='200M',
-                **tornado_app_settings):
+                max_payload_size='200M', websocket_compression=True, backpressure='block', reconnect_buffer=None,
+                json_codec='auto', thread_pool=None, asyncio_task=False, loop='asyncio',
+                event_loop_threads=0, **tornado_app_settings):
     """Deploy the PyWebIO applications from a directory.
 
     The server communicates with the browser using WebSocket protocol.
@@ -245,6 +247,13 @@ def path_deploy(base, port=0, host='',
     """
     debug = Session.debug = os.environ.get('PYWEBIO_DEBUG', debug)
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
+    loop_factory = event_loop_factory(loop)
+    if loop_factory:
+        asyncio.set_event_loop(loop_factory())
+    CoroutineBasedSession.set_event_loop_threads(event_loop_threads, loop_factory)
     # Since some cloud server may close idle connections (such as heroku),
     # use `websocket_ping_interval` to  keep the connection alive
     tornado_app_settings.setdefault('websocket_ping_interval', 30)
@@ -263,7 +272,9 @@ def path_deploy(base, port=0, host='',
     index_func = {True: partial(default_index_page, base=abs_base), False: lambda p: '403 Forbidden'}.get(index, index)
 
     Handler = webio_handler(lambda: None, cdn=cdn, allowed_origins=allowed_origins,
-                            check_origin=check_origin, reconnect_timeout=reconnect_timeout)
+                            check_origin=check_origin, reconnect_timeout=reconnect_timeout,
+                            websocket_compression=websocket_compression, backpressure=backpressure,
+                            reconnect_buffer=reconnect_buffer)
 
     class WSHandler(Handler):
 
@@ -297,6 +308,10 @@ def path_deploy_http(base, port=0, host='',
                      session_expire_seconds=None,
                      session_cleanup_interval=None,
                      max_payload_size='200M',
+                     long_poll_timeout=0,
+                     server_sent_events=False,
+                     json_codec='auto',
+                     thread_pool=None, asyncio_task=False, loop='asyncio',
                      **tornado_app_settings):
     """Deploy the PyWebIO applications from a directory.
 
@@ -310,6 +325,12 @@ def path_deploy_http(base, port=0, host='',
     debug = Session.debug = os.environ.get('PYWEBIO_DEBUG', debug)
 
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
+    loop_factory = event_loop_factory(loop)
+    if loop_factory:
+        asyncio.set_event_loop(loop_factory())
 
     gen = _path_deploy(base, port=port, host=host,
                        static_dir=static_dir, debug=debug,
@@ -344,7 +365,9 @@ def path_deploy_http(base, port=0, host='',
                                     session_expire_seconds=session_expire_seconds,
                                     session_cleanup_interval=session_cleanup_interval,
                                     allowed_origins=allowed_origins,
-                                    check_origin=check_origin)
+                                    check_origin=check_origin,
+                                    long_poll_timeout=long_poll_timeout,
+                                    server_sent_events=server_sent_events)
 
     class ReqHandler(tornado.web.RequestHandler):
         def options(self):
@@ -353,9 +376,12 @@ def path_deploy_http(base, port=0, host='',
         def post(self):
             return self.get()
 
-        def get(self):
+        async def get(self):
             context = TornadoHttpContext(self)
-            self.write(handler.handle_request(context))
+            response = await handler.handle_request_async(context)
+            if context.stream is not None:
+                return await context.write_event_stream()
+            self.write(response)
 
     gen.send(ReqHandler)
     gen.close()
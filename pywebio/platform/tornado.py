@@ -1,6 +1,5 @@
 import asyncio
 import fnmatch
-import json
 import logging
 import os
 import threading
@@ -12,7 +11,11 @@ from urllib.parse import urlparse
 
 import tornado
 import tornado.httpserver
+import tornado.httpclient
 import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.process
 import tornado.web
 import tornado.websocket
 
@@ -20,8 +23,11 @@ from . import page
 from .adaptor import ws as ws_adaptor
 from .page import make_applications, render_page
 from .remote_access import start_remote_access_service
-from .utils import cdn_validation, print_listen_address, deserialize_binary_event
-from ..session import ScriptModeSession, register_session_implement_for_target, Session
+from .utils import cdn_validation, print_listen_address, deserialize_binary_event, json_dumps, json_loads, \
+    set_json_codec, set_thread_pool, set_process_pool, websocket_compression_options, backpressure_options, \
+    reconnect_buffer_options, prepare_file_response, iter_file, event_loop_factory, set_worker, owner_worker_port, \
+    limit_server_window_bits, DeflateMeter
+from ..session import ScriptModeSession, CoroutineBasedSession, register_session_implement_for_target, Session
 from ..session.base import get_session_info_from_headers
 from ..utils import get_free_port, wait_host_port, STATIC_PATH, check_webio_js, parse_file_size
 
@@ -65,10 +71,112 @@ def _is_same_site(origin, handler: tornado.websocket.WebSocketHandler):
     return origin == host
 
 
+async def write_file(handler: tornado.web.RequestHandler, file, length):
+    """Write the ``length`` bytes from the current position of the binary file object to client"""
+    chunks = iter_file(file, length)
+    try:
+        for chunk in chunks:
+            handler.write(chunk)
+            await handler.flush()
+    except tornado.iostream.StreamClosedError:
+        pass
+    finally:
+        chunks.close()
+
+
+async def serve_file(handler: tornado.web.RequestHandler, token):
+    """Serve the file in file store, see :mod:`pywebio.session.file_store`"""
+    status, headers, file, start, length = prepare_file_response(token, handler.request.headers)
+    handler.set_status(status)
+    for name, value in headers.items():
+        handler.set_header(name, value)
+    if file is not None:
+        await write_file(handler, file.open(start), length)
+
+
+async def forward_file_request(handler: tornado.web.RequestHandler, port):
+    """Forward the request of a stored file to the worker process owning it, which listens on ``port``"""
+    url = 'http://127.0.0.1:%d%s' % (port, handler.request.uri)
+    headers = {name: handler.request.headers[name] for name in ('Range', 'If-Range') if name in handler.request.headers}
+
+    def on_header(line):
+        line = line.strip()
+        if line.startswith('HTTP/'):
+            handler.set_status(int(line.split(' ', 2)[1]))
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            if name.lower() not in ('transfer-encoding', 'connection', 'date', 'server'):
+                handler.set_header(name, value.strip())
+
+    def on_chunk(chunk):
+        handler.write(chunk)
+        handler.flush()
+
+    response = await tornado.httpclient.AsyncHTTPClient().fetch(
+        url, headers=headers, header_callback=on_header, streaming_callback=on_chunk,
+        raise_error=False, request_timeout=3600)
+    if response.code == 599:  # the worker is unreachable
+        logger.warning('Forward file request to worker at port %s failed: %s', port, response.error)
+        handler.clear()
+        handler.set_status(404)
+
+
+class WorkerForwarder:
+    """Forward the WebSocket connection to the worker process owning the session
+
+    In multi-worker server, the client may reconnect to a worker other than the one owning its session,
+    then the messages are forwarded between the client and the owner worker.
+    Has the same interface as ``ws_adaptor.WebSocketHandler`` used by the tornado handler.
+    """
+
+    def __init__(self, handler: tornado.websocket.WebSocketHandler):
+        self.handler = handler
+        self.upstream = None  # the connection to the owner worker
+        self.closed = False
+
+    async def connect(self, port) -> bool:
+        url = 'ws://127.0.0.1:%d%s' % (port, self.handler.request.uri)
+        try:
+            self.upstream = await tornado.websocket.websocket_connect(
+                url, max_message_size=self.handler.settings.get('websocket_max_message_size', 10 * 1024 * 1024))
+        except Exception as e:
+            logger.warning('Forward WebSocket connection to worker at port %s failed: %r', port, e)
+            return False
+        logger.debug('Forward WebSocket connection to worker at port %s', port)
+        if self.closed:
+            self.upstream.close()
+        else:
+            tornado.ioloop.IOLoop.current().spawn_callback(self._forward_to_client)
+        return True
+
+    async def _forward_to_client(self):
+        while True:
+            message = await self.upstream.read_message()
+            if message is None:
+                break
+            try:
+                await self.handler.write_message(message, binary=isinstance(message, bytes))
+            except tornado.websocket.WebSocketClosedError:
+                break
+        self.handler.close()
+
+    def send_client_data(self, data):
+        try:
+            self.upstream.write_message(data, binary=isinstance(data, bytes))
+        except tornado.websocket.WebSocketClosedError:
+            self.handler.close()
+
+    def notify_connection_lost(self):
+        self.closed = True
+        if self.upstream is not None:
+            self.upstream.close()
+
+
 class WebSocketConnection(ws_adaptor.WebSocketConnection):
 
-    def __init__(self, context: tornado.websocket.WebSocketHandler):
+    def __init__(self, context: tornado.websocket.WebSocketHandler, meter: Optional[DeflateMeter] = None):
         self.context = context
+        self.meter = meter  # measure the compression ratio for debug log
 
     def get_query_argument(self, name) -> typing.Optional[str]:
         return self.context.get_query_argument(name, None)
@@ -81,8 +189,19 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         session_info['protocol'] = 'websocket'
         return session_info
 
-    def write_message(self, message: dict):
-        self.context.write_message(json.dumps(message))
+    def write_message(self, message: typing.Union[dict, list, bytes]):
+        binary = isinstance(message, bytes)
+        if not binary:
+            message = json_dumps(message).encode('utf8')
+        future = self.context.write_message(message, binary=binary)
+        if self.meter:
+            self.meter.feed(message)
+        # the future is resolved when the message is written to socket
+        self._track_buffer(len(message), future)
+
+    def log_traffic(self):
+        if self.meter:
+            self.meter.log(logger)
 
     def closed(self) -> bool:
         return not bool(self.context.ws_connection)
@@ -91,12 +210,18 @@ class WebSocketConnection(ws_adaptor.WebSocketConnection):
         self.context.close()
 
 
-def _webio_handler(applications=None, cdn=True, reconnect_timeout=0, check_origin_func=_is_same_site) \
-        -> tornado.websocket.WebSocketHandler:  # noqa: C901
+def _webio_handler(applications=None, cdn=True, reconnect_timeout=0, check_origin_func=_is_same_site,
+                   compression: Optional[dict] = None,
+                   backpressure: Optional[dict] = None,
+                   reconnect_buffer: Optional[dict] = None) -> tornado.websocket.WebSocketHandler:  # noqa: C901
     """
     :param dict applications: dict of `name -> task function`
     :param bool/str cdn: Whether to load front-end static resources from CDN
     :param callable check_origin_func: check_origin_func(origin, handler) -> bool
+    :param dict compression: The options of permessage-deflate compression, returned by
+       `websocket_compression_options()`. ``None`` to disable compression.
+    :param dict backpressure: The backpressure options, returned by `backpressure_options()`
+    :param dict reconnect_buffer: The reconnect buffer options, returned by `reconnect_buffer_options()`
     :return: Tornado RequestHandler class
     """
     check_webio_js()
@@ -105,7 +230,6 @@ def _webio_handler(applications=None, cdn=True, reconnect_timeout=0, check_origi
         applications = dict(index=lambda: None)  # mock PyWebIO app
 
     ws_adaptor.set_expire_second(reconnect_timeout)
-    tornado.ioloop.IOLoop.current().spawn_callback(ws_adaptor.session_clean_task)
 
     class Handler(tornado.websocket.WebSocketHandler):
 
@@ -127,37 +251,75 @@ def _webio_handler(applications=None, cdn=True, reconnect_timeout=0, check_origi
                 if self.get_query_argument('test', ''):
                     return self.write('')
 
+                if self.get_query_argument('file', ''):
+                    token = self.get_query_argument('file')
+                    port = owner_worker_port(token)
+                    if port is not None:
+                        return await forward_file_request(self, port)
+                    return await serve_file(self, token)
+
                 app = self.get_app()
-                html = render_page(app, protocol='ws', cdn=self.get_cdn())
+                html = render_page(app, protocol='ws', cdn=self.get_cdn(),
+                                   language=self.request.headers.get('Accept-Language', ''))
                 return self.write(html)
             else:
+                if compression and 'window_bits' in compression:
+                    limit_server_window_bits(self.request.headers, compression['window_bits'])
                 await super().get()
 
         def check_origin(self, origin):
             return check_origin_func(origin=origin, handler=self)
 
         def get_compression_options(self):
-            # Non-None enables compression with default options.
-            return {}
+            # Non-None enables compression
+            if compression is None:
+                return None
+            options = {}
+            if 'level' in compression:
+                options['compression_level'] = compression['level']
+            if 'mem_level' in compression:
+                options['mem_level'] = compression['mem_level']
+            return options
 
         _handler: ws_adaptor.WebSocketHandler
+        _conn: WebSocketConnection
 
         def open(self):
-            conn = WebSocketConnection(self)
+            meter = None
+            if compression is not None and logger.isEnabledFor(logging.DEBUG):
+                # the default options of tornado
+                meter = DeflateMeter(level=compression.get('level', 6), mem_level=compression.get('mem_level', 8),
+                                     window_bits=compression.get('window_bits', 15))
+            self._conn = WebSocketConnection(self, meter)
+            port = owner_worker_port(self.get_query_argument('session', None))
+            if port is not None:  # the client reconnects to a worker not owning its session
+                return self._open_forwarder(port)
+            self._open_handler()
+
+        def _open_handler(self):
             self._handler = ws_adaptor.WebSocketHandler(
-                connection=conn, application=self.get_app(), reconnectable=bool(reconnect_timeout)
+                connection=self._conn, application=self.get_app(), reconnectable=bool(reconnect_timeout),
+                backpressure=backpressure, reconnect_buffer=reconnect_buffer
             )
 
+        async def _open_forwarder(self, port):
+            self._handler = forwarder = WorkerForwarder(self)
+            if not await forwarder.connect(port) and not forwarder.closed:
+                # the owner worker is unreachable, so the session is lost, tell the client as an expired session
+                self._open_handler()
+
         def on_message(self, message):
             self._handler.send_client_data(message)
 
         def on_close(self):
             self._handler.notify_connection_lost()
+            self._conn.log_traffic()
 
     return Handler
 
 
-def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=None, check_origin=None):
+def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=None, check_origin=None,
+                  websocket_compression=True, backpressure='block', reconnect_buffer=None):
     """Get the ``RequestHandler`` class for running PyWebIO applications in Tornado.
     The ``RequestHandler`` communicates with the browser by WebSocket protocol.
 
@@ -174,8 +336,14 @@ def webio_handler(applications, cdn=True, reconnect_timeout=0, allowed_origins=N
     else:
         check_origin_func = lambda origin, handler: _is_same_site(origin, handler) or check_origin(origin)
 
+    # tornado always compresses the whole message once permessage-deflate is negotiated, so no `min_size`
+    compression = websocket_compression_options(websocket_compression, backend='tornado',
+                                                supported=('level', 'mem_level', 'window_bits'))
+
     return _webio_handler(applications=applications, cdn=cdn, check_origin_func=check_origin_func,
-                          reconnect_timeout=reconnect_timeout)
+                          reconnect_timeout=reconnect_timeout, compression=compression,
+                          backpressure=backpressure_options(backpressure),
+                          reconnect_buffer=reconnect_buffer_options(reconnect_buffer))
 
 
 async def open_webbrowser_on_server_started(host, port):
@@ -189,10 +357,40 @@ async def open_webbrowser_on_server_started(host, port):
         logger.error('Open %s in web browser failed.' % url)
 
 
-def _setup_server(webio_handler, port=0, host='', static_dir=None, max_buffer_size=2 ** 20 * 200,
-                  **tornado_app_settings):
+def _fork_workers(workers, port=0, host=''):
+    """Bind the listening sockets and fork the worker processes
+
+    Only returns in the worker processes, the parent process waits for the workers and restarts the crashed ones.
+    Besides the shared listening sockets, each worker listens on a port of ``127.0.0.1`` for the requests forwarded
+    from other workers, see `set_worker() <pywebio.platform.utils.set_worker>`.
+
+    :return: (worker id, port, listening sockets, forwarding sockets of current worker)
+    """
     if port == 0:
         port = get_free_port()
+    number = workers or tornado.process.cpu_count()
+    sockets = tornado.netutil.bind_sockets(port, address=host or None)
+    forward_sockets = [tornado.netutil.bind_sockets(0, address='127.0.0.1') for _ in range(number)]
+    forward_ports = [socks[0].getsockname()[1] for socks in forward_sockets]
+
+    print_listen_address(host, port)
+    worker_id = tornado.process.fork_processes(number)
+
+    for idx, socks in enumerate(forward_sockets):
+        if idx != worker_id:
+            for sock in socks:
+                sock.close()
+    set_worker(worker_id, forward_ports)
+    return worker_id, port, sockets, forward_sockets[worker_id]
+
+
+def _setup_server(webio_handler, port=0, host='', static_dir=None, max_buffer_size=2 ** 20 * 200,
+                  sockets=None, **tornado_app_settings):
+    """
+    :param list sockets: The listening sockets, which are used instead of ``port`` and ``host`` when provided
+    """
+    if port == 0 and not sockets:
+        port = get_free_port()
 
     handlers = [(r"/", webio_handler)]
 
@@ -202,7 +400,11 @@ def _setup_server(webio_handler, port=0, host='', static_dir=None, max_buffer_si
     handlers.append((r"/(.*)", tornado.web.StaticFileHandler, {"path": STATIC_PATH, 'default_filename': 'index.html'}))
 
     app = tornado.web.Application(handlers=handlers, **tornado_app_settings)
-    # Credit: https://stackoverflow.com/questions/19074972/content-length-too-long-when-uploading-file-using-tornado
+    if sockets:
+        # Credit: https://stackoverflow.com/questions/19074972/content-length-too-long-when-uploading-file-using-tornado
+        server = tornado.httpserver.HTTPServer(app, max_buffer_size=max_buffer_size)
+        server.add_sockets(sockets)
+        return server, port
     server = app.listen(port, address=host, max_buffer_size=max_buffer_size)
     return server, port
 
@@ -212,7 +414,11 @@ def start_server(applications: Union[Callable[[], None], List[Callable[[], None]
                  static_dir: Optional[str] = None, remote_access: bool = False, reconnect_timeout: int = 0,
                  allowed_origins: Optional[List[str]] = None, check_origin: Callable[[str], bool] = None,
                  auto_open_webbrowser: bool = False, max_payload_size: Union[int, str] = '200M',
-                 **tornado_app_settings):
+                 websocket_compression: Union[bool, dict] = True, backpressure: Union[str, dict] = 'block',
+                 reconnect_buffer: Optional[dict] = None,
+                 json_codec: str = 'auto', thread_pool: Union[int, dict] = None,
+                 asyncio_task: bool = False, loop: str = 'asyncio', event_loop_threads: int = 0,
+                 workers: int = 1, process_pool: Union[int, dict] = None, **tornado_app_settings):
     """Start a Tornado server to provide the PyWebIO application as a web service.
 
     The Tornado server communicates with the browser by WebSocket protocol.
@@ -267,14 +473,135 @@ def start_server(applications: Union[Callable[[], None], List[Callable[[], None]
         ``max_payload_size`` can be a integer indicating the number of bytes, or a string ending with `K` / `M` / `G`
         (representing kilobytes, megabytes, and gigabytes, respectively).
         E.g: ``500``, ``'40K'``, ``'3M'``
+    :param bool/dict websocket_compression: Whether to enable the permessage-deflate compression of WebSocket messages,
+        the default is ``True``. Can also use a dict to tune the compression, the available keys are:
+
+        - ``level`` : The compression level of zlib, from ``0`` to ``9``, default is ``6``.
+          Lower level costs less CPU time.
+        - ``mem_level`` : The memory level of zlib, from ``1`` to ``9``, default is ``8``.
+        - ``window_bits`` : The base-two logarithm of the compression window size of server, from ``9`` to ``15``,
+          default is ``15``. Smaller window uses less memory per connection but gets lower compression ratio.
+        - ``min_size`` : The minimum size in bytes of the messages to compress. None of the WebSocket libraries
+          of the backends can send a message uncompressed once permessage-deflate is negotiated, so this option
+          is ignored with a warning for now.
+
+        E.g: ``websocket_compression=dict(level=1, window_bits=12)``.
+        When the debug log is enabled, the number and size of the messages sent to each connection and the estimated
+        compression ratio are reported in debug log when the connection closed.
+    :param str/dict backpressure: How to deal with the clients that receive messages slower than the application
+        produces them. When the messages waiting to be written to a connection exceed ``max_buffered_size`` ,
+        the server stops sending messages to it and queues them in session until the connection catches up.
+        When the queue of a session reaches ``max_queued`` messages, the policy decides what to do:
+
+        - ``'block'`` (default): Block the application until the client catches up.
+          Coroutine-based sessions can't be blocked, so they use ``'drop_oldest'`` instead.
+        - ``'drop_oldest'`` : Drop the oldest output message in queue, the messages that the application
+          waits for a response (such as input) are never dropped.
+        - ``'collapse'`` : Remove the queued messages superseded by the new message, such as the outputs to a scope
+          which is going to be cleared, and the repeated ``pin_update()`` of the same pin widget.
+          Then block the application if the queue is still full, or drop the oldest output message in
+          coroutine-based sessions.
+
+        Can also use a dict to specify the thresholds,
+        e.g. ``dict(policy='collapse', max_buffered_size='4M', max_queued=500)``.
+        ``max_buffered_size`` (default ``'1M'``) accepts the same format as ``max_payload_size`` ,
+        set it to ``0`` to never stop sending; ``max_queued`` defaults to ``1000`` .
+        The backpressure metrics of each session, including the number and the approximate bytes of the queued
+        messages, are reported in debug log when the connection closed.
+    :param dict reconnect_buffer: The size of the buffer that keeps the latest messages sent to each session,
+        used to resend the messages lost in an unexpected disconnection when ``reconnect_timeout`` is set.
+        A dict with ``max_messages`` (default ``1000`` ) and ``max_bytes`` (default ``'4M'`` , accepts the same
+        format as ``max_payload_size`` ) keys, the oldest messages are evicted when either limit is exceeded.
+        If some lost messages are evicted before the client reconnects, the page can't be recovered,
+        so the session is closed and the user is told to reload the page.
+        The chunks sent by `download() <pywebio.session.download>` for iterable content are not kept in buffer,
+        the client aborts such a download when some of its chunks are lost in reconnection.
+    :param str json_codec: The JSON library used to encode and decode the messages between server and browser,
+        can be ``'orjson'`` , ``'ujson'`` , ``'json'`` (the standard library) or ``'auto'`` (default).
+        ``'auto'`` uses the fastest one installed, in the order of orjson, ujson, json.
+        The messages sent by the codecs are identical for browser. See also `set_json_codec() <pywebio.platform.set_json_codec>`
+    :param int/dict thread_pool: Run the thread-based sessions in a bounded thread pool instead of starting a new thread
+        for each session, so that a traffic spike can't exhaust the server. The value is the max number of
+        sessions running at the same time, or a dict with the keys:
+
+        - ``max_workers`` : The max number of worker threads, i.e. sessions running at the same time.
+        - ``max_pending`` : The max number of sessions waiting for a free worker, the users beyond it are told
+          that the server is busy. Default is ``0`` , which means no limit.
+        - ``idle_timeout`` : The idle worker threads exit after this many seconds, default is ``60`` .
+        - ``callback_workers`` : The max number of threads running the callbacks (not in ``serial_mode``)
+          of all sessions, default is ``64`` .
+        - ``max_inflight_callbacks`` : The max number of callbacks running at the same time in a session, the other
+          callbacks of the session wait in order. Default is ``8`` .
+
+        The callbacks waiting for user input (e.g. calling ``input()`` in a button's callback) don't count against
+        ``callback_workers`` and ``max_inflight_callbacks`` .
+        The users waiting for a free worker see a waiting message until their sessions start.
+        Use `pywebio.session.main_task_pool_metrics()` to get the queue depth and wait time of the pool.
+        Default is ``None`` , which means no limit. Coroutine-based sessions are not affected.
+    :param bool asyncio_task: Run the tasks of coroutine-based sessions as ``asyncio.Task`` instead of stepping the
+        coroutines by PyWebIO. It reduces the overhead of each ``await`` , makes ``asyncio.current_task()`` available
+        in the session, and the coroutines in asyncio can be awaited directly without `run_asyncio_coroutine()
+        <pywebio.session.run_asyncio_coroutine>` . When the session closes, the tasks are cancelled, and the
+        PyWebIO interactive function being awaited raises ``SessionClosedException`` . Default is ``False`` .
+    :param str loop: The event loop implementation that runs the server, ``'asyncio'`` (default) or ``'uvloop'`` .
+        `uvloop <https://github.com/MagicStack/uvloop>`_ speeds up the network IO and the scheduling of coroutines,
+        it can be installed with ``pip3 install uvloop`` , and is not available on Windows.
+        If uvloop is not installed, a warning is issued and the default asyncio event loop is used.
+        The environment variable ``PYWEBIO_EVENT_LOOP`` can also be used to specify the event loop (with high
+        priority), it also applies to the script mode and `pywebio.platform.run_event_loop()` .
+    :param int event_loop_threads: Run the coroutine-based sessions in this many event loop threads instead of the
+        event loop of the server. Each new session runs in the thread with the fewest sessions, so that a session
+        busy with computation doesn't delay the network IO of the server and the sessions in the other threads.
+        Note that the threads share the GIL of Python, so the sessions only run in parallel when the computation
+        releases the GIL, e.g. in numpy, or in IO. The event loops of the threads are created by the ``loop``
+        implementation. Default is ``0`` , which runs the sessions in the event loop of the server.
+    :param int workers: The number of worker processes to fork, the workers share the listening socket and each
+        runs its own sessions. ``0`` means the number of CPUs. Default is ``1`` , which runs the server in current
+        process. The sessions, thread pool and event loop threads are per worker. When a client reconnects
+        (see ``reconnect_timeout``) or downloads a file to a worker not owning its session, the request is forwarded
+        to the owner worker. The parent process restarts the crashed workers, and the ``debug`` mode doesn't
+        reload the code in multi-worker mode. Not available on Windows.
+    :param int/dict process_pool: Run the thread-based sessions in worker processes instead of the threads of the
+        server process, so that the CPU-bound sessions (e.g. pandas or numpy computation) are not serialized by
+        the GIL. Each session runs in its own process, the output and input functions and `pywebio.pin` are used
+        the same as in thread-based session. The value is the max number of sessions running at the same time,
+        or a dict with the keys:
+
+        - ``max_workers`` : The max number of worker processes, i.e. sessions running at the same time.
+        - ``warm_workers`` : The number of idle worker processes started in advance, so that a new session doesn't
+          wait for the process to start and import the app. Default is ``1`` .
+        - ``max_pending`` : The max number of sessions waiting for a free worker, the users beyond it are told
+          that the server is busy. Default is ``0`` , which means no limit.
+        - ``start_method`` : The start method of the worker processes in ``multiprocessing`` module,
+          default is ``'spawn'`` .
+
+        The worker processes import the module of the app, so the apps must be defined at the top level of a
+        module, and the code starting the server must be guarded by ``if __name__ == '__main__':`` .
+        The other apps (such as lambda or nested function) still run in the server process.
+        ``pywebio.session.info.request`` is ``None`` in worker processes, and the module-level state is not
+        shared between sessions. Default is ``None`` , which runs the sessions in the server process.
+        Coroutine-based sessions are not affected.
     :param tornado_app_settings: Additional keyword arguments passed to the constructor of ``tornado.web.Application``.
         For details, please refer: https://www.tornadoweb.org/en/stable/web.html#tornado.web.Application.settings
     """
+    worker_id, sockets, forward_sockets = None, None, None
+    if workers != 1:
+        # fork before creating any event loop or thread
+        worker_id, port, sockets, forward_sockets = _fork_workers(workers, port=port, host=host)
+
+    loop_factory = event_loop_factory(loop)
+    if loop_factory:
+        asyncio.set_event_loop(loop_factory())
+    CoroutineBasedSession.set_event_loop_threads(event_loop_threads, loop_factory)
     set_ioloop(tornado.ioloop.IOLoop.current())  # to enable bokeh app
 
     cdn = cdn_validation(cdn, 'warn')  # if CDN is not available, warn user and disable CDN
 
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
 
     # covered `os.environ.get()` func with `bool()` to prevent type check error
     debug = Session.debug = bool(os.environ.get('PYWEBIO_DEBUG', debug))
@@ -286,12 +613,21 @@ def start_server(applications: Union[Callable[[], None], List[Callable[[], None]
     tornado_app_settings['websocket_max_message_size'] = parse_file_size(
         tornado_app_settings['websocket_max_message_size'])
     tornado_app_settings['debug'] = debug
+    if worker_id is not None:
+        tornado_app_settings.setdefault('autoreload', False)  # autoreload is incompatible with multi-process mode
     handler = webio_handler(applications, cdn, allowed_origins=allowed_origins, check_origin=check_origin,
-                            reconnect_timeout=reconnect_timeout)
-    _, port = _setup_server(webio_handler=handler, port=port, host=host, static_dir=static_dir,
-                            max_buffer_size=max_payload_size, **tornado_app_settings)
-
-    print_listen_address(host, port)
+                            reconnect_timeout=reconnect_timeout, websocket_compression=websocket_compression,
+                            backpressure=backpressure, reconnect_buffer=reconnect_buffer)
+    server, port = _setup_server(webio_handler=handler, port=port, host=host, static_dir=static_dir,
+                                 max_buffer_size=max_payload_size, sockets=sockets, **tornado_app_settings)
+
+    if worker_id is not None:
+        server.add_sockets(forward_sockets)
+        if worker_id != 0:  # only the first worker opens browser and starts remote access
+            tornado.ioloop.IOLoop.current().start()
+            return
+    else:
+        print_listen_address(host, port)
 
     if auto_open_webbrowser:
         tornado.ioloop.IOLoop.current().spawn_callback(open_webbrowser_on_server_started, host or '127.0.0.1', port)
@@ -312,15 +648,23 @@ def start_server_in_current_thread_session():
     websocket_conn_opened = threading.Event()
     thread = threading.current_thread()
 
-    class SingleSessionWSHandler(_webio_handler(cdn=False)):
+    class SingleSessionWSHandler(_webio_handler(cdn=False, compression={})):
         session: ScriptModeSession = None
         instance: typing.ClassVar = None
         closed = False
 
         def send_msg_to_client(self, session):
-            for msg in session.get_task_commands():
+            msgs = session.get_task_commands()
+            if not msgs:
+                return
+            try:  # send the pending messages in one frame
+                self.write_message(json_dumps(msgs[0] if len(msgs) == 1 else msgs))
+                return
+            except TypeError:
+                pass
+            for msg in msgs:
                 try:
-                    self.write_message(json.dumps(msg))
+                    self.write_message(json_dumps(msg))
                 except TypeError as e:
                     logger.exception('Data serialization error: %s\n'
                                      'This may be because you pass the wrong type of parameter to the function'
@@ -346,7 +690,7 @@ def start_server_in_current_thread_session():
             if isinstance(data, bytes):
                 event = deserialize_binary_event(data)
             else:
-                event = json.loads(data)
+                event = json_loads(data)
             if event is None:
                 return
             self.session.send_client_event(event)
@@ -397,7 +741,8 @@ def start_server_in_current_thread_session():
         app_log.setLevel(logging.ERROR)
         gen_log.setLevel(logging.ERROR)
 
-        loop = asyncio.new_event_loop()
+        # script mode can only choose the event loop by the `PYWEBIO_EVENT_LOOP` environment variable
+        loop = (event_loop_factory() or asyncio.new_event_loop)()
         asyncio.set_event_loop(loop)
 
         set_ioloop(tornado.ioloop.IOLoop.current())  # to enable bokeh app
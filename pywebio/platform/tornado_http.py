@@ -1,15 +1,17 @@
+import asyncio
 import os
-import json
 import logging
 
 import tornado.ioloop
+import tornado.iostream
 import tornado.web
 
 from . import page
-from ..session import Session
+from ..session import CoroutineBasedSession, Session
 from .adaptor.http import HttpContext, HttpHandler
-from .tornado import set_ioloop, _setup_server, open_webbrowser_on_server_started
-from .utils import cdn_validation, print_listen_address
+from .tornado import set_ioloop, _setup_server, open_webbrowser_on_server_started, write_file
+from .utils import cdn_validation, print_listen_address, json_dumps, set_json_codec, set_thread_pool, \
+    set_process_pool, event_loop_factory
 from ..utils import parse_file_size
 
 logger = logging.getLogger(__name__)
@@ -21,6 +23,8 @@ class TornadoHttpContext(HttpContext):
     def __init__(self, handler: tornado.web.RequestHandler):
         self.handler = handler
         self.response = b''
+        self.stream = None
+        self.file = None
 
     def request_obj(self):
         """返回当前请求对象"""
@@ -58,10 +62,28 @@ class TornadoHttpContext(HttpContext):
         # self.response.content accept str and byte
         if json_type:
             self.set_header('content-type', 'application/json')
-            self.response = json.dumps(content)
+            self.response = json_dumps(content)
         else:
             self.response = content
 
+    def set_event_stream(self, stream):
+        self.set_header('content-type', 'text/event-stream')
+        self.stream = stream
+
+    async def write_event_stream(self):
+        """Write the event stream set by `set_event_stream()` to client"""
+        try:
+            async for chunk in self.stream:
+                self.handler.write(chunk)
+                await self.handler.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            await self.stream.aclose()
+
+    def set_file(self, file, length):
+        self.file = (file, length)
+
     def get_response(self):
         """获取当前的响应对象，用于在私图函数中返回"""
         return self.response
@@ -78,11 +100,20 @@ class TornadoHttpContext(HttpContext):
 def webio_handler(applications, cdn=True,
                   session_expire_seconds=None,
                   session_cleanup_interval=None,
-                  allowed_origins=None, check_origin=None):
+                  allowed_origins=None, check_origin=None,
+                  long_poll_timeout=0, server_sent_events=False, affinity_socket_dir=None):
     """Get the ``RequestHandler`` class for running PyWebIO applications in Tornado.
     The ``RequestHandler``  communicates with the browser by HTTP protocol.
 
-    The arguments of ``webio_handler()`` have the same meaning as for :func:`pywebio.platform.tornado_http.start_server`
+    The arguments of ``webio_handler()`` have the same meaning as for :func:`pywebio.platform.tornado_http.start_server`,
+    except:
+
+    :param str affinity_socket_dir: Enable session affinity and set the directory to place the Unix sockets
+       of worker processes. Use it when the handler is served by multiple processes on the same host,
+       the requests landing on the worker that doesn't own the session are forwarded to the owner worker.
+       See :mod:`pywebio.platform.adaptor.affinity` for details.
+       The directory is created with mode ``0o700`` if not exists, and must only be accessible by the user
+       running the workers.
 
     .. versionadded:: 1.2
     """
@@ -91,7 +122,9 @@ def webio_handler(applications, cdn=True,
     handler = HttpHandler(applications=applications, cdn=cdn,
                           session_expire_seconds=session_expire_seconds,
                           session_cleanup_interval=session_cleanup_interval,
-                          allowed_origins=allowed_origins, check_origin=check_origin)
+                          allowed_origins=allowed_origins, check_origin=check_origin,
+                          long_poll_timeout=long_poll_timeout, server_sent_events=server_sent_events,
+                          affinity_socket_dir=affinity_socket_dir)
 
     class MainHandler(tornado.web.RequestHandler):
         def options(self):
@@ -103,7 +136,12 @@ def webio_handler(applications, cdn=True,
         async def get(self):
             context = TornadoHttpContext(self)
             response = await handler.handle_request_async(context)
-            self.write(response)
+            if context.stream is not None:
+                return await context.write_event_stream()
+            if context.file is not None:
+                return await write_file(self, *context.file)
+            if response:  # tornado doesn't allow body in 304 response, even an empty one
+                self.write(response)
 
     return MainHandler
 
@@ -115,6 +153,10 @@ def start_server(applications, port=8080, host='',
                  session_expire_seconds=None,
                  session_cleanup_interval=None,
                  max_payload_size='200M',
+                 long_poll_timeout=0,
+                 server_sent_events=False,
+                 json_codec='auto',
+                 thread_pool=None, asyncio_task=False, loop='asyncio', process_pool=None,
                  **tornado_app_settings):
     """Start a Tornado server to provide the PyWebIO application as a web service.
 
@@ -125,6 +167,15 @@ def start_server(applications, port=8080, host='',
     :param int session_cleanup_interval: Session cleanup interval, in seconds(default 120s).
        The server will periodically clean up expired sessions and release the resources occupied by the sessions.
     :param int/str max_payload_size: Max size of a request body which Tornado can accept.
+    :param int long_poll_timeout: Enable long polling and set the max seconds that the server holds a client's pull
+       request when there is no new message. With long polling, the messages of session are pushed to browser as soon
+       as they are produced instead of waiting for the next pull. Default is ``0``, which means use fixed interval pulling.
+    :param bool server_sent_events: Whether to push messages to browser via a
+       `Server-Sent Events <https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events>`_ stream.
+       It provides push latency close to WebSocket in the networks where WebSocket is not available.
+       The browser keeps one streaming response open and still sends the events by POST requests.
+       The browser falls back to pulling when the event stream can't be established.
+       Default is ``False``.
 
     The rest arguments of ``start_server()`` have the same meaning as for :func:`pywebio.platform.tornado.start_server`
 
@@ -136,11 +187,18 @@ def start_server(applications, port=8080, host='',
 
     cdn = cdn_validation(cdn, 'warn')
 
+    loop_factory = event_loop_factory(loop)
+    if loop_factory:
+        asyncio.set_event_loop(loop_factory())
     set_ioloop(tornado.ioloop.IOLoop.current())  # to enable bokeh app
 
     cdn = cdn_validation(cdn, 'warn')  # if CDN is not available, warn user and disable CDN
 
     page.MAX_PAYLOAD_SIZE = max_payload_size = parse_file_size(max_payload_size)
+    set_json_codec(json_codec)
+    set_thread_pool(thread_pool)
+    set_process_pool(process_pool)
+    CoroutineBasedSession.asyncio_task = asyncio_task
 
     debug = Session.debug = os.environ.get('PYWEBIO_DEBUG', debug)
 
@@ -152,7 +210,8 @@ def start_server(applications, port=8080, host='',
     handler = webio_handler(applications, cdn,
                             session_expire_seconds=session_expire_seconds,
                             session_cleanup_interval=session_cleanup_interval,
-                            allowed_origins=allowed_origins, check_origin=check_origin)
+                            allowed_origins=allowed_origins, check_origin=check_origin,
+                            long_poll_timeout=long_poll_timeout, server_sent_events=server_sent_events)
 
     _, port = _setup_server(webio_handler=handler, port=port, host=host, static_dir=static_dir,
                             max_buffer_size=parse_file_size(max_payload_size), **tornado_app_settings)
@@ -1,12 +1,24 @@
+import asyncio
 import fnmatch
 import json
+import mimetypes
 import os
+import re
 import socket
 import urllib.parse
+import zlib
+from base64 import b64encode
 from collections import defaultdict
+from email.utils import formatdate
+from functools import partial
+from typing import Optional
 
 from ..__version__ import __version__ as version
 from ..exceptions import PyWebIOWarning
+from ..session.file_store import file_store, StoredFile
+from ..session.processbased import ProcessBasedSession
+from ..session.threadbased import ThreadBasedSession
+from ..utils import parse_file_size, strip_space
 
 
 def cdn_validation(cdn, level='warn', stacklevel=3):
@@ -99,12 +111,12 @@ def deserialize_binary_event(data: bytes):
         parts.append(content)
         start_idx += size
 
-    event = json.loads(parts[0])
+    event = json_loads(parts[0])
 
     # deserialize file data
     files = defaultdict(list)
     for idx in range(1, len(parts), 2):
-        f = json.loads(parts[idx])
+        f = json_loads(parts[idx])
         f['content'] = parts[idx + 1]
 
         # Security fix: to avoid interpreting file name as path
@@ -123,6 +135,475 @@ def deserialize_binary_event(data: bytes):
     return event
 
 
+def _json_default(obj):
+    # binary data in messages is carried as base64 string in JSON
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return b64encode(obj).decode('ascii')
+    from ..io_ctrl import Output
+    return Output.json_encoder(obj)  # the `Output` and `OutputList` objects
+
+
+def _stdlib_json_codec():
+    return partial(json.dumps, default=_json_default), json.loads
+
+
+def _orjson_codec():
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(message):
+        try:
+            return orjson.dumps(message, default=_json_default, option=option).decode('utf8')
+        except TypeError:  # such as the integer exceeds 64-bit range
+            return json.dumps(message, default=_json_default)
+
+    return dumps, orjson.loads
+
+
+def _ujson_codec():
+    import ujson
+
+    def dumps(message):
+        try:
+            return ujson.dumps(message, default=_json_default, reject_bytes=True, ensure_ascii=False,
+                               escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return json.dumps(message, default=_json_default)
+
+    return dumps, ujson.loads
+
+
+JSON_CODECS = {
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+    'json': _stdlib_json_codec,
+}
+
+_json_codec = None  # the name of the JSON codec in use
+_json_dumps = _json_loads = None
+
+
+def set_json_codec(codec='auto') -> str:
+    """Set the JSON library used to serialize and deserialize the messages between server and browser.
+    The codec is shared by all the backends in current process.
+
+    :param str codec: ``'orjson'`` , ``'ujson'`` , ``'json'`` (the standard library),
+       or ``'auto'`` to use the fastest one installed, in the order of orjson, ujson, json.
+    :return: The name of the codec in use
+
+    .. versionadded:: 1.9
+    """
+    global _json_codec, _json_dumps, _json_loads
+    if codec != 'auto' and codec not in JSON_CODECS:
+        raise ValueError("Unknown JSON codec %r, must be one of 'auto', %s" %
+                         (codec, ', '.join(map(repr, JSON_CODECS))))
+
+    for name in (JSON_CODECS if codec == 'auto' else [codec]):
+        try:
+            _json_dumps, _json_loads = JSON_CODECS[name]()
+        except ImportError:
+            if codec == 'auto':
+                continue
+            raise RuntimeError(strip_space("""
+            Missing dependency package `%s` for the JSON codec.
+            You can install it with the following command:
+                pip install %s
+            """ % (name, name), n=12).strip()) from None
+        _json_codec = name
+        return name
+
+
+def json_codec() -> str:
+    """The name of the JSON codec in use"""
+    return _json_codec
+
+
+def json_dumps(message) -> str:
+    """Serialize the message sent to client to JSON"""
+    return _json_dumps(message)
+
+
+def json_loads(data):
+    """Deserialize the JSON message received from client"""
+    return _json_loads(data)
+
+
+set_json_codec('auto')
+
+
+# The short integer codes of the frequently used command names in MessagePack frames.
+# Must be kept in sync with `command_names` in webiojs/src/msgpack.ts
+MSGPACK_COMMAND_CODES = {name: code for code, name in enumerate([
+    'output', 'output_ctl', 'pin_value', 'pin_update', 'pin_wait', 'pin_onchange',
+    'input_group', 'update_input', 'destroy_form', 'run_script', 'set_env', 'download',
+    'popup', 'close_popup', 'toast', 'close_session', 'set_session_id',
+], start=1)}
+
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def msgpack_dumps(message) -> bytes:
+    """Serialize the message sent to client to MessagePack.
+
+    :param message: A command dict, or a list of command dicts.
+       The command names are replaced with the codes in ``MSGPACK_COMMAND_CODES``,
+       and the binary data is carried as MessagePack bin type.
+    """
+    import msgpack
+
+    def encode_command(cmd):
+        code = MSGPACK_COMMAND_CODES.get(cmd.get('command'))
+        if code is not None:
+            cmd = dict(cmd, command=code)
+        return cmd
+
+    if isinstance(message, list):
+        message = [encode_command(m) for m in message]
+    else:
+        message = encode_command(message)
+    return msgpack.packb(message, use_bin_type=True)
+
+
+# The valid range of the options in ``websocket_compression`` parameter
+WEBSOCKET_COMPRESSION_OPTIONS = {
+    'level': (0, 9),
+    'mem_level': (1, 9),
+    'window_bits': (9, 15),
+    'min_size': (0, 2 ** 31),
+}
+
+
+def websocket_compression_options(compression, backend='tornado', supported=tuple(WEBSOCKET_COMPRESSION_OPTIONS),
+                                  stacklevel=3):
+    """Normalize the ``websocket_compression`` parameter of the WebSocket based backends
+
+    :param bool/dict compression: ``False`` to disable permessage-deflate compression,
+       ``True`` to enable it with the default options, or a dict of options.
+    :param str backend: The backend name, used in warning message
+    :param supported: The options supported by the backend, the other options are ignored with a warning.
+    :return: ``None`` if the compression is disabled, otherwise the dict of supported options.
+    """
+    if not compression:
+        return None
+    if compression is True:
+        return {}
+
+    options = {}
+    for name, value in compression.items():
+        if name not in WEBSOCKET_COMPRESSION_OPTIONS:
+            raise ValueError("Unknown option %r in `websocket_compression`" % name)
+        low, high = WEBSOCKET_COMPRESSION_OPTIONS[name]
+        if not isinstance(value, int) or not low <= value <= high:
+            raise ValueError("Invalid value of `websocket_compression['%s']`: %r" % (name, value))
+        if name in supported:
+            options[name] = value
+
+    ignored = [name for name in compression if name not in supported]
+    if ignored:
+        import warnings
+        warnings.warn("The %s backend doesn't support the %s option(s) in `websocket_compression`, ignored." %
+                      (backend, ', '.join(map(repr, ignored))), PyWebIOWarning, stacklevel=stacklevel)
+    return options
+
+
+def limit_server_window_bits(headers, window_bits):
+    """Add ``server_max_window_bits`` parameter to the permessage-deflate offers in request headers.
+
+    The server is allowed to include this parameter in response even if the client doesn't offer it (RFC 7692),
+    and the WebSocket libraries create the compressor with the agreed parameters.
+    """
+    offers = []
+    for offer in headers.get('Sec-WebSocket-Extensions', '').split(','):
+        offer = offer.strip()
+        if offer.split(';', 1)[0].strip() == 'permessage-deflate':
+            match = re.search(r'server_max_window_bits\s*=\s*"?(\d+)"?', offer)
+            if match is None:
+                offer += '; server_max_window_bits=%d' % window_bits
+            elif int(match.group(1)) > window_bits:
+                offer = offer[:match.start()] + 'server_max_window_bits=%d' % window_bits + offer[match.end():]
+        offers.append(offer)
+    headers['Sec-WebSocket-Extensions'] = ', '.join(offers)
+
+
+class DeflateMeter:
+    """Count the messages sent to a WebSocket connection and their size after permessage-deflate compression.
+
+    The WebSocket libraries don't expose the size of the compressed frames, so the meter compresses a copy of
+    the messages with the same parameters as the library. The result is an estimate, since the client may
+    negotiate a smaller window. It doubles the compression cost, only use it when debug log is enabled.
+    """
+
+    def __init__(self, level=6, mem_level=8, window_bits=15):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+        self.messages = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def feed(self, message: bytes):
+        data = self.compressor.compress(message) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.messages += 1
+        self.raw_bytes += len(message)
+        self.wire_bytes += len(data) - 4  # the trailing 0x00 0x00 0xff 0xff is removed from the frame
+
+    def log(self, logger):
+        logger.debug('WebSocket sent %d messages in %d bytes, about %d bytes after compression (ratio %.2f)',
+                     self.messages, self.raw_bytes, self.wire_bytes, self.raw_bytes / max(self.wire_bytes, 1))
+
+
+BACKPRESSURE_POLICIES = ('block', 'drop_oldest', 'collapse')
+
+
+def backpressure_options(backpressure) -> dict:
+    """Normalize the ``backpressure`` parameter of the WebSocket based backends
+
+    :param str/dict backpressure: The policy name, or a dict with ``policy`` , ``max_buffered_size`` and
+       ``max_queued`` keys
+    :return: The dict of all the options
+    """
+    options = dict(policy='block', max_buffered_size='1M', max_queued=1000)
+    if isinstance(backpressure, str):
+        backpressure = dict(policy=backpressure)
+    for name in backpressure or {}:
+        if name not in options:
+            raise ValueError("Unknown option %r in `backpressure`" % name)
+    options.update(backpressure or {})
+    if options['policy'] not in BACKPRESSURE_POLICIES:
+        raise ValueError("Unknown backpressure policy %r, must be one of %s" %
+                         (options['policy'], ', '.join(map(repr, BACKPRESSURE_POLICIES))))
+    options['max_buffered_size'] = parse_file_size(options['max_buffered_size'])
+    return options
+
+
+def reconnect_buffer_options(reconnect_buffer) -> dict:
+    """Normalize the ``reconnect_buffer`` parameter of the WebSocket based backends
+
+    :param dict reconnect_buffer: A dict with ``max_messages`` and ``max_bytes`` keys
+    :return: The dict of all the options
+    """
+    options = dict(max_messages=1000, max_bytes='4M')
+    for name in reconnect_buffer or {}:
+        if name not in options:
+            raise ValueError("Unknown option %r in `reconnect_buffer`" % name)
+    options.update(reconnect_buffer or {})
+    options['max_bytes'] = parse_file_size(options['max_bytes'])
+    return options
+
+
+def set_thread_pool(thread_pool):
+    """Set up the thread pool which runs the main tasks of the thread-based sessions
+
+    :param int/dict thread_pool: The max number of worker threads, or a dict with ``max_workers`` ,
+       ``max_pending`` , ``idle_timeout`` , ``callback_workers`` and ``max_inflight_callbacks`` keys.
+       ``None`` or ``0`` to start a new thread for each session.
+    """
+    options = dict(max_workers=0, max_pending=0, idle_timeout=60, callback_workers=64, max_inflight_callbacks=8)
+    if not isinstance(thread_pool, dict):
+        thread_pool = dict(max_workers=thread_pool or 0)
+    for name in thread_pool:
+        if name not in options:
+            raise ValueError("Unknown option %r in `thread_pool`" % name)
+    options.update(thread_pool)
+    ThreadBasedSession.set_callback_pool(options.pop('callback_workers'), options.pop('max_inflight_callbacks'))
+    ThreadBasedSession.set_main_task_pool(**options)
+
+
+def set_process_pool(process_pool):
+    """Set up the process pool which runs the thread-based sessions in worker processes
+
+    :param int/dict process_pool: The max number of worker processes, or a dict with ``max_workers`` ,
+       ``warm_workers`` , ``max_pending`` and ``start_method`` keys.
+       ``None`` or ``0`` to run the thread-based sessions in current process.
+    """
+    options = dict(max_workers=0, warm_workers=1, max_pending=0, start_method='spawn')
+    if not isinstance(process_pool, dict):
+        process_pool = dict(max_workers=process_pool or 0)
+    for name in process_pool:
+        if name not in options:
+            raise ValueError("Unknown option %r in `process_pool`" % name)
+    options.update(process_pool)
+    ProcessBasedSession.set_process_pool(**options)
+
+
+EVENT_LOOPS = ('asyncio', 'uvloop')
+
+
+def event_loop_factory(loop='asyncio'):
+    """Get the function to create the event loop of the server
+
+    :param str loop: The event loop implementation, ``'asyncio'`` or ``'uvloop'`` .
+       The environment variable ``PYWEBIO_EVENT_LOOP`` has higher priority.
+    :return: The function to create a new event loop,
+       or ``None`` for the default asyncio event loop, so the server keeps its own way to get the loop.
+       If uvloop is not installed, warn and fallback to the default asyncio event loop.
+    """
+    loop = os.environ.get('PYWEBIO_EVENT_LOOP', loop) or 'asyncio'
+    if loop not in EVENT_LOOPS:
+        raise ValueError("Unknown event loop %r, must be one of %s" % (loop, ', '.join(map(repr, EVENT_LOOPS))))
+
+    if loop == 'asyncio':
+        return None
+
+    try:
+        import uvloop
+    except ImportError:
+        import warnings
+        warnings.warn("uvloop is not installed, fallback to the default asyncio event loop. "
+                      "You can install it with `pip install uvloop`", PyWebIOWarning, stacklevel=3)
+        return None
+    return uvloop.new_event_loop
+
+
+# The id of current worker process in multi-worker server and the forwarding ports of all workers,
+# see `set_worker()`
+_worker_id = None
+_worker_ports = []
+
+
+def set_worker(worker_id, ports):
+    """Mark current process as the worker ``worker_id`` of a multi-worker server
+
+    The ids of the sessions and the tokens of the stored files created in current process are prefixed with
+    the worker id, so that the requests of them reaching other workers can be forwarded to current process.
+
+    :param int worker_id: The id of current worker, from 0
+    :param list ports: The ports that the workers listen on ``127.0.0.1`` for the forwarded requests
+    """
+    global _worker_id, _worker_ports
+    _worker_id, _worker_ports = worker_id, list(ports)
+    file_store.token_prefix = worker_id_prefix()
+
+
+def worker_id_prefix() -> str:
+    """The prefix of the ids owned by current worker, empty string when not in a multi-worker server"""
+    return '' if _worker_id is None else '%d.' % _worker_id
+
+
+def owner_worker_port(id_) -> Optional[int]:
+    """The forwarding port of the worker owning the session or stored file with ``id_`` .
+    ``None`` when it's owned by current process or not in a multi-worker server"""
+    if _worker_id is None or not id_:
+        return None
+    worker, sep, _ = id_.partition('.')
+    if not sep or not worker.isdigit() or int(worker) == _worker_id or int(worker) >= len(_worker_ports):
+        return None
+    return _worker_ports[int(worker)]
+
+
+# The max-age of the files in file store that live until the session closes
+FILE_CACHE_MAX_AGE = 3600
+
+
+def stored_file_headers(file: StoredFile) -> dict:
+    """The ``Content-Type``, ``Content-Disposition`` and ``Cache-Control`` headers of the file in file store"""
+    content_type = mimetypes.guess_type(file.name)[0] or 'application/octet-stream'
+    ascii_name = file.name.encode('ascii', 'replace').decode('ascii').replace('"', '_').replace('\\', '_')
+    disposition = 'attachment; filename="%s"; filename*=UTF-8\'\'%s' % (
+        ascii_name, urllib.parse.quote(file.name, safe=''))
+    return {
+        'Content-Type': content_type,
+        'Content-Disposition': disposition,
+        'Cache-Control': 'private, max-age=%d' % (file.ttl or FILE_CACHE_MAX_AGE),
+    }
+
+
+def _parse_range(range_header, size):
+    """Parse the ``Range`` request header
+
+    :return: ``(start, end)`` of the requested range, the ``end`` is inclusive.
+        ``None`` if the header is not a single byte range, and the whole file should be sent.
+        Raise ``ValueError`` if the range is not satisfiable.
+    """
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:  # multiple ranges is not supported
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        return None
+    if not sep or (first is None and last is None):
+        return None
+
+    if first is None:  # suffix range: the last `last` bytes
+        first, last = max(size - last, 0), size - 1
+    elif last is None or last >= size:
+        last = size - 1
+    if first > last or first >= size:
+        raise ValueError('Range not satisfiable')
+    return first, last
+
+
+def prepare_file_response(token, request_headers):
+    """Prepare the response of the request to the file in file store, used by backends to serve
+    ``<backend address>?file=<token>`` requests. Support conditional requests and single range requests.
+
+    :param str token: The token of the file
+    :param request_headers: The case-insensitive mapping of the request headers
+    :return: ``(status, headers, file, start, length)`` . The response body is ``length`` bytes from ``start``
+        of ``file`` ( `StoredFile` ), ``file`` is ``None`` when the response has no body.
+    """
+    file = file_store.get(token)
+    try:
+        size, mtime = file.stat() if file is not None else (0, 0)
+    except OSError:
+        file = None
+    if file is None:
+        return 404, {}, None, 0, 0
+
+    etag = '"%s-%x-%x"' % (token[:8], size, int(mtime))
+    headers = stored_file_headers(file)
+    headers.update({'Accept-Ranges': 'bytes', 'ETag': etag, 'Last-Modified': formatdate(mtime, usegmt=True)})
+
+    if request_headers.get('If-None-Match') == etag:
+        return 304, headers, None, 0, 0
+
+    start, end = 0, size - 1
+    range_header = request_headers.get('Range')
+    if_range = request_headers.get('If-Range')
+    if range_header and (not if_range or if_range == etag):
+        try:
+            requested = _parse_range(range_header, size)
+        except ValueError:
+            headers['Content-Range'] = 'bytes */%s' % size
+            return 416, headers, None, 0, 0
+        if requested is not None:
+            start, end = requested
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+
+    headers['Content-Length'] = str(end - start + 1)
+    status = 206 if 'Content-Range' in headers else 200
+    return status, headers, file, start, end - start + 1
+
+
+def iter_file(file, length, chunk_size=64 * 1024):
+    """Read ``length`` bytes from the binary file object in chunks, the file is closed when finished"""
+    try:
+        while length > 0:
+            data = file.read(min(chunk_size, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def file_to_eof(file, length) -> bool:
+    """Whether the ``length`` bytes from the current position of the file object reach the end of the file.
+    The WSGI servers send the rest of the file by ``wsgi.file_wrapper`` , which may use ``sendfile()`` """
+    try:
+        return os.fstat(file.fileno()).st_size - file.tell() == length
+    except (OSError, AttributeError):
+        return False
+
+
 def get_interface_ip(family: socket.AddressFamily) -> str:
     """Get the IP address of an external interface. Used when binding to
     0.0.0.0 or :: to show a more useful URL.
@@ -157,27 +157,32 @@ r"""
 .. autofunction:: hold
 .. autofunction:: run_async
 .. autofunction:: run_asyncio_coroutine
+.. autofunction:: run_in_thread
+.. autofunction:: run_in_process
+.. autofunction:: main_task_pool_metrics
 """
 
+import os
 import threading
-from base64 import b64encode
 from functools import wraps
 
 import user_agents
 
-from .base import Session
+from .base import Session, session_context
 from .coroutinebased import CoroutineBasedSession
-from .threadbased import ThreadBasedSession, ScriptModeSession
+from .threadbased import ThreadBasedSession, ScriptModeSession, main_task_pool_metrics
+from .processbased import ProcessBasedSession
 from ..exceptions import SessionNotFoundException, SessionException
 from ..utils import iscoroutinefunction, isgeneratorfunction, run_as_function, to_coroutine, ObjectDictProxy, \
-    ReadOnlyObjectDict
+    ReadOnlyObjectDict, parse_file_size
 
 # 当前进程中正在使用的会话实现的列表
 # List of session implementations currently in use
 _active_session_cls = []
 
 __all__ = ['run_async', 'run_asyncio_coroutine', 'register_thread', 'hold', 'defer_call', 'data', 'get_info',
-           'run_js', 'eval_js', 'download', 'set_env', 'go_app', 'local', 'info']
+           'run_js', 'eval_js', 'download', 'set_env', 'go_app', 'local', 'info', 'main_task_pool_metrics',
+           'run_in_thread', 'run_in_process']
 
 
 def register_session_implement(cls):
@@ -216,6 +221,13 @@ def get_session_implement():
     if len(_active_session_cls) == 1:
         return _active_session_cls[0]
 
+    # The session of the running task is set in context
+    ctx = session_context.get()
+    if ctx is not None:
+        for cls in _active_session_cls:
+            if isinstance(ctx[0], cls):
+                return cls
+
     # 当前有多个正在使用的会话实现
     # There are currently multiple session implementations in use
     for cls in _active_session_cls:
@@ -234,10 +246,16 @@ def _start_script_mode_server():
 
 
 def get_current_session() -> "Session":
+    ctx = session_context.get()
+    if ctx is not None:
+        return type(ctx[0]).get_current_session()
     return get_session_implement().get_current_session()
 
 
 def get_current_task_id():
+    ctx = session_context.get()
+    if ctx is not None:
+        return type(ctx[0]).get_current_task_id()
     return get_session_implement().get_current_task_id()
 
 
@@ -317,11 +335,78 @@ def hold():
             return
 
 
-def download(name, content):
+def _iter_download_chunks(chunks, chunk_size):
+    """Merge the small chunks and split the large chunks of the iterable download content,
+    to make the frames in bounded size"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _download_frames(name, content, chunk_size):
+    """Generate the ``download`` commands of a chunked download,
+    the last one is marked with ``done`` """
+    from ..utils import random_str
+    chunks = _iter_download_chunks(content, chunk_size)
+    spec = dict(name=name, id=random_str(10), size=None)
+    chunk = next(chunks, b'')
+    for next_chunk in chunks:
+        yield dict(spec, content=chunk, done=False)
+        chunk = next_chunk
+    yield dict(spec, content=chunk, done=True)
+
+
+def _stream_download_in_thread(session, frames):
+    from ..io_ctrl import send_msg
+    try:
+        for spec in frames:
+            # wait the previous chunk sent to client, to keep at most one chunk in memory
+            while not session.unhandled_task_msgs.empty():
+                if session.closed():
+                    return
+                session.unhandled_task_msgs.wait_empty(1)
+            send_msg('download', spec=spec)
+    except SessionException:
+        pass
+
+
+async def _stream_download_in_coroutine(session, frames):
+    from ..io_ctrl import send_msg
+    try:
+        for spec in frames:
+            # wait the previous chunk sent to client, to keep at most one chunk in memory
+            if not session.unhandled_task_msgs.empty():
+                await session.run_asyncio_coroutine(session.wait_commands_taken())
+            send_msg('download', spec=spec)
+    except SessionException:
+        pass
+
+
+# The seconds that a file sent by `download()` is kept in file store after the last access
+DOWNLOAD_FILE_TTL = 600
+
+
+def download(name, content, chunk_size='512K'):
     """Send file to user, and the user browser will download the file to the local
 
     :param str name: File name when downloading
-    :param content: File content. It is a bytes-like object
+    :param content: File content. It can be a bytes-like object, a file path in ``pathlib.Path`` (or other
+       ``os.PathLike`` object), or an iterable of bytes-like objects (such as a generator that yields the file content
+       chunk by chunk). ``str`` is not accepted to avoid mistaking the text content for file path, use
+       ``content.encode()`` to download text, or ``pathlib.Path(content)`` to download a file path.
+    :param int/str chunk_size: The size of the chunks that the iterable ``content`` is sent in.
+       ``chunk_size`` can be an integer in bytes, or a string like ``'512K'``, ``'4M'``.
+
+    The bytes-like and file path ``content`` is served by the backend server at a short-lived URL,
+    so the browser downloads the file by a plain HTTP request and can resume the interrupted download.
+    The file path is read only when the browser downloads it.
+    The iterable ``content`` is read lazily and sent to browser in multiple chunks in background,
+    and the browser shows the download progress.
 
     Example:
 
@@ -331,10 +416,28 @@ def download(name, content):
 
         put_button('Click to download', lambda: download('hello-world.txt', b'hello world!'))
 
+    .. versionchanged:: 1.9
+       Support the ``os.PathLike`` file path and iterable ``content``.
     """
     from ..io_ctrl import send_msg
-    content = b64encode(content).decode('ascii')
-    send_msg('download', spec=dict(name=name, content=content))
+    from .file_store import file_store
+    session = get_current_session()
+    if isinstance(content, str):
+        raise TypeError("The `content` of `download()` must be bytes-like object, `pathlib.Path` or iterable of bytes, "
+                        "not str. Use `content.encode()` for text content, or `pathlib.Path(content)` for file path.")
+    if isinstance(content, (bytes, bytearray, memoryview, os.PathLike)):
+        token = file_store.add(session, name, content, ttl=DOWNLOAD_FILE_TTL)
+        return send_msg('download', spec=dict(name=name, token=token))
+
+    chunk_size = parse_file_size(chunk_size)
+    assert chunk_size > 0, "`chunk_size` must be positive"
+    frames = _download_frames(name, content, chunk_size)
+    if isinstance(session, CoroutineBasedSession):
+        session.run_async(_stream_download_in_coroutine(session, frames))
+    else:
+        t = threading.Thread(target=_stream_download_in_thread, args=(session, frames), daemon=True)
+        session.register_thread(t)
+        t.start()
 
 
 def run_js(code_, **args):
@@ -444,6 +547,68 @@ async def run_asyncio_coroutine(coro_obj):
     return await get_current_session().run_asyncio_coroutine(coro_obj)
 
 
+@check_session_impl(CoroutineBasedSession)
+async def run_in_thread(func, *args, **kwargs):
+    """Run the blocking function ``func(*args, **kwargs)`` in a thread pool, and return its result.
+    Use it to call blocking code (such as file or database IO, or the computation releasing the GIL)
+    without blocking the event loop shared by the coroutine-based sessions.
+
+    Can only be used in :ref:`coroutine-based session <coroutine_based_session>`.
+
+    The PyWebIO output functions can be called in ``func`` , the outputs are sent to the current session.
+    But the functions waiting for the response of browser (such as input functions and `eval_js()`) are
+    not available in ``func`` .
+
+    The max number of threads in pool is ``CoroutineBasedSession.run_in_thread_workers`` , ``None`` (default)
+    means the default value of ``concurrent.futures.ThreadPoolExecutor`` .
+
+    Example::
+
+        async def app():
+            def load(path):
+                put_text('Loading %s' % path)
+                with open(path) as f:
+                    return f.read()
+
+            content = await run_in_thread(load, 'data.csv')
+
+    .. versionadded:: 1.9
+    """
+    return await get_current_session().run_in_thread(func, *args, **kwargs)
+
+
+@check_session_impl(CoroutineBasedSession)
+async def run_in_process(func, *args, **kwargs):
+    """Run the function ``func(*args, **kwargs)`` in a process pool, and return its result.
+    Use it to run the CPU-bound computation in parallel, without blocking the event loop.
+
+    Can only be used in :ref:`coroutine-based session <coroutine_based_session>`.
+
+    ``func`` , the arguments and the result are pickled to and from the worker process, so ``func`` must be defined
+    at the top level of a module. The PyWebIO output functions can be called in ``func`` , the outputs are sent back
+    to the current session and shown before ``run_in_process()`` returns. But the output functions with callback
+    and the functions waiting for the response of browser (such as input functions) are not available in ``func`` .
+    ``pywebio.session.info.request`` is ``None`` in ``func`` .
+
+    The worker processes are started by the ``spawn`` method, they import the module of the app, so the code starting
+    the server must be guarded by ``if __name__ == '__main__':`` . The max number of processes in pool is
+    ``CoroutineBasedSession.run_in_process_workers`` , ``None`` (default) means the number of CPUs.
+
+    Example::
+
+        def compute(n):
+            put_text('Computing...')
+            return sum(i * i for i in range(n))
+
+        async def app():
+            res = await run_in_process(compute, 10 ** 7)
+            put_text(res)
+
+    .. versionadded:: 1.9
+    """
+    return await get_current_session().run_in_process(func, *args, **kwargs)
+
+
 @check_session_impl(ThreadBasedSession)
 def register_thread(thread: threading.Thread):
     """Register the thread so that PyWebIO interactive functions are available in the thread.
@@ -508,7 +673,8 @@ def set_env(**env_info):
     * ``auto_scroll_bottom`` (bool): Whether to automatically scroll the page to the bottom after output content,
       it is closed by default.  Note that after enabled, only outputting to ROOT scope can trigger automatic scrolling.
     * ``http_pull_interval`` (int): The period of HTTP polling messages (in milliseconds, default 1000ms),
-      only available in sessions based on HTTP connection.
+      only available in sessions based on HTTP connection. When long polling is enabled in server,
+      it's used as the retry delay after a failed pull.
     * ``input_panel_fixed`` (bool): Whether to make input panel fixed at bottom, enabled by default
     * ``input_panel_min_height`` (int): The minimum height of input panel (in pixel, default 300px),
       it should be larger than 75px. Available only when ``input_panel_fixed=True``
@@ -1,13 +1,21 @@
+import contextvars
 import logging
 import sys
 import traceback
 from collections import defaultdict
+from contextlib import contextmanager
 
 import user_agents
 from ..exceptions import SessionException
+from ..utils import LimitedSizeQueue, approx_size
 
 logger = logging.getLogger(__name__)
 
+# The ``(session, task_id)`` of the running session task, set by `Session.task_context()`.
+# Context variables are isolated between threads and asyncio tasks, so the lookup of current session
+# needs neither a registry nor a guess of the session implementation.
+session_context = contextvars.ContextVar('pywebio_session_context', default=None)
+
 
 class Session:
     """
@@ -25,6 +33,8 @@ class Session:
         pop_scope
         push_scope
         send_task_command
+        start_batch
+        end_batch
         next_client_event
         on_task_exception
         register_callback
@@ -35,6 +45,7 @@ class Session:
     由Backend调用：
         send_client_event
         get_task_commands
+        rebind_backend
         close
 
     Task和Backend都可调用：
@@ -61,10 +72,24 @@ class Session:
         self.internal_save = dict(info=session_info)  # some session related info, just for internal used
         self.save = {}  # underlying implement of `pywebio.session.data`
         self.scope_stack = defaultdict(lambda: ['ROOT'])  # task_id -> scope栈
+        self.batch_commands = {}  # task_id -> the commands collected in `batch()` of the task
 
         self.deferred_functions = []  # 会话结束时运行的函数
         self._closed = False
 
+    @contextmanager
+    def task_context(self, task_id):
+        """Set the session and task in current context, used when running the task of session
+
+        >>> with session.task_context(task_id):
+        ...     task()
+        """
+        token = session_context.set((self, task_id))
+        try:
+            yield
+        finally:
+            session_context.reset(token)
+
     def get_scope_name(self, idx):
         """获取当前任务的scope栈检索scope名
 
@@ -96,6 +121,46 @@ class Session:
     def send_task_command(self, command):
         raise NotImplementedError
 
+    def _send_task_commands(self, commands):
+        """Hand the commands to backend as a whole"""
+        raise NotImplementedError
+
+    def start_batch(self) -> bool:
+        """Start to collect the commands sent by current task, used by `pywebio.output.batch()`
+
+        :return: ``False`` if current task is already in batch
+        """
+        task_id = type(self).get_current_task_id()
+        if task_id in self.batch_commands:
+            return False
+        self.batch_commands[task_id] = []
+        return True
+
+    def end_batch(self):
+        """Stop collecting the commands of current task and hand the collected commands to backend"""
+        commands = self.batch_commands.pop(type(self).get_current_task_id(), None)
+        if commands and not self.closed():
+            self._send_task_commands(commands)
+
+    def flush_batch(self):
+        """Hand the commands collected in the batch of current task to backend, and keep the batch.
+        Called before the task waits for client event, otherwise the client never receives the command it responds to.
+        """
+        commands = self.batch_commands.get(type(self).get_current_task_id())
+        if commands and not self.closed():
+            self.batch_commands[type(self).get_current_task_id()] = []
+            self._send_task_commands(commands)
+
+    def _collect_batch_command(self, command) -> bool:
+        """Collect the command if current task is in batch, return whether the command is collected"""
+        if not self.batch_commands:
+            return False
+        commands = self.batch_commands.get(type(self).get_current_task_id())
+        if commands is None:
+            return False
+        commands.append(command)
+        return True
+
     def next_client_event(self) -> dict:
         """获取来自客户端的下一个事件。阻塞调用，若在等待过程中，会话被用户关闭，则抛出SessionClosedException异常"""
         raise NotImplementedError
@@ -106,6 +171,15 @@ class Session:
     def get_task_commands(self) -> list:
         raise NotImplementedError
 
+    def rebind_backend(self, on_task_command, on_session_close):
+        """Replace the backend callbacks passed to the constructor of session.
+        Used when another backend object takes over the session, such as the client reconnects via a new connection.
+        """
+        if self.closed():
+            return
+        self._on_task_command = on_task_command
+        self._on_session_close = on_session_close
+
     def close(self, nonblock=False):
         """Close current session
 
@@ -171,6 +245,119 @@ class Session:
         raise NotImplementedError
 
 
+class TaskCommandQueue(LimitedSizeQueue):
+    """The queue of the commands that session sends to client
+
+    When the queue is full (the client consumes the commands slower than the app produces),
+    ``policy`` decides what to do:
+
+     - ``'block'`` : Block ``put()`` until the commands in queue are taken.
+     - ``'drop_oldest'`` : Drop the oldest droppable command in queue, which is an output creating no scope or
+       container, a toast, or a pin update.
+     - ``'collapse'`` : Remove the queued commands superseded by the new command, such as the outputs to a scope
+       which is going to be cleared, and the pin updates overwritten by the new one.
+       Then block if the queue is still full.
+
+    The commands which the app waits the response of (such as ``input_group`` , ``pin_value`` ) are never dropped.
+    ``put(block=False)`` never blocks: under ``'collapse'`` policy it drops the oldest droppable command instead of
+    waiting, and the command is added even if the queue is still full.
+    """
+    POLICIES = ('block', 'drop_oldest', 'collapse')
+
+    def __init__(self, maxsize=0, policy='block'):
+        assert policy in self.POLICIES, "Unknown policy of command queue: %r" % policy
+        super().__init__(maxsize)
+        self.policy = policy
+        self.peak_size = 0  # the max number of queued commands
+        self.dropped = 0  # the number of commands dropped by 'drop_oldest' policy
+        self.collapsed = 0  # the number of commands removed by 'collapse' policy
+        self.queued_bytes = 0  # the approximate size of the queued commands
+        self.peak_bytes = 0
+
+    def put(self, command, block=True):
+        with self.not_full:
+            if self.policy == 'collapse' and self.queue:
+                self._collapse(command)
+            if 0 < self.maxsize <= self._qsize():
+                if self.policy == 'drop_oldest' or (self.policy == 'collapse' and not block):
+                    self._drop_oldest()
+                while block and 0 < self.maxsize <= self._qsize():
+                    self.not_full.wait()
+            self._put(command)
+            self.peak_size = max(self.peak_size, self._qsize())
+            self.queued_bytes += approx_size(command)
+            self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    # The output types that create no scope or container, so no later command refers to them
+    LEAF_OUTPUT_TYPES = ('text', 'html', 'markdown', 'table', 'buttons')
+
+    @classmethod
+    def _droppable(cls, command):
+        if command['command'] in ('pin_update', 'toast'):
+            return True
+        if command['command'] == 'output':
+            return cls._is_leaf_output(command['spec'])
+        # `output_ctl` (such as creating, clearing, removing or scrolling a scope) changes the page structure,
+        # dropping it makes the page out of sync
+        return False
+
+    @classmethod
+    def _is_leaf_output(cls, spec) -> bool:
+        spec = getattr(spec, 'spec', spec)  # the `Output` object which is not converted to spec yet
+        if spec.get('type') not in cls.LEAF_OUTPUT_TYPES or 'container_dom_id' in spec:
+            return False
+        if spec['type'] == 'table':  # the cell of table can be any output
+            return all(isinstance(cell, str) or cls._is_leaf_output(cell) for row in spec['data'] for cell in row)
+        return True
+
+    def _drop_oldest(self):
+        for idx, cmd in enumerate(self.queue):
+            if self._droppable(cmd):
+                del self.queue[idx]
+                self.dropped += 1
+                self.queued_bytes -= approx_size(cmd)
+                return
+
+    @staticmethod
+    def _superseded_by(command):
+        """Return the function to check whether a queued command is superseded by ``command``"""
+        spec = command.get('spec') or {}
+        if command['command'] == 'pin_update':
+            return lambda cmd: cmd['command'] == 'pin_update' and cmd['spec']['name'] == spec['name'] and \
+                               set(cmd['spec']['attributes']) <= set(spec['attributes'])
+        if command['command'] != 'output_ctl':
+            return None
+
+        # the contents of the scope are going to be cleared
+        if 'clear' in spec or 'remove' in spec:
+            scope = spec.get('clear') or spec.get('remove')
+        elif 'set_scope' in spec and spec.get('if_exist') in ('clear', 'remove', 'blank'):
+            scope = '#' + spec['set_scope']
+        else:
+            return None
+        return lambda cmd: (cmd['command'] == 'output' and cmd['spec'].get('scope') == scope) or \
+                           (cmd['command'] == 'output_ctl' and cmd['spec'].get('clear') == scope)
+
+    def _collapse(self, command):
+        superseded = self._superseded_by(command)
+        if superseded is None:
+            return
+        kept = []
+        for cmd in self.queue:
+            if superseded(cmd):
+                self.collapsed += 1
+                self.queued_bytes -= approx_size(cmd)
+            else:
+                kept.append(cmd)
+        self.queue = kept
+
+    def _get(self):
+        self.queued_bytes = 0
+        return super()._get()
+
+
 def get_session_info_from_headers(headers):
     """从Http请求头中获取会话信息
 
@@ -1,10 +1,12 @@
 import asyncio
+import concurrent.futures
+import contextvars
 import logging
 import threading
-from contextlib import contextmanager
 from functools import partial
+from typing import Optional
 
-from .base import Session
+from .base import Session, TaskCommandQueue, session_context
 from ..exceptions import SessionNotFoundException, SessionClosedException, SessionException
 from ..utils import random_str, isgeneratorfunction, iscoroutinefunction
 
@@ -22,9 +24,38 @@ class WebIOFuture:
     __await__ = __iter__  # make compatible with 'await' expression
 
 
-class _context:
-    current_session = None  # type:"CoroutineBasedSession"
-    current_task_id = None
+async def _wait_future(future: concurrent.futures.Future):
+    return await asyncio.wrap_future(future)
+
+
+def _call_in_loop(loop, func, *args):
+    """在事件循环 ``loop`` 中调用 ``func(*args)`` 。若当前正运行在 ``loop`` 中，则直接调用"""
+    if asyncio._get_running_loop() is loop:
+        func(*args)
+    else:
+        loop.call_soon_threadsafe(func, *args)
+
+
+class EventLoopThread:
+    """运行事件循环的线程，用于分片运行协程会话，见 `CoroutineBasedSession.set_event_loop_threads()`"""
+
+    def __init__(self, name, loop_factory=None):
+        """
+        :param str name: 线程名
+        :param callable loop_factory: 创建事件循环的函数，默认为 ``asyncio.new_event_loop``
+        """
+        self.loop = (loop_factory or asyncio.new_event_loop)()
+        self.sessions = 0  # 运行在该线程中的会话数
+
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), name=name, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
 
 
 class CoroutineBasedSession(Session):
@@ -42,27 +73,84 @@ class CoroutineBasedSession(Session):
     # Flask backend时，在platform.flaskrun_event_loop()时初始化
     event_loop_thread_id = None
 
+    # 分片运行会话的事件循环线程，由 set_event_loop_threads() 启动。为空时，会话运行在创建会话的事件循环中
+    event_loop_threads = []
+    _event_loop_threads_lock = threading.Lock()
+
+    unhandled_task_mq_maxsize = 1000
+
+    # 是否以 `asyncio.Task` 运行会话内的协程，见 `AsyncioTask` 。
+    # 为 False 时，由 `Task` 逐步驱动协程
+    asyncio_task = False
+
+    # `run_in_thread()` 和 `run_in_process()` 的线程池/进程池的最大工作线程/进程数，为 None 时使用
+    # `concurrent.futures.ThreadPoolExecutor` / `concurrent.futures.ProcessPoolExecutor` 的默认值
+    run_in_thread_workers = None
+    run_in_process_workers = None
+    _thread_executor = None
+    _task_process_pool = None
+    _executor_lock = threading.Lock()
+
     @classmethod
     def get_current_session(cls) -> "CoroutineBasedSession":
-        if _context.current_session is None or cls.event_loop_thread_id != threading.current_thread().ident:
+        ctx = session_context.get()
+        # 分片运行的会话的 event_loop_thread_id 为会话所在的事件循环线程
+        thread_id = threading.current_thread().ident
+        in_session_thread = ctx is not None and isinstance(ctx[0], CoroutineBasedSession) and (
+            ctx[0].event_loop_thread_id == thread_id or thread_id in ctx[0].offload_threads)
+        if not in_session_thread:
             raise SessionNotFoundException("No session found in current context!")
 
-        if _context.current_session.closed():
+        if ctx[0].closed():
             raise SessionClosedException
 
-        return _context.current_session
+        return ctx[0]
 
     @staticmethod
     def get_current_task_id():
-        if _context.current_task_id is None:
+        ctx = session_context.get()
+        if ctx is None or not isinstance(ctx[0], CoroutineBasedSession):
             raise RuntimeError("No current task found in context!")
-        return _context.current_task_id
+        return ctx[1]
 
-    def __init__(self, target, session_info, on_task_command=None, on_session_close=None):
+    @classmethod
+    def set_event_loop_threads(cls, number, loop_factory=None):
+        """启动 ``number`` 个事件循环线程，之后由 `pick_event_loop_thread()` 选择的会话分片运行在这些线程中。
+        已启动的线程不会停止，所以 ``number`` 小于已启动的线程数时不做任何操作
+
+        :param int number: 事件循环线程数
+        :param callable loop_factory: 创建事件循环的函数，默认为 ``asyncio.new_event_loop``
+        """
+        with cls._event_loop_threads_lock:
+            while len(cls.event_loop_threads) < (number or 0):
+                name = 'pywebio-event-loop-%s' % len(cls.event_loop_threads)
+                cls.event_loop_threads.append(EventLoopThread(name, loop_factory))
+
+    @classmethod
+    def pick_event_loop_thread(cls) -> "Optional[EventLoopThread]":
+        """选择运行会话数最少的事件循环线程，未启动事件循环线程时返回 None"""
+        with cls._event_loop_threads_lock:
+            if not cls.event_loop_threads:
+                return None
+            thread = min(cls.event_loop_threads, key=lambda t: t.sessions)
+            thread.sessions += 1
+            return thread
+
+    def __init__(self, target, session_info, on_task_command=None, on_session_close=None,
+                 command_queue_policy='block', command_queue_size=None, loop=None, event_loop_thread=None):
         """
         :param target: 协程函数
         :param on_task_command: 由协程内发给session的消息的处理函数
         :param on_session_close: 会话结束的处理函数。后端Backend在相应on_session_close时关闭连接时，需要保证会话内的所有消息都传送到了客户端
+        :param loop: 后端Backend的事件循环。当会话运行在其他事件循环中时， ``on_task_command`` 和 ``on_session_close``
+            在该事件循环中调用
+        :param EventLoopThread event_loop_thread: 运行会话的事件循环线程，由 `pick_event_loop_thread()` 返回。
+            默认运行在创建会话时的事件循环中
+        :param str command_queue_policy: The policy when the queue of unhandled commands is full,
+            see `TaskCommandQueue`. Since the coroutine can't be blocked, ``'block'`` falls back to ``'drop_oldest'`` ,
+            and ``'collapse'`` drops the oldest droppable command when the queue is still full after collapsing.
+        :param int command_queue_size: The max size of the queue of unhandled commands,
+            default is ``unhandled_task_mq_maxsize``
         """
         assert iscoroutinefunction(target) or isgeneratorfunction(target), ValueError(
             "CoroutineBasedSession accept coroutine function or generator function as task function")
@@ -75,13 +163,32 @@ class CoroutineBasedSession(Session):
         self._on_session_close = on_session_close or (lambda: None)
 
         # 当前会话未被Backend处理的消息
-        self.unhandled_task_msgs = []
+        if command_queue_policy == 'block':  # the coroutine can't wait for the queue in `send_task_command()`
+            command_queue_policy = 'drop_oldest'
+        self.unhandled_task_msgs = TaskCommandQueue(maxsize=command_queue_size or self.unhandled_task_mq_maxsize,
+                                                    policy=command_queue_policy)
+
+        # 正在运行 `run_in_thread()` 的函数的线程id，这些线程内可以调用 PyWebIO 输出函数
+        self.offload_threads = set()
+
+        # 等待 unhandled_task_msgs 中的消息被Backend取走的 asyncio.Future ，见 `wait_commands_taken()`
+        self._drain_waiters = []
 
         # 在创建第一个CoroutineBasedSession时 event_loop_thread_id 还未被初始化
         # 则当前线程即为运行 event loop 的线程
         if cls.event_loop_thread_id is None:
             cls.event_loop_thread_id = threading.current_thread().ident
 
+        # 运行会话的事件循环
+        self._event_loop_thread = event_loop_thread
+        if event_loop_thread is not None:
+            self._loop = event_loop_thread.loop
+            self.event_loop_thread_id = event_loop_thread.thread.ident  # shadow the class attribute
+        else:
+            self._loop = asyncio.get_event_loop()
+        # 会话运行在其他事件循环中时，需要转交到后端的事件循环中调用 on_task_command 和 on_session_close
+        self._backend_loop = loop if loop is not self._loop else None
+
         # 会话内的协程任务
         self.coros = {}  # coro_task_id -> Task()
 
@@ -92,10 +199,16 @@ class CoroutineBasedSession(Session):
         # 当前会话未结束运行(已创建和正在运行的)的协程数量。当 _alive_coro_cnt 变为 0 时，会话结束。
         self._alive_coro_cnt = 1
 
-        main_task = Task(self._start_main_task(target), session=self, on_coro_stop=self._on_task_finish)
+        # 会话的协程运行方式在会话创建时确定
+        self.asyncio_task = cls.asyncio_task
+
+        main_task = self._new_task(self._start_main_task(target), on_coro_stop=self._on_task_finish)
         self.coros[main_task.coro_id] = main_task
 
-        self._step_task(main_task)
+        if self.asyncio_task:
+            main_task.start()
+        else:
+            self._step_task(main_task)
 
     async def _start_main_task(self, target):
         await target()
@@ -103,8 +216,12 @@ class CoroutineBasedSession(Session):
             from ..session import hold
             await hold()
 
+    def _new_task(self, coro, on_coro_stop=None):
+        task_cls = AsyncioTask if self.asyncio_task else Task
+        return task_cls(coro, session=self, on_coro_stop=on_coro_stop)
+
     def _step_task(self, task, result=None):
-        asyncio.get_event_loop().call_soon_threadsafe(partial(task.step, result))
+        self._loop.call_soon_threadsafe(partial(task.step, result))
 
     def _on_task_finish(self, task: "Task"):
         self._alive_coro_cnt -= 1
@@ -115,7 +232,7 @@ class CoroutineBasedSession(Session):
 
         if self._alive_coro_cnt <= 0 and not self.closed():
             self.send_task_command(dict(command='close_session'))
-            self._on_session_close()
+            self._trigger_close_event()
             self.close()
 
     def send_task_command(self, command):
@@ -125,12 +242,35 @@ class CoroutineBasedSession(Session):
         """
         if self.closed():
             raise SessionClosedException()
-        self.unhandled_task_msgs.append(command)
-        self._on_task_command(self)
+        if not self._collect_batch_command(command):
+            self._send_task_commands([command])
+
+    def _send_task_commands(self, commands):
+        for command in commands:
+            self.unhandled_task_msgs.put(command, block=False)
+        if self._backend_loop:
+            self._backend_loop.call_soon_threadsafe(self._on_task_command, self)
+        elif threading.current_thread().ident in self.offload_threads:
+            self._loop.call_soon_threadsafe(self._on_task_command, self)
+        else:
+            self._on_task_command(self)
+
+    def _trigger_close_event(self):
+        """触发Backend on_session_close callback"""
+        if self._backend_loop:
+            self._backend_loop.call_soon_threadsafe(self._on_session_close)
+        else:
+            self._on_session_close()
 
     async def next_client_event(self):
         # 函数开始不需要判断 self.closed()
         # 如果会话关闭，对 get_current_session().next_client_event() 的调用会抛出SessionClosedException
+        self.flush_batch()
+        if self.asyncio_task:
+            task = self.coros.get(type(self).get_current_task_id())
+            if task is None:
+                raise SessionClosedException()
+            return await task.next_event()
         return await WebIOFuture()
 
     def send_client_event(self, event):
@@ -143,19 +283,44 @@ class CoroutineBasedSession(Session):
         if not coro:
             logger.error('coro not found, coro_id:%s', coro_id)
             return
-        self._step_task(coro, event)
+        if self.asyncio_task:
+            coro.send_event(event)
+        else:
+            self._step_task(coro, event)
 
     def get_task_commands(self):
-        msgs = self.unhandled_task_msgs
-        self.unhandled_task_msgs = []
-        return msgs
+        commands = self.unhandled_task_msgs.get()
+        if self._drain_waiters:
+            _call_in_loop(self._loop, self._wake_drain_waiters)
+        return commands
+
+    def _wake_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    async def wait_commands_taken(self):
+        """等待当前会话未被Backend处理的消息被取走，需在会话的事件循环中运行"""
+        future = self._loop.create_future()
+        self._drain_waiters.append(future)
+        # 在加入等待列表之后再检查队列，以免错过Backend在其他线程中取走消息时的唤醒
+        if self.unhandled_task_msgs.empty() or self.closed():
+            self._drain_waiters.remove(future)
+            return
+        await future
 
     def _cleanup(self):
         for t in list(self.coros.values()):  # t.close() may cause self.coros changed size
+            if self.asyncio_task:
+                # the task is cancelled, and the `next_client_event()` it's waiting raises SessionClosedException
+                t.close()
+                continue
             t.step(SessionClosedException, throw_exp=True)
             # in case that the task catch the SessionClosedException, we need to close it manually
             t.close()
         self.coros = {}  # delete session tasks
+        self._wake_drain_waiters()
 
         # reset the reference, to avoid circular reference
         self._on_session_close = None
@@ -168,7 +333,11 @@ class CoroutineBasedSession(Session):
 
         super().close()
 
-        self._cleanup()
+        if self._event_loop_thread is not None:
+            with type(self)._event_loop_threads_lock:
+                self._event_loop_thread.sessions -= 1
+        # the coroutines must be closed in the event loop running them
+        _call_in_loop(self._loop, self._cleanup)
 
     def register_callback(self, callback, mutex_mode=False):
         """ 向Session注册一个回调函数，返回回调id
@@ -178,6 +347,19 @@ class CoroutineBasedSession(Session):
         :param bool mutex_mode: 互斥模式。若为 ``True`` ，则在运行回调函数过程中，无法响应同一组件（callback_id相同）的新点击事件，仅当 ``callback`` 为协程函数时有效
         :return str: 回调id.
         """
+        if threading.current_thread().ident in self.offload_threads:
+            # 在 `run_in_thread()` 的线程中注册回调时，转交到会话的事件循环中注册
+            future = concurrent.futures.Future()
+            ctx = contextvars.copy_context()
+
+            def register():
+                try:
+                    future.set_result(ctx.run(self.register_callback, callback, mutex_mode))
+                except Exception as e:
+                    future.set_exception(e)
+
+            self._loop.call_soon_threadsafe(register)
+            return future.result()
 
         async def callback_coro():
             while True:
@@ -209,6 +391,13 @@ class CoroutineBasedSession(Session):
                         self.run_async(coro)
 
         cls = type(self)
+        if self.asyncio_task:
+            callback_task = self._new_task(callback_coro())
+            callback_task.start()
+            self.coros[callback_task.coro_id] = callback_task
+            self._need_keep_alive = True
+            return callback_task.coro_id
+
         callback_task = Task(callback_coro(), cls.get_current_session())
         # Activate task
         # Don't callback.step(), it will result in recursive calls to step()
@@ -230,18 +419,68 @@ class CoroutineBasedSession(Session):
 
         self._alive_coro_cnt += 1
 
-        task = Task(coro_obj, session=self, on_coro_stop=self._on_task_finish)
+        task = self._new_task(coro_obj, on_coro_stop=self._on_task_finish)
         self.coros[task.coro_id] = task
-        asyncio.get_event_loop().call_soon_threadsafe(task.step)
+        if self.asyncio_task:
+            task.start()
+        else:
+            self._loop.call_soon_threadsafe(task.step)
         return task.task_handle()
 
     async def run_asyncio_coroutine(self, coro_obj):
         """若会话线程和运行事件的线程不是同一个线程，需要用 asyncio_coroutine 来运行asyncio中的协程"""
         assert asyncio.iscoroutine(coro_obj), '`run_asyncio_coroutine()` only accept coroutine object'
 
+        if self.asyncio_task:
+            # the session task is an asyncio Task already, so the coroutine can be awaited directly
+            try:
+                return await coro_obj
+            except asyncio.CancelledError:
+                if self.closed():
+                    raise SessionClosedException() from None
+                raise
+
         res = await WebIOFuture(coro=coro_obj)
         return res
 
+    async def run_in_thread(self, func, *args, **kwargs):
+        """在线程池中运行 ``func(*args, **kwargs)`` 并返回其结果，``func`` 中可以调用 PyWebIO 输出函数"""
+        task_id = type(self).get_current_task_id()
+
+        def run():
+            ident = threading.current_thread().ident
+            self.offload_threads.add(ident)
+            try:
+                with self.task_context(task_id):
+                    return func(*args, **kwargs)
+            finally:
+                self.offload_threads.discard(ident)
+
+        future = self._get_thread_executor().submit(run)
+        return await self.run_asyncio_coroutine(_wait_future(future))
+
+    async def run_in_process(self, func, *args, **kwargs):
+        """在进程池中运行 ``func(*args, **kwargs)`` 并返回其结果，``func`` 中调用的 PyWebIO 输出函数的消息会被转发到当前会话"""
+        task_id = type(self).get_current_task_id()
+        pool = self._get_task_process_pool()
+        return await self.run_asyncio_coroutine(pool.run(self, task_id, func, args, kwargs))
+
+    @classmethod
+    def _get_thread_executor(cls) -> concurrent.futures.ThreadPoolExecutor:
+        with cls._executor_lock:
+            if cls._thread_executor is None:
+                cls._thread_executor = concurrent.futures.ThreadPoolExecutor(
+                    cls.run_in_thread_workers, thread_name_prefix='run_in_thread')
+            return cls._thread_executor
+
+    @classmethod
+    def _get_task_process_pool(cls):
+        from .processbased import TaskProcessPool
+        with cls._executor_lock:
+            if cls._task_process_pool is None:
+                cls._task_process_pool = TaskProcessPool(cls.run_in_process_workers)
+            return cls._task_process_pool
+
     def need_keep_alive(self) -> bool:
         return self._need_keep_alive
 
@@ -267,21 +506,12 @@ class TaskHandler:
 
 class Task:
 
-    @contextmanager
     def session_context(self):
         """
         >>> with session_context():
         ...     res = self.coros[-1].send(data)
         """
-
-        # todo issue: with 语句可能发生嵌套，导致内层with退出时，将属性置空
-        _context.current_session = self.session
-        _context.current_task_id = self.coro_id
-        try:
-            yield
-        finally:
-            _context.current_session = None
-            _context.current_task_id = None
+        return self.session.task_context(self.coro_id)
 
     @staticmethod
     def gen_coro_id(coro=None):
@@ -350,7 +580,10 @@ class Task:
     def _wakeup(self, future):
         if not future.cancelled():
             del self.pending_futures[id(future)]
-            self.step(future.result())
+            if future.exception() is not None:  # raise the error of the awaited asyncio coroutine in task
+                self.step(future.exception(), throw_exp=True)
+            else:
+                self.step(future.result())
 
     def close(self):
         if self.task_closed:
@@ -376,3 +609,108 @@ class Task:
     def task_handle(self):
         handle = TaskHandler(close=self.close, closed=lambda: self.task_closed)
         return handle
+
+
+class AsyncioTask:
+    """以 `asyncio.Task` 运行的会话协程任务
+
+    与 `Task` 的接口相同。协程由事件循环直接调度，所以可以在协程中使用 ``asyncio.current_task()`` ，
+    并可以直接 await asyncio 中的协程。会话上下文保存在 `asyncio.Task` 的 contextvars 上下文中。
+    关闭任务时取消 `asyncio.Task` ，若是由于会话关闭，任务正在等待的 `next_client_event()`
+    和 `run_asyncio_coroutine()` 会引发 `SessionClosedException` 。
+    与 `Task` 不同，任务未在等待事件时收到的浏览器事件不会被丢弃，而是按顺序排队，由之后的 `next_event()` 依次取出。
+
+    除 `close()` 外，任务的操作都在事件循环线程中进行，其他线程的调用通过 ``call_soon_threadsafe()`` 转交。
+    """
+
+    def __init__(self, coro, session: CoroutineBasedSession, on_coro_stop=None):
+        """
+        :param coro: 协程对象
+        :param session: 创建该Task的会话实例
+        :param on_coro_stop: 任务结束(正常结束或外部调用Task.close)时运行的回调
+        """
+        self.session = session
+        self.coro = coro
+        self.result = None
+        self.task_closed = False  # 任务完毕/取消
+        self.on_coro_stop = on_coro_stop or (lambda _: None)
+
+        self.coro_id = Task.gen_coro_id(self.coro)
+
+        self.loop = session._loop
+        self.task = None  # asyncio.Task, created in the event loop thread
+        # the events from browser that are not taken by the task yet, created in the event loop thread.
+        # The events arriving while the task is busy are queued and delivered in order
+        self.events = None  # type: asyncio.Queue
+
+        logger.debug('AsyncioTask[%s] created ', self.coro_id)
+
+    def start(self):
+        _call_in_loop(self.loop, self._start)
+
+    def _start(self):
+        if self.task_closed:  # closed before start
+            self.coro.close()
+            self._on_finish()
+            return
+        self.events = asyncio.Queue()
+        self.task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        # the asyncio.Task runs in a copy of context, so the setting only affects this task
+        session_context.set((self.session, self.coro_id))
+        try:
+            self.result = await self.coro
+            logger.debug('AsyncioTask[%s] finished', self.coro_id)
+        except SessionException:
+            pass
+        except asyncio.CancelledError:  # CancelledError is a subclass of Exception before Python 3.8
+            raise
+        except Exception:
+            self.session.on_task_exception()
+        finally:
+            self._on_finish()
+
+    def _on_finish(self):
+        self.task_closed = True
+        self.events = None
+
+        on_coro_stop, self.on_coro_stop = self.on_coro_stop, None  # avoid circular reference
+        if on_coro_stop:
+            on_coro_stop(self)
+        self.session = None
+
+        logger.debug('AsyncioTask[%s] closed', self.coro_id)
+
+    async def next_event(self):
+        """等待浏览器发送给该任务的下一个事件"""
+        try:
+            return await self.events.get()
+        except asyncio.CancelledError:
+            if self.session is None or self.session.closed():
+                raise SessionClosedException() from None
+            raise
+
+    def send_event(self, event):
+        _call_in_loop(self.loop, self._send_event, event)
+
+    def _send_event(self, event):
+        if self.task_closed:
+            return
+        self.events.put_nowait(event)
+
+    def close(self):
+        if self.task_closed:
+            return
+
+        self.task_closed = True
+        _call_in_loop(self.loop, self._cancel)
+
+    def _cancel(self):
+        # if the task hasn't started, `_start()` will close the coroutine
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def task_handle(self):
+        handle = TaskHandler(close=self.close, closed=lambda: self.task_closed)
+        return handle
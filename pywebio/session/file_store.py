@@ -0,0 +1,138 @@
+"""
+The store of the files sent to user by `download() <pywebio.session.download>` and
+`put_file() <pywebio.output.put_file>`
+
+The file content is registered in the store with a random token, and the browser fetches the file from
+``<backend address>?file=<token>`` , which is served by the backends with the help of
+`prepare_file_response() <pywebio.platform.utils.prepare_file_response>` .
+So the file content is not sent through the session connection, and the browser can cache the file
+and resume the interrupted download by HTTP Range requests.
+
+The files of a session are removed from the store when the session closes,
+a file registered with ``ttl`` is also removed when it hasn't been accessed for ``ttl`` seconds.
+"""
+import io
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+from ..exceptions import SessionClosedException
+
+
+class StoredFile:
+    """A file in the store, the content is a bytes object or a file path
+
+    Only ``os.PathLike`` object (such as ``pathlib.Path`` ) is treated as file path. The ``str`` content is rejected,
+    since it's ambiguous between text content and file path, and serving a path from user input exposes the
+    files on server.
+    """
+
+    def __init__(self, name, content, ttl=None):
+        self.name = name
+        self.path = None
+        self.content = None
+        if isinstance(content, str):
+            raise TypeError("The file content must be a bytes-like object or a `pathlib.Path` object, not str. "
+                            "Use `content.encode()` for text content, or `pathlib.Path(content)` for file path.")
+        if isinstance(content, os.PathLike):
+            self.path = os.path.abspath(content)
+        else:
+            self.content = content if isinstance(content, bytes) else bytes(content)
+        self.ttl = ttl
+        self.mtime = time.time()  # the modification time of bytes content
+        self.last_access = time.monotonic()
+
+    def stat(self):
+        """Return ``(size, mtime)`` of the file, raise `OSError` when the file path is not accessible"""
+        if self.path is None:
+            return len(self.content), self.mtime
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime
+
+    def open(self, start=0):
+        """Return a binary file object of the content positioned at ``start``"""
+        file = open(self.path, 'rb') if self.path is not None else io.BytesIO(self.content)
+        file.seek(start)
+        return file
+
+    def expired(self, now):
+        return self.ttl is not None and now - self.last_access > self.ttl
+
+
+class FileStore:
+    """Map the random tokens to the files, thread-safe"""
+
+    # Prepended to the tokens, marks the worker process owning the files in multi-worker server
+    token_prefix = ''
+
+    # Called with ``(token, file)`` instead of storing the file in current process.
+    # Used in the worker processes of `ProcessBasedSession`, whose files are stored in the server process.
+    forward = None
+
+    def __init__(self):
+        self._files: Dict[str, StoredFile] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def add(self, session, name, content, ttl=None) -> str:
+        """Register a file of ``session`` in the store
+
+        :param Session session: The session that owns the file, the file is removed when the session closes
+        :param str name: The file name used in download
+        :param content: The file content, a bytes-like object or a ``os.PathLike`` file path
+        :param int ttl: Remove the file when it hasn't been accessed for ``ttl`` seconds.
+            ``None`` to keep it until the session closes.
+        :return: The token of the file
+        """
+        if session.closed():
+            raise SessionClosedException
+
+        token = self.token_prefix + secrets.token_urlsafe(24)
+        file = StoredFile(name, content, ttl)
+        if self.forward is not None:
+            self.forward(token, file)
+        else:
+            self.put(session, token, file)
+        return token
+
+    def put(self, session, token, file: StoredFile):
+        """Register the ``file`` of ``session`` with the given ``token``"""
+        file.last_access = time.monotonic()
+        with self._lock:
+            self._remove_expired()
+            self._files[token] = file
+
+        tokens = session.internal_save.get('file_store_tokens')
+        if tokens is None:
+            tokens = session.internal_save['file_store_tokens'] = []
+            session.defer_call(lambda: self.remove(*tokens))
+        tokens.append(token)
+
+    def get(self, token) -> Optional[StoredFile]:
+        """Get the file of the token, return ``None`` when the token doesn't exist or expired"""
+        now = time.monotonic()
+        with self._lock:
+            file = self._files.get(token)
+            if file is None or file.expired(now):
+                self._files.pop(token, None)
+                return None
+            file.last_access = now
+            return file
+
+    def remove(self, *tokens):
+        with self._lock:
+            for token in tokens:
+                self._files.pop(token, None)
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        for token in [t for t, f in self._files.items() if f.expired(now)]:
+            del self._files[token]
+
+
+# the store shared by all the sessions in current process
+file_store = FileStore()
@@ -0,0 +1,510 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import pickle
+import threading
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+
+from .base import Session, TaskCommandQueue, session_context
+from .file_store import file_store
+from .threadbased import ThreadBasedSession, WAITING_SCOPE, _waiting_commands
+from ..exceptions import SessionNotFoundException, SessionClosedException
+from ..utils import isgeneratorfunction, iscoroutinefunction, random_str
+
+logger = logging.getLogger(__name__)
+
+"""
+基于进程的会话实现
+
+会话的任务函数运行在进程池的工作进程中，工作进程使用 `ThreadBasedSession` 运行任务函数，
+会话产生的消息和用户浏览器的事件通过管道在工作进程和服务器进程中的 `ProcessBasedSession` 之间转发，
+所以 PyWebIO 的输入输出函数的用法和基于线程的会话相同，而计算密集的会话之间不会因为 GIL 而互相阻塞。
+
+每个工作进程只运行一个会话，会话结束后进程退出。进程池会预先启动空闲的工作进程，以减小会话的启动延迟。
+"""
+
+
+def _serve_session(conn):
+    """The entry of the worker process: receive the app from ``conn`` and run it in a `ThreadBasedSession`
+
+    Messages from server process: ``('start', target, session_info, options)`` , ``('event', event)`` , ``('close',)``
+    Messages to server process: ``('commands', commands)`` , ``('file', token, file)`` , ``('close',)``
+    """
+    from . import register_session_implement
+    register_session_implement(ThreadBasedSession)
+
+    try:
+        msg = conn.recv()
+    except EOFError:  # the server process exited
+        return
+    if msg[0] != 'start':  # the pool is shut down before the worker is used
+        return
+
+    _, target, session_info, options = msg
+    Session.debug = options['debug']
+    file_store.token_prefix = options['token_prefix']
+
+    send_lock = threading.Lock()
+
+    def send(*msg):
+        with send_lock:
+            conn.send(msg)
+
+    def on_task_command(session):
+        # get the commands with lock held, so the commands are sent in order
+        with send_lock:
+            commands = session.get_task_commands()
+            if commands:
+                conn.send(('commands', commands))
+
+    file_store.forward = partial(send, 'file')
+    session = ThreadBasedSession(target, session_info, on_task_command=on_task_command,
+                                 on_session_close=partial(send, 'close'))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg[0] == 'event':
+            session.send_client_event(msg[1])
+        else:
+            break
+    session.close(nonblock=True)
+
+
+class SessionProcess:
+    """The worker process of `SessionProcessPool`, runs one session"""
+
+    # The seconds to wait for the worker process to exit after the session closes, then the process is killed
+    exit_timeout = 10
+
+    def __init__(self, pool: "SessionProcessPool"):
+        self.pool = pool
+        self.session = None  # type: ProcessBasedSession
+        self.conn, child_conn = pool.context.Pipe()
+        self.process = pool.context.Process(target=_serve_session, args=(child_conn,), name='pywebio-session')
+        self.process.start()
+        child_conn.close()
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._receive, daemon=True, name='session-process-%s' % self.process.pid).start()
+
+    def send(self, *msg) -> bool:
+        """Send message to the worker process, return ``False`` if the process has exited"""
+        with self._send_lock:
+            try:
+                self.conn.send(msg)
+                return True
+            except (OSError, ValueError):
+                return False
+
+    def stop(self):
+        """Tell the worker process to close the session and exit, kill it if it doesn't exit in time"""
+        self.send('close')
+        timer = threading.Timer(self.exit_timeout, self._kill)
+        timer.daemon = True
+        timer.start()
+
+    def _kill(self):
+        if self.process.is_alive():
+            logger.warning("The worker process %s of session doesn't exit in %s seconds, kill it",
+                           self.process.pid, self.exit_timeout)
+            self.process.kill()
+
+    def _receive(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):  # the worker process exited
+                break
+            if self.session is not None:
+                self.session._on_process_message(msg)
+        self.process.join()
+        self.conn.close()
+        if self.session is not None:
+            self.session._on_process_exit(self.process.exitcode)
+        self.pool._on_process_exit(self)
+
+
+class SessionProcessPool:
+    """The bounded pool of the worker processes which run `ProcessBasedSession`
+
+    There are at most ``max_workers`` processes running sessions, the new sessions wait in a FIFO queue for a free
+    slot, and are rejected when there are already ``max_pending`` sessions waiting (``0`` means no limit).
+    ``warm_workers`` idle processes are started in advance, so that a new session doesn't wait for the process
+    to start and import the app.
+    """
+
+    def __init__(self, max_workers, warm_workers=1, max_pending=0, start_method='spawn'):
+        """
+        :param str start_method: The start method of `multiprocessing` , ``None`` for the platform default
+        """
+        assert max_workers > 0, "The `max_workers` of process pool must be positive"
+        self.max_workers = max_workers
+        self.warm_workers = warm_workers
+        self.max_pending = max_pending
+        self.context = multiprocessing.get_context(start_method)
+
+        self._idle = deque()  # the started processes waiting for session
+        self._busy = set()  # the processes running session
+        self._pending = deque()  # the sessions waiting for a process
+        self._lock = threading.RLock()
+        self._shutdown = False
+
+        with self._lock:
+            self._dispatch()
+        atexit.register(self.shutdown)
+
+    def busy(self) -> bool:
+        """Whether a new session has to wait for a free process"""
+        return len(self._busy) + len(self._pending) >= self.max_workers
+
+    def submit(self, session: "ProcessBasedSession"):
+        """Run the session in a worker process
+
+        :return: The position of the session in queue, ``0`` when the session starts immediately,
+            ``None`` when the session is rejected because the queue is full.
+        """
+        with self._lock:
+            position = len(self._pending) + len(self._busy) + 1 - self.max_workers
+            if 0 < self.max_pending <= len(self._pending) and position > 0:
+                return None
+            self._pending.append(session)
+            self._dispatch()
+        return max(position, 0)
+
+    def discard(self, session):
+        """Remove the session from queue"""
+        with self._lock:
+            self._pending = deque(i for i in self._pending if i is not session)
+
+    def _dispatch(self, warm=True):
+        """Start the queued sessions in processes, then start the warm processes. Called with the lock held"""
+        if self._shutdown:
+            return
+        while self._pending and len(self._busy) < self.max_workers:
+            session = self._pending.popleft()
+            if session.closed():  # the user left before the session starts
+                continue
+            process = self._idle.popleft() if self._idle else SessionProcess(self)
+            self._busy.add(process)
+            session._start(process)
+
+        while warm and len(self._idle) < self.warm_workers and len(self._idle) + len(self._busy) < self.max_workers:
+            self._idle.append(SessionProcess(self))
+
+    def _on_process_exit(self, process):
+        with self._lock:
+            self._busy.discard(process)
+            crashed = process in self._idle
+            if crashed:
+                self._idle.remove(process)
+                if not self._shutdown:
+                    logger.error("The idle worker process %s of session exited, exit code: %s",
+                                 process.process.pid, process.process.exitcode)
+            # don't restart the crashed warm process, in case it crashes repeatedly, e.g. fails to import the app
+            self._dispatch(warm=not crashed)
+
+    def shutdown(self):
+        """Stop all the worker processes"""
+        with self._lock:
+            self._shutdown = True
+            processes = list(self._idle) + list(self._busy)
+        for process in processes:
+            process.send('close')
+
+
+@lru_cache(maxsize=None)
+def _picklable(func) -> bool:
+    try:
+        pickle.dumps(func)
+    except Exception:
+        return False
+    return True
+
+
+class ProcessBasedSession(Session):
+    """The proxy in server process of the session running in a worker process of `process_pool`"""
+
+    # The pool of worker processes, set by `set_process_pool()`.
+    # When it's None, the thread-based apps run in `ThreadBasedSession` in the server process.
+    process_pool = None  # type: SessionProcessPool
+
+    unhandled_task_mq_maxsize = 1000
+
+    @classmethod
+    def set_process_pool(cls, max_workers=0, warm_workers=1, max_pending=0, start_method='spawn'):
+        """Run the thread-based apps in the worker processes of a `SessionProcessPool` .
+        ``max_workers=0`` to run them in `ThreadBasedSession` in current process."""
+        if cls.process_pool is not None:
+            cls.process_pool.shutdown()
+        cls.process_pool = SessionProcessPool(max_workers, warm_workers, max_pending, start_method) \
+            if max_workers else None
+
+    @classmethod
+    def accepts(cls, target) -> bool:
+        """Whether the app ``target`` runs in process-based session: the process pool is enabled and the app
+        is a plain function which can be pickled to the worker process, i.e. defined at the top level of a module"""
+        if cls.process_pool is None or iscoroutinefunction(target) or isgeneratorfunction(target):
+            return False
+        return _picklable(target)
+
+    def __init__(self, target, session_info, on_task_command=None, on_session_close=None, loop=None,
+                 command_queue_policy='block', command_queue_size=None):
+        """
+        :param target: 会话运行的函数，需要可以被 pickle 序列化
+        :param on_task_command: 当会话产生消息时触发的处理函数
+        :param on_session_close: 会话结束的处理函数
+        :param loop: 事件循环。若 on_task_command 或者 on_session_close 中有调用使用asyncio事件循环的调用，
+            则需要事件循环实例来将回调在事件循环的线程中执行
+        :param str command_queue_policy: The policy when the queue of unhandled commands is full,
+            see `TaskCommandQueue`
+        :param int command_queue_size: The max size of the queue of unhandled commands,
+            default is ``unhandled_task_mq_maxsize``
+        """
+        super().__init__(session_info)
+
+        self._on_task_command = on_task_command or (lambda _: None)
+        self._on_session_close = on_session_close or (lambda: None)
+        self._loop = loop
+        self._target = target
+
+        self.unhandled_task_msgs = TaskCommandQueue(maxsize=command_queue_size or self.unhandled_task_mq_maxsize,
+                                                    policy=command_queue_policy)
+        self.process = None  # type: SessionProcess
+
+        pool = type(self).process_pool
+        self._queued = pool.busy()
+        if self._queued:
+            self._send_task_commands(_waiting_commands(self))
+        if pool.submit(self) is None:
+            logger.warning("Session rejected, the queue of process pool is full")
+            self._send_task_commands(_waiting_commands(self, busy=True) + [dict(command='close_session')])
+            self._trigger_close_event()
+            if not self._loop:  # otherwise the backend closes the session after sending the commands
+                self.close(nonblock=True)
+
+    def _start(self, process: SessionProcess):
+        """Run the session in ``process`` , called by the pool"""
+        self.process = process
+        process.session = self
+        if self._queued:
+            self._send_task_commands([dict(command='output_ctl', spec=dict(remove=WAITING_SCOPE))])
+        # the request object of backend can't be sent to other process
+        session_info = dict(self.internal_save['info'], request=None)
+        options = dict(debug=Session.debug, token_prefix=file_store.token_prefix)
+        if not process.send('start', self._target, session_info, options):
+            logger.error("Failed to start the session in worker process %s", process.process.pid)
+
+    def _on_process_message(self, msg):
+        """Handle the message from worker process, called in the receiving thread of the process"""
+        if self.closed():
+            return
+        if msg[0] == 'commands':
+            self._send_task_commands(msg[1])
+        elif msg[0] == 'file':
+            file_store.put(self, msg[1], msg[2])
+        elif msg[0] == 'close':
+            self._trigger_close_event()
+            self.close()
+
+    def _on_process_exit(self, exitcode):
+        if self.closed():
+            return
+        logger.error("The worker process of session exited unexpectedly, exit code: %s", exitcode)
+        self._send_task_commands([dict(command='close_session')])
+        self._trigger_close_event()
+        self.close()
+
+    def _send_task_commands(self, commands):
+        for command in commands:
+            self.unhandled_task_msgs.put(command)
+
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._on_task_command, self)
+        else:
+            self._on_task_command(self)
+
+    def send_client_event(self, event):
+        """向会话发送来自用户浏览器的事件️
+
+        :param dict event: 事件️消息
+        """
+        if self.process is None:
+            logger.debug('Session is waiting for worker process, discard event: %s', event)
+            return
+        self.process.send('event', event)
+
+    def get_task_commands(self):
+        return self.unhandled_task_msgs.get()
+
+    def _trigger_close_event(self):
+        """触发Backend on_session_close callback"""
+        if self.closed():
+            return
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._on_session_close)
+        else:
+            self._on_session_close()
+
+    def close(self, nonblock=False):
+        """关闭当前Session。由Backend调用"""
+        if self.closed():
+            return
+
+        super().close()
+
+        if self.process is not None:
+            self.process.stop()
+        elif type(self).process_pool is not None:
+            type(self).process_pool.discard(self)
+
+    def need_keep_alive(self) -> bool:
+        return False
+
+
+class ProcessTaskSession(Session):
+    """The session of the function run by `run_in_process() <pywebio.session.run_in_process>` in the worker process
+    of `TaskProcessPool` , sends the output of the function to the coroutine-based session in server process"""
+
+    queue = None  # the queue to send messages to server process, set in the worker process
+
+    @staticmethod
+    def get_current_session() -> "ProcessTaskSession":
+        ctx = session_context.get()
+        if ctx is None or not isinstance(ctx[0], ProcessTaskSession):
+            raise SessionNotFoundException("No session found in current context!")
+        if ctx[0].closed():
+            raise SessionClosedException
+        return ctx[0]
+
+    @staticmethod
+    def get_current_task_id():
+        ctx = session_context.get()
+        if ctx is None or not isinstance(ctx[0], ProcessTaskSession):
+            raise RuntimeError("No current task found in context!")
+        return ctx[1]
+
+    def __init__(self, call_id, session_info):
+        super().__init__(session_info)
+        self.call_id = call_id
+
+    def send(self, *msg):
+        self.queue.put((self.call_id,) + msg)
+
+    def send_task_command(self, command):
+        if self.closed():
+            raise SessionClosedException()
+        if not self._collect_batch_command(command):
+            self._send_task_commands([command])
+
+    def _send_task_commands(self, commands):
+        self.send('commands', commands)
+
+    def next_client_event(self):
+        raise NotImplementedError("The functions waiting for the response of browser (such as input functions) "
+                                  "are not available in `run_in_process()`")
+
+    def register_callback(self, callback, **options):
+        raise NotImplementedError("The callbacks of output functions are not available in `run_in_process()`")
+
+    def need_keep_alive(self) -> bool:
+        return False
+
+
+def _init_task_process(queue, token_prefix):
+    """The initializer of the worker processes of `TaskProcessPool`"""
+    from . import register_session_implement
+    register_session_implement(ProcessTaskSession)
+    ProcessTaskSession.queue = queue
+    file_store.token_prefix = token_prefix
+    file_store.forward = lambda token, file: ProcessTaskSession.get_current_session().send('file', token, file)
+
+
+def _run_task(call_id, task_id, session_info, scopes, func, args, kwargs):
+    """Run the function in the worker process of `TaskProcessPool` .
+    The result is sent after the outputs of the function in the queue, instead of returned by the executor,
+    so the outputs are delivered to session before the function returns in session."""
+    session = ProcessTaskSession(call_id, session_info)
+    session.scope_stack[task_id] = scopes
+    try:
+        with session.task_context(task_id):
+            result = (True, func(*args, **kwargs))
+    except Exception as e:
+        result = (False, e)
+    session.close()
+    session.send('done', result)
+
+
+def _deliver_commands(session, commands):
+    if not session.closed():
+        session._send_task_commands(commands)
+
+
+def _set_result(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class TaskProcessPool:
+    """The process pool which runs the functions of `run_in_process() <pywebio.session.run_in_process>`
+    of coroutine-based sessions
+
+    The outputs of the functions are sent back through a queue, and delivered to the sessions by a thread.
+    """
+
+    def __init__(self, max_workers=None, start_method='spawn'):
+        """
+        :param int max_workers: The max number of worker processes, ``None`` for the number of CPUs
+        :param str start_method: The start method of `multiprocessing`
+        """
+        self.max_workers = max_workers
+        self.context = multiprocessing.get_context(start_method)
+        self.queue = self.context.SimpleQueue()
+        self.executor = self._new_executor()
+        self.calls = {}  # call id -> (session, the future of the result of function)
+        threading.Thread(target=self._receive, daemon=True, name='task-process-receiver').start()
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=self.context,
+                                                      initializer=_init_task_process,
+                                                      initargs=(self.queue, file_store.token_prefix))
+
+    async def run(self, session, task_id, func, args, kwargs):
+        """Run ``func(*args, **kwargs)`` in worker process for the task ``task_id`` of ``session``"""
+        call_id = random_str(16)
+        done = asyncio.get_running_loop().create_future()
+        self.calls[call_id] = (session, done)
+        # the request object of backend can't be sent to other process
+        session_info = dict(session.internal_save['info'], request=None)
+        try:
+            future = asyncio.wrap_future(self.executor.submit(
+                _run_task, call_id, task_id, session_info, list(session.scope_stack[task_id]), func, args, kwargs))
+            await asyncio.wait([future])
+            if isinstance(future.exception(), BrokenProcessPool):  # a worker process is killed
+                self.executor = self._new_executor()
+            future.result()  # raise the error in sending the function and the result
+            ok, result = await done
+        finally:
+            del self.calls[call_id]
+        if not ok:
+            raise result
+        return result
+
+    def _receive(self):
+        while True:
+            call_id, kind, *payload = self.queue.get()
+            call = self.calls.get(call_id)
+            if call is None:
+                continue
+            session, done = call
+            if kind == 'commands':
+                # deliver the commands in the event loop of session, before the result
+                done.get_loop().call_soon_threadsafe(_deliver_commands, session, payload[0])
+            elif kind == 'file':
+                file_store.put(session, *payload)
+            elif kind == 'done':
+                done.get_loop().call_soon_threadsafe(_set_result, done, payload[0])
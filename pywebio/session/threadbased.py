@@ -1,11 +1,14 @@
 import logging
 import queue
 import threading
-from functools import wraps
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps, partial
 
-from .base import Session
+from .base import Session, TaskCommandQueue, session_context
 from ..exceptions import SessionNotFoundException, SessionClosedException, SessionException
-from ..utils import random_str, LimitedSizeQueue, isgeneratorfunction, iscoroutinefunction, \
+from ..utils import random_str, isgeneratorfunction, iscoroutinefunction, \
     get_function_name
 
 logger = logging.getLogger(__name__)
@@ -19,16 +22,201 @@ logger = logging.getLogger(__name__)
 """
 
 
+# The scope to show the waiting message when the session is queued in `main_task_pool`
+WAITING_SCOPE = '#pywebio-scope-pywebio_waiting'
+
+
+def waiting_content(language='', busy=False) -> str:
+    """The HTML content to show when the session waits for a free worker of `main_task_pool`
+
+    :param str language: The language of user
+    :param bool busy: The server is too busy to queue the session
+    """
+    if busy:
+        msg = "服务器繁忙，请稍后再试" if 'zh' in language else "The server is busy, please try again later"
+    else:
+        msg = "当前访问人数较多，正在排队中，请稍候..." if 'zh' in language else \
+            "All the workers are busy, you are in the queue, please wait..."
+    return '<div class="text-center text-muted" style="padding: 40px 0;">' \
+           '<div class="spinner-border text-info" role="status"%s></div><p class="mt-3">%s</p></div>' % \
+           (' style="display: none;"' if busy else '', msg)
+
+
+def _waiting_commands(session, busy=False):
+    info = session.internal_save['info']
+    content = waiting_content(info.get('user_language', ''), busy)
+    return [
+        dict(command='output_ctl', spec=dict(set_scope=WAITING_SCOPE[1:], container='#pywebio-scope-ROOT',
+                                             position=0, if_exist='remove')),
+        dict(command='output', spec=dict(type='html', content=content, sanitize=False,
+                                         scope=WAITING_SCOPE, position=-1)),
+    ]
+
+
+class TaskPool:
+    """The bounded pool of the daemon threads which run the tasks (main tasks or callbacks) of `ThreadBasedSession`
+
+    The worker threads are created on demand and exit after being idle for ``idle_timeout`` seconds.
+    When all the ``max_workers`` workers are busy, the new tasks wait in a FIFO queue for a free worker,
+    and are rejected when there are already ``max_pending`` tasks waiting (``0`` means no limit).
+
+    A task waiting for user (such as in ``input()`` ) can give up its slot by `blocking()` , so that it doesn't
+    starve the other tasks, the pool starts an extra worker for the pending tasks in this case.
+    """
+
+    def __init__(self, max_workers, max_pending=0, idle_timeout=60, name='task'):
+        assert max_workers > 0, "The `max_workers` of thread pool must be positive"
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.idle_timeout = idle_timeout
+        self.name = name
+
+        self._pending = deque()  # (session, func, enqueue time)
+        self._cond = threading.Condition()
+        self._workers = 0  # the number of worker threads
+        self._running = 0  # the number of the workers running task
+        self._blocked = 0  # the number of the workers running the task which gave up its slot by `blocking()`
+
+        # metrics
+        self.peak_pending = 0
+        self.started = 0  # the number of the started tasks
+        self.rejected = 0  # the number of the sessions rejected because the queue is full
+        self.waited = 0  # the number of the tasks that have waited for a free worker
+        self.total_wait = 0.0  # the total seconds the started tasks waited in queue
+        self.max_wait = 0.0
+
+    def busy(self) -> bool:
+        """Whether a new task has to wait for a free worker"""
+        return self._running + len(self._pending) >= self.max_workers
+
+    def submit(self, session, func):
+        """Run ``func`` in a worker thread
+
+        :return: The position of the task in queue, ``0`` when the task starts immediately,
+            ``None`` when the task is rejected because the queue is full.
+        """
+        with self._cond:
+            position = len(self._pending) + self._running + 1 - self.max_workers
+            # the pending tasks to be taken by the idle (or just started) workers are not waiting
+            waiting = len(self._pending) - (self._workers - self._running - self._blocked)
+            if 0 < self.max_pending <= waiting and position > 0:
+                self.rejected += 1
+                return None
+            self._pending.append((session, func, time.monotonic()))
+            self.peak_pending = max(self.peak_pending, len(self._pending))
+            self._start_worker_if_needed()
+        return max(position, 0)
+
+    def _start_worker_if_needed(self):
+        """Start a worker when there are more pending tasks than idle workers, must be called with `_cond` held"""
+        idle = self._workers - self._running - self._blocked
+        if len(self._pending) > idle and self._workers - self._blocked < self.max_workers:
+            self._workers += 1
+            threading.Thread(target=self._work, daemon=True, name='%s-worker' % self.name).start()
+        else:
+            self._cond.notify()
+
+    @contextmanager
+    def blocking(self):
+        """Don't count current task against ``max_workers`` in the context, used when the task waits for user"""
+        with self._cond:
+            self._running -= 1
+            self._blocked += 1
+            if self._pending:
+                self._start_worker_if_needed()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._blocked -= 1
+                self._running += 1
+
+    def discard(self, session):
+        """Remove the tasks of the session from queue"""
+        with self._cond:
+            self._pending = deque(i for i in self._pending if i[0] is not session)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if not self._cond.wait(self.idle_timeout) and not self._pending:
+                        self._workers -= 1
+                        return
+                session, func, enqueue_time = self._pending.popleft()
+                wait = time.monotonic() - enqueue_time
+                self._running += 1
+                self.started += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if wait >= 0.01:
+                    self.waited += 1
+            try:
+                func()
+            except Exception:
+                logger.exception('Error in running %s of session', self.name)
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return dict(max_workers=self.max_workers, workers=self._workers, running=self._running,
+                        blocked=self._blocked, pending=len(self._pending), peak_pending=self.peak_pending,
+                        started=self.started, rejected=self.rejected, waited=self.waited,
+                        max_wait=round(self.max_wait, 3),
+                        avg_wait=round(self.total_wait / self.started, 3) if self.started else 0.0)
+
+
+def main_task_pool_metrics():
+    """Return the metrics of the thread pool of the thread-based sessions, ``None`` when the pool is not enabled.
+
+    The metrics is a dict with keys:
+
+    - ``max_workers`` : The max number of worker threads
+    - ``workers`` : The number of current worker threads
+    - ``running`` : The number of the sessions running in the pool
+    - ``blocked`` : Always ``0`` , the main tasks don't give up their workers when waiting for user
+    - ``pending`` / ``peak_pending`` : The current/max number of the sessions waiting for a free worker
+    - ``started`` : The number of the sessions started by the pool
+    - ``rejected`` : The number of the sessions rejected because the waiting queue is full
+    - ``waited`` : The number of the started sessions that have waited for a free worker
+    - ``avg_wait`` / ``max_wait`` : The average/max seconds the started sessions waited in queue
+
+    .. versionadded:: 1.9
+    """
+    pool = ThreadBasedSession.main_task_pool
+    return pool.metrics() if pool else None
+
+
 # todo 线程安全
 class ThreadBasedSession(Session):
     thread2session = {}  # thread_id -> session
 
+    # The pool to run the main tasks, set by `set_main_task_pool()`.
+    # When it's None, each session runs its main task in a new thread.
+    main_task_pool = None
+
+    # The max number of threads running the non-serial callbacks of all sessions, and the max number of non-serial
+    # callbacks running at the same time in a session, set by `set_callback_pool()`.
+    # The callbacks waiting for user (such as in `input()`) are not counted.
+    callback_pool_size = 64
+    max_inflight_callbacks = 8
+    _callback_pool = None
+    _callback_pool_lock = threading.Lock()
+
     unhandled_task_mq_maxsize = 1000
     event_mq_maxsize = 100
     callback_mq_maxsize = 100
 
     @classmethod
     def get_current_session(cls) -> "ThreadBasedSession":
+        ctx = session_context.get()
+        # the closed session is looked up from `thread2session` to raise the error the same way as before
+        if ctx is not None and isinstance(ctx[0], ThreadBasedSession) and not ctx[0].closed():
+            return ctx[0]
+
+        # the threads registered by `register_thread()` are started by user without the context
         curr = id(threading.current_thread())
         session = cls.thread2session.get(curr)
         if session is None:
@@ -38,6 +226,9 @@ class ThreadBasedSession(Session):
 
     @classmethod
     def get_current_task_id(cls):
+        ctx = session_context.get()
+        if ctx is not None and isinstance(ctx[0], ThreadBasedSession):
+            return ctx[1]
         return cls._get_task_id(threading.current_thread())
 
     @staticmethod
@@ -46,13 +237,18 @@ class ThreadBasedSession(Session):
         tname = getattr(tname, '__name__', tname)
         return '%s-%s' % (tname, id(thread))
 
-    def __init__(self, target, session_info, on_task_command=None, on_session_close=None, loop=None):
+    def __init__(self, target, session_info, on_task_command=None, on_session_close=None, loop=None,
+                 command_queue_policy='block', command_queue_size=None):
         """
         :param target: 会话运行的函数. 为None时表示Script mode
         :param on_task_command: 当Task内发送Command给session的时候触发的处理函数
         :param on_session_close: 会话结束的处理函数
         :param loop: 事件循环。若 on_task_command 或者 on_session_close 中有调用使用asyncio事件循环的调用，
             则需要事件循环实例来将回调在事件循环的线程中执行
+        :param str command_queue_policy: The policy when the queue of unhandled commands is full,
+            see `TaskCommandQueue`
+        :param int command_queue_size: The max size of the queue of unhandled commands,
+            default is ``unhandled_task_mq_maxsize``
         """
         assert target is None or (not iscoroutinefunction(target)) and (not isgeneratorfunction(target)), ValueError(
             "ThreadBasedSession only accept a simple function as task function, "
@@ -65,7 +261,8 @@ class ThreadBasedSession(Session):
         self._loop = loop
 
         self.threads = []  # 注册到当前会话的线程集合
-        self.unhandled_task_msgs = LimitedSizeQueue(maxsize=self.unhandled_task_mq_maxsize)
+        self.unhandled_task_msgs = TaskCommandQueue(maxsize=command_queue_size or self.unhandled_task_mq_maxsize,
+                                                    policy=command_queue_policy)
 
         self.task_mqs = {}  # task_id -> event msg queue
         self._closed = False
@@ -74,14 +271,39 @@ class ThreadBasedSession(Session):
         self.callback_mq = None
         self.callback_thread = None
         self.callbacks = {}  # callback_id -> (callback_func, is_mutex)
+        # limit the number of in-flight non-serial callbacks, the callbacks beyond the limit wait in queue
+        self._callback_slots_lock = threading.Lock()
+        self._inflight_callbacks = 0
+        self._pending_callbacks = deque()  # (callback, data)
+        self._slotless_callback_tasks = set()  # the task ids of the callbacks which gave up their slots
+        self.pooled_callback_tasks = {}  # task id -> the callback pool which runs the non-serial callback
 
         if target is not None:
             self._start_main_task(target)
 
+    @classmethod
+    def set_main_task_pool(cls, max_workers=0, max_pending=0, idle_timeout=60):
+        """Run the main tasks of sessions in a bounded thread pool, see `TaskPool`.
+        ``max_workers=0`` to start a new thread for each session."""
+        cls.main_task_pool = TaskPool(max_workers, max_pending, idle_timeout, name='main_task') if max_workers else None
+
+    @classmethod
+    def set_callback_pool(cls, max_workers=64, max_inflight=8):
+        """Set the limits of the thread pool that runs the non-serial callbacks of sessions"""
+        assert max_workers > 0 and max_inflight > 0, "The limits of callback pool must be positive"
+        with cls._callback_pool_lock:
+            cls.callback_pool_size = max_workers
+            cls.max_inflight_callbacks = max_inflight
+            cls._callback_pool = None  # the running callbacks finish in the old pool
+
     def _start_main_task(self, target):
 
         @wraps(target)
         def main_task(target):
+            with self.task_context(self._get_task_id(threading.current_thread())):
+                run_main_task(target)
+
+        def run_main_task(target):
             try:
                 target()
             except Exception as e:
@@ -107,12 +329,37 @@ class ThreadBasedSession(Session):
                     self._trigger_close_event()
                     self.close()
 
+        pool = type(self).main_task_pool
+        if pool is not None:
+            return self._submit_main_task(pool, partial(main_task, target=target))
+
         thread = threading.Thread(target=main_task, kwargs=dict(target=target),
                                   daemon=True, name='main_task')
         self.register_thread(thread)
 
         thread.start()
 
+    def _submit_main_task(self, pool: TaskPool, main_task):
+        queued = pool.busy()
+
+        def run():
+            if self.closed():  # the user left before the task starts
+                return
+            self.register_thread(threading.current_thread())
+            if queued:
+                self.send_task_command(dict(command='output_ctl', spec=dict(remove=WAITING_SCOPE)))
+            main_task()
+
+        if queued:
+            self._send_task_commands(_waiting_commands(self))
+        if pool.submit(self, run) is None:
+            logger.warning("Session rejected, the queue of thread pool is full: %s", pool.metrics())
+            self._send_task_commands(_waiting_commands(self, busy=True) + [dict(command='close_session')])
+            self._trigger_close_event()
+            if not self._loop:  # otherwise the backend closes the session after sending the commands
+                # the HTTP backends take the final commands in the next poll, so keep them in queue
+                self.close(nonblock=True, keep_commands=True)
+
     def send_task_command(self, command):
         """向会话发送来自pywebio应用的消息
 
@@ -121,7 +368,12 @@ class ThreadBasedSession(Session):
         if self.closed():
             raise SessionClosedException()
 
-        self.unhandled_task_msgs.put(command)
+        if not self._collect_batch_command(command):
+            self._send_task_commands([command])
+
+    def _send_task_commands(self, commands):
+        for command in commands:
+            self.unhandled_task_msgs.put(command)
 
         if self._loop:
             self._loop.call_soon_threadsafe(self._on_task_command, self)
@@ -136,7 +388,22 @@ class ThreadBasedSession(Session):
         event_mq = self.get_current_session().task_mqs.get(task_id)
         if event_mq is None:
             raise SessionNotFoundException
-        event = event_mq.get()
+        self.flush_batch()
+        pool = self.pooled_callback_tasks.get(task_id)
+        if pool is not None:
+            # give up the slot of callback pool while waiting for user, otherwise the callbacks waiting for user
+            # can occupy all the workers and block the callbacks of other sessions
+            self._slotless_callback_tasks.add(task_id)
+            self._release_callback_slot()
+            with pool.blocking():
+                event = event_mq.get()
+            if event is not None:  # no need to take the slot back when the session is closed
+                with self._callback_slots_lock:
+                    # don't wait for a free slot, it may exceed `max_inflight_callbacks` for a while
+                    self._inflight_callbacks += 1
+                self._slotless_callback_tasks.discard(task_id)
+        else:
+            event = event_mq.get()
         if event is None:
             raise SessionClosedException
         return event
@@ -172,7 +439,7 @@ class ThreadBasedSession(Session):
         else:
             self._on_session_close()
 
-    def _cleanup(self, nonblock=False):
+    def _cleanup(self, nonblock=False, keep_commands=False):
         # reset the reference, to avoid circular reference
         self._on_session_close = None
         self._on_task_command = None
@@ -181,18 +448,23 @@ class ThreadBasedSession(Session):
         if not nonblock:
             self.unhandled_task_msgs.wait_empty(8)
 
-        if not self.unhandled_task_msgs.empty():
+        if not keep_commands and not self.unhandled_task_msgs.empty():
             msg = self.unhandled_task_msgs.get()
             logger.warning("%d unhandled task messages when session close. [%s]", len(msg), threading.current_thread())
 
         for t in self.threads:
             # delete registered thread
             # so the `get_current_session()` call in those thread will raise SessionNotFoundException
-            del cls.thread2session[id(t)]
+            # the worker threads of `main_task_pool` may have been registered by other session
+            if cls.thread2session.get(id(t)) is self:
+                del cls.thread2session[id(t)]
 
         if self.callback_thread:
             del cls.thread2session[id(self.callback_thread)]
 
+        if cls.main_task_pool is not None:
+            cls.main_task_pool.discard(self)
+
         def try_best_to_add_item_to_mq(mq, item, try_count=10):
             for _ in range(try_count):
                 try:
@@ -207,19 +479,26 @@ class ThreadBasedSession(Session):
         if self.callback_mq is not None:  # 回调功能已经激活, 结束回调线程
             try_best_to_add_item_to_mq(self.callback_mq, None)
 
-        for mq in self.task_mqs.values():
+        with self._callback_slots_lock:
+            self._pending_callbacks.clear()
+
+        # the pooled callbacks woken up remove their queues from `task_mqs`
+        for mq in list(self.task_mqs.values()):
             try_best_to_add_item_to_mq(mq, None)  # 消费端接收到None消息会抛出SessionClosedException异常
         self.task_mqs = {}
 
-    def close(self, nonblock=False):
-        """关闭当前Session。由Backend调用"""
+    def close(self, nonblock=False, keep_commands=False):
+        """关闭当前Session。由Backend调用
+
+        :param bool keep_commands: Keep the unhandled commands in queue for the next `get_task_commands()`
+        """
         # todo self._closed 会有竞争条件
         if self.closed():
             return
 
         super().close()
 
-        self._cleanup(nonblock=nonblock)
+        self._cleanup(nonblock=nonblock, keep_commands=keep_commands)
 
     def _activate_callback_env(self):
         """激活回调功能
@@ -243,6 +522,10 @@ class ThreadBasedSession(Session):
         logger.debug('Callback thread start')
 
     def _dispatch_callback_event(self):
+        with self.task_context(self._get_task_id(threading.current_thread())):
+            self._dispatch_callback_events()
+
+    def _dispatch_callback_events(self):
         while not self.closed():
             event = self.callback_mq.get()
             if event is None:  # 结束信号
@@ -255,24 +538,73 @@ class ThreadBasedSession(Session):
                 return
             callback, mutex = callback_info
 
-            @wraps(callback)
-            def run(callback):
-                try:
-                    callback(event['data'])
-                except Exception as e:
-                    # 子类可能会重写 get_current_session ，所以不要用 ThreadBasedSession.get_current_session 来调用
-                    if not isinstance(e, SessionException):
-                        self.on_task_exception()
-
-                # todo: good to have -> clean up from `register_thread()`
-
             if mutex:
-                run(callback)
+                self._run_callback(callback, event['data'])
             else:
-                t = threading.Thread(target=run, kwargs=dict(callback=callback),
-                                     daemon=True)
-                self.register_thread(t)
-                t.start()
+                self._submit_pooled_callback(callback, event['data'])
+
+    def _submit_pooled_callback(self, callback, data):
+        """Run the non-serial callback in callback pool, or queue it when there are already
+        ``max_inflight_callbacks`` callbacks of the session running. Never blocks the dispatcher thread."""
+        with self._callback_slots_lock:
+            if self._inflight_callbacks >= self.max_inflight_callbacks:
+                self._pending_callbacks.append((callback, data))
+                return
+            self._inflight_callbacks += 1
+        pool = self._get_callback_pool()
+        pool.submit(self, partial(self._run_pooled_callback, pool, callback, data))
+
+    def _release_callback_slot(self):
+        """Pass the slot of a finished or waiting callback to the next queued callback"""
+        with self._callback_slots_lock:
+            if not self._pending_callbacks or self.closed():
+                self._inflight_callbacks -= 1
+                return
+            callback, data = self._pending_callbacks.popleft()
+        pool = self._get_callback_pool()
+        pool.submit(self, partial(self._run_pooled_callback, pool, callback, data))
+
+    def _run_callback(self, callback, data):
+        try:
+            callback(data)
+        except Exception as e:
+            # 子类可能会重写 get_current_session ，所以不要用 ThreadBasedSession.get_current_session 来调用
+            if not isinstance(e, SessionException):
+                self.on_task_exception()
+
+    def _run_pooled_callback(self, pool, callback, data):
+        """Run the callback in the worker thread of callback pool with the context of current session"""
+        thread = threading.current_thread()
+        task_id = self._get_task_id(thread)
+        try:
+            if self.closed():
+                return
+            self.thread2session[id(thread)] = self
+            self.task_mqs[task_id] = queue.Queue(maxsize=self.event_mq_maxsize)
+            self.pooled_callback_tasks[task_id] = pool
+            try:
+                with self.task_context(task_id):
+                    self._run_callback(callback, data)
+            finally:
+                # the worker thread will be used by other sessions
+                self.pooled_callback_tasks.pop(task_id, None)
+                self.task_mqs.pop(task_id, None)
+                self.scope_stack.pop(task_id, None)
+                self.batch_commands.pop(task_id, None)
+                if self.thread2session.get(id(thread)) is self:
+                    del self.thread2session[id(thread)]
+        finally:
+            if task_id in self._slotless_callback_tasks:  # the slot was given up when waiting for user
+                self._slotless_callback_tasks.discard(task_id)
+            else:
+                self._release_callback_slot()
+
+    @classmethod
+    def _get_callback_pool(cls) -> TaskPool:
+        with cls._callback_pool_lock:
+            if cls._callback_pool is None:
+                cls._callback_pool = TaskPool(cls.callback_pool_size, name='callback')
+            return cls._callback_pool
 
     def register_callback(self, callback, serial_mode=False):
         """ 向Session注册一个回调函数，返回回调id
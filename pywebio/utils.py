@@ -240,6 +240,17 @@ class LimitedSizeQueue(queue.Queue):
         return all_data
 
 
+def approx_size(obj) -> int:
+    """The approximate size of the message in bytes, only the strings and binary data are counted"""
+    if isinstance(obj, (str, bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(approx_size(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(approx_size(v) for v in obj)
+    return 8
+
+
 async def wait_host_port(host, port, duration=10, delay=2):
     """Repeatedly try if a port on a host is open until duration seconds passed
 
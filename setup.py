@@ -17,6 +17,9 @@ extras_require = {
     'django': ['django>=2.2'],
     'aiohttp': ['aiohttp>=3.1'],
     'bokeh': ['bokeh'],
+    'msgpack': ['msgpack'],
+    'orjson': ['orjson'],
+    'uvloop': ['uvloop; sys_platform != "win32"'],
     'doc': ['sphinx', 'sphinx-tabs'],
 }
 # 可以使用 pip install pywebio[all] 安装所有额外依赖
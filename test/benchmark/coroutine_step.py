@@ -0,0 +1,74 @@
+"""
+Benchmark of stepping the tasks of coroutine-based session
+
+The main task of the session repeatedly waits for an event from browser, the event is delivered in the next
+iteration of event loop as the backend does, and then repeatedly awaits an asyncio coroutine with
+`run_asyncio_coroutine()`. Compare the steps per second of the tasks driven by `Task` with the tasks run as
+`asyncio.Task` (``CoroutineBasedSession.asyncio_task = True``).
+
+Usage::
+
+    python3 test/benchmark/coroutine_step.py [number]
+"""
+import asyncio
+import sys
+import time
+
+from pywebio.session import CoroutineBasedSession, register_session_implement, get_current_session, \
+    get_current_task_id, run_asyncio_coroutine
+
+
+async def run_session(asyncio_task, number):
+    """Return the steps per second of waiting client events and awaiting asyncio coroutines"""
+    loop = asyncio.get_event_loop()
+    finished = loop.create_future()
+
+    async def target():
+        session = get_current_session()
+        task_id = get_current_task_id()
+
+        start = time.perf_counter()
+        for _ in range(number):
+            session.send_task_command(dict(command='ping', task_id=task_id))
+            await session.next_client_event()
+        event_steps = number / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(number):
+            await run_asyncio_coroutine(asyncio.sleep(0))
+        asyncio_steps = number / (time.perf_counter() - start)
+
+        finished.set_result((event_steps, asyncio_steps))
+
+    def on_task_command(session):
+        for command in session.get_task_commands():
+            if command['command'] == 'ping':
+                event = dict(event='pong', task_id=command['task_id'], data=None)
+                loop.call_soon(session.send_client_event, event)
+
+    CoroutineBasedSession.asyncio_task = asyncio_task
+    CoroutineBasedSession(target, session_info={}, on_task_command=on_task_command)
+    return await finished
+
+
+async def benchmark(number):
+    results = {
+        'Task': await run_session(False, number),
+        'asyncio.Task': await run_session(True, number),
+    }
+    print('%-14s %14s %16s' % ('engine', 'event steps/s', 'asyncio steps/s'))
+    for name, (event_steps, asyncio_steps) in results.items():
+        print('%-14s %14.0f %16.0f' % (name, event_steps, asyncio_steps))
+    print('speedup: %.1fx (event), %.1fx (asyncio)' % (
+        results['asyncio.Task'][0] / results['Task'][0],
+        results['asyncio.Task'][1] / results['Task'][1]))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    register_session_implement(CoroutineBasedSession)
+    asyncio.run(benchmark(number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark of building the spec of nested outputs
+
+Build a 5-level nested layout with 10k cells, compare the spec conversion of `Output.dump_dict()`
+with the legacy JSON round trip implementation.
+
+Usage::
+
+    python3 test/benchmark/output_spec.py [repeat]
+"""
+import json
+import sys
+import threading
+import time
+
+from pywebio.io_ctrl import Output
+from pywebio.output import put_text, put_row, put_column, put_table, put_scrollable
+from pywebio.platform.utils import json_dumps
+from pywebio.session import ThreadBasedSession, register_session_implement_for_target
+
+
+def legacy_dump_dict(cls, data):
+    return json.loads(json.dumps(data, default=cls.json_encoder))
+
+
+def nested_layout():
+    """put_column > put_scrollable > put_table > put_column > put_row > put_text, 10 children each level"""
+    return put_column([
+        put_scrollable(put_table([[
+            put_column([
+                put_row([put_text('cell-%s-%s-%s-%s' % (a, b, c, d)) for d in range(10)])
+                for c in range(10)
+            ])
+            for b in range(10)
+        ]]), height=200)
+        for a in range(10)
+    ])
+
+
+def measure(repeat):
+    """Return the seconds of building the layout and serializing it"""
+    build, serialize = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = nested_layout()
+        spec = output.embed_data()
+        build.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        json_dumps(dict(command='output', spec=spec))
+        serialize.append(time.perf_counter() - start)
+    return min(build), min(serialize), spec
+
+
+def benchmark(repeat):
+    results = {}
+    for name, dump_dict in [('legacy', classmethod(legacy_dump_dict)), ('single-pass', None)]:
+        origin = Output.__dict__['dump_dict']
+        if dump_dict is not None:
+            Output.dump_dict = dump_dict
+        try:
+            results[name] = measure(repeat)
+        finally:
+            Output.dump_dict = origin
+
+    assert json_dumps(results['legacy'][2]) == json_dumps(results['single-pass'][2]), 'The specs are different'
+    for name, (build, serialize, _) in results.items():
+        print('%-12s build: %7.1f ms  serialize: %6.1f ms' % (name, build * 1000, serialize * 1000))
+    print('speedup of building: %.1fx' % (results['legacy'][0] / results['single-pass'][0]))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    finished = threading.Event()
+
+    def target():
+        try:
+            benchmark(repeat)
+        finally:
+            finished.set()
+
+    # the outputs need to be created in a session
+    register_session_implement_for_target(target)
+    session = ThreadBasedSession(target, session_info={}, on_task_command=lambda s: s.get_task_commands())
+    finished.wait()
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
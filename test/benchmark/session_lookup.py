@@ -0,0 +1,66 @@
+"""
+Benchmark of looking up the current session
+
+Both the coroutine-based and thread-based session implementations are active, as in a server running both kinds of
+apps. Compare the lookup in the session task, where the session is set in context, with the lookup in a thread
+registered by `register_thread()`, which walks the session implementations and `thread2session` registry
+as the lookup did before the session is kept in context.
+
+Usage::
+
+    python3 test/benchmark/session_lookup.py [number]
+"""
+import sys
+import threading
+import time
+
+from pywebio.session import ThreadBasedSession, CoroutineBasedSession, register_session_implement, \
+    get_current_session, get_current_task_id, register_thread
+
+
+def measure(number):
+    """Return the nanoseconds per lookup"""
+    session = get_current_session()
+    start = time.perf_counter()
+    for _ in range(number):
+        assert get_current_session() is session
+        get_current_task_id()
+    return (time.perf_counter() - start) / number * 1e9
+
+
+def benchmark(number):
+    results = {'session task': measure(number)}
+
+    def registered_thread():
+        results['registered thread'] = measure(number)
+
+    t = threading.Thread(target=registered_thread)
+    register_thread(t)
+    t.start()
+    t.join()
+
+    for name, ns in results.items():
+        print('%-18s %7.0f ns/lookup' % (name, ns))
+    print('speedup: %.1fx' % (results['registered thread'] / results['session task']))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    finished = threading.Event()
+
+    def target():
+        try:
+            benchmark(number)
+        finally:
+            finished.set()
+
+    # the lookup tries the coroutine-based session first when it can't find the session in context
+    register_session_implement(CoroutineBasedSession)
+    register_session_implement(ThreadBasedSession)
+    session = ThreadBasedSession(target, session_info={}, on_task_command=lambda s: s.get_task_commands())
+    finished.wait()
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of WebSocket message throughput with different event loops
+
+Start the Tornado server in a subprocess with the default asyncio event loop and with uvloop
+(the ``loop`` parameter of `start_server()`). The coroutine-based app calls `eval_js()` repeatedly,
+the client answers each ``run_script`` command immediately, so each round trip is a message in each direction.
+
+Usage::
+
+    python3 test/benchmark/websocket_loop.py [number]
+"""
+import asyncio
+import importlib.util
+import json
+import subprocess
+import sys
+import time
+
+from tornado.websocket import websocket_connect
+
+from pywebio.utils import get_free_port, wait_host_port
+
+LOOPS = ['asyncio', 'uvloop']
+
+
+def serve(loop, port, number):
+    from pywebio.platform.tornado import start_server
+    from pywebio.session import eval_js
+
+    async def app():
+        for _ in range(number):
+            await eval_js('0')
+
+    start_server(app, port=port, cdn=False, websocket_compression=False, loop=loop)
+
+
+async def client(port, number):
+    """Return the messages per second"""
+    ws = await websocket_connect('ws://127.0.0.1:%d/' % port)
+    start = time.perf_counter()
+    round_trips = 0
+    while round_trips < number:
+        message = json.loads(await ws.read_message())
+        for command in (message if isinstance(message, list) else [message]):
+            if command['command'] == 'run_script':
+                round_trips += 1
+                await ws.write_message(json.dumps(dict(event='js_yield', task_id=command['task_id'], data=0)))
+    cost = time.perf_counter() - start
+    ws.close()
+    return round_trips * 2 / cost
+
+
+def benchmark(loop, number):
+    port = get_free_port()
+    server = subprocess.Popen([sys.executable, __file__, '--serve', loop, str(port), str(number)],
+                              stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_host_port('127.0.0.1', port, duration=10, delay=0.1))
+        return asyncio.run(client(port, number))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    if sys.argv[1:2] == ['--serve']:
+        return serve(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    loops = LOOPS
+    if importlib.util.find_spec('uvloop') is None:
+        print('uvloop is not installed, only benchmark the default asyncio event loop')
+        loops = ['asyncio']
+
+    results = {loop: benchmark(loop, number) for loop in loops}
+    for loop, messages in results.items():
+        print('%-8s %8.0f messages/s' % (loop, messages))
+    if len(results) > 1:
+        print('speedup: %.1fx' % (results['uvloop'] / results['asyncio']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import threading
+import time
+import unittest
+
+from pywebio.session.base import TaskCommandQueue
+from pywebio.utils import approx_size
+
+
+def output(content, scope='#pywebio-scope-ROOT', **spec):
+    return dict(command='output', spec=dict(type='text', content=content, scope=scope, **spec))
+
+
+class TaskCommandQueueTest(unittest.TestCase):
+
+    def test_block(self):
+        q = TaskCommandQueue(maxsize=2, policy='block')
+        q.put(output('1'))
+        q.put(output('2'))
+
+        t = threading.Thread(target=q.put, args=(output('3'),), daemon=True)
+        t.start()
+        time.sleep(0.1)
+        self.assertTrue(t.is_alive(), "put() should block when the queue is full")
+
+        self.assertEqual([c['spec']['content'] for c in q.get()], ['1', '2'])
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual([c['spec']['content'] for c in q.get()], ['3'])
+
+    def test_nonblock_put(self):
+        q = TaskCommandQueue(maxsize=1, policy='block')
+        q.put(output('1'))
+        q.put(output('2'), block=False)
+        self.assertEqual(len(q.get()), 2)
+        self.assertEqual(q.peak_size, 2)
+
+    def test_drop_oldest(self):
+        q = TaskCommandQueue(maxsize=3, policy='drop_oldest')
+        q.put(dict(command='input_group', spec={}))
+        q.put(output('1'))
+        q.put(output('2'))
+        q.put(output('3'))
+        cmds = q.get()
+        self.assertEqual(cmds[0]['command'], 'input_group')
+        self.assertEqual([c['spec']['content'] for c in cmds[1:]], ['2', '3'])
+        self.assertEqual(q.dropped, 1)
+
+    def test_drop_oldest_keeps_containers(self):
+        q = TaskCommandQueue(maxsize=4, policy='drop_oldest')
+        q.put(dict(command='output_ctl', spec=dict(set_scope='a', container='#pywebio-scope-ROOT')))
+        q.put(dict(command='output', spec=dict(type='scope', contents=[])))
+        q.put(output('1', container_dom_id='pywebio-scope-b'))
+        q.put(dict(command='output', spec=dict(type='table', data=[['a', dict(type='scope', contents=[])]])))
+        q.put(output('2'), block=False)  # nothing is droppable
+        self.assertEqual(q.dropped, 0)
+        self.assertEqual(len(q.get()), 5)
+
+    def test_drop_oldest_keeps_output_ctl(self):
+        q = TaskCommandQueue(maxsize=3, policy='drop_oldest')
+        q.put(dict(command='output_ctl', spec=dict(clear='#a')))
+        q.put(dict(command='output_ctl', spec=dict(remove='#b')))
+        q.put(output('1'))
+        q.put(output('2'))
+        cmds = q.get()
+        self.assertEqual([c['spec'] for c in cmds[:2]], [dict(clear='#a'), dict(remove='#b')])
+        self.assertEqual(cmds[2]['spec']['content'], '2')
+        self.assertEqual(q.dropped, 1)
+
+    def test_droppable_commands(self):
+        self.assertTrue(TaskCommandQueue._droppable(dict(command='toast', spec={})))
+        self.assertTrue(TaskCommandQueue._droppable(dict(command='pin_update', spec={})))
+        self.assertTrue(TaskCommandQueue._droppable(
+            dict(command='output', spec=dict(type='table', data=[['a', dict(type='text', content='b')]]))))
+        self.assertFalse(TaskCommandQueue._droppable(dict(command='output_ctl', spec=dict(clear='#a'))))
+        self.assertFalse(TaskCommandQueue._droppable(dict(command='output_ctl', spec=dict(scroll_to='#a'))))
+        self.assertFalse(TaskCommandQueue._droppable(dict(command='output_ctl', spec=dict(set_scope='a'))))
+        self.assertFalse(TaskCommandQueue._droppable(dict(command='pin_value', spec={})))
+
+    def test_collapse_cleared_scope(self):
+        q = TaskCommandQueue(maxsize=10, policy='collapse')
+        q.put(output('1', scope='#a'))
+        q.put(output('2', scope='#b'))
+        q.put(output('3', scope='#a'))
+        q.put(dict(command='output_ctl', spec=dict(clear='#a')))
+        cmds = q.get()
+        self.assertEqual(len(cmds), 2)
+        self.assertEqual(cmds[0]['spec']['content'], '2')
+        self.assertEqual(cmds[1]['command'], 'output_ctl')
+        self.assertEqual(q.collapsed, 2)
+
+    def test_collapse_set_scope(self):
+        q = TaskCommandQueue(maxsize=10, policy='collapse')
+        q.put(output('1', scope='#a'))
+        q.put(dict(command='output_ctl', spec=dict(set_scope='a', if_exist='clear')))
+        q.put(dict(command='output_ctl', spec=dict(set_scope='b', if_exist=None)))
+        cmds = q.get()
+        self.assertEqual([c['command'] for c in cmds], ['output_ctl', 'output_ctl'])
+
+    def test_collapse_pin_update(self):
+        q = TaskCommandQueue(maxsize=10, policy='collapse')
+        q.put(dict(command='pin_update', spec=dict(name='a', attributes=dict(value=1))))
+        q.put(dict(command='pin_update', spec=dict(name='a', attributes=dict(value=1, label='x'))))
+        q.put(dict(command='pin_update', spec=dict(name='b', attributes=dict(value=1))))
+        q.put(dict(command='pin_update', spec=dict(name='a', attributes=dict(value=2))))
+        cmds = q.get()
+        # the update with `label` is not fully overwritten by the last one
+        self.assertEqual([(c['spec']['name'], c['spec']['attributes']) for c in cmds],
+                         [('a', dict(value=1, label='x')), ('b', dict(value=1)), ('a', dict(value=2))])
+        self.assertEqual(q.collapsed, 1)
+
+    def test_collapse_then_block(self):
+        q = TaskCommandQueue(maxsize=2, policy='collapse')
+        q.put(output('1', scope='#a'))
+        q.put(output('2', scope='#b'))
+        q.put(dict(command='output_ctl', spec=dict(clear='#a')))  # room is made by the collapse
+        self.assertEqual(len(q.get()), 2)
+
+    def test_nonblock_collapse_drops_oldest(self):
+        q = TaskCommandQueue(maxsize=2, policy='collapse')
+        q.put(output('1'))
+        q.put(output('2'))
+        q.put(output('3'), block=False)
+        self.assertEqual([c['spec']['content'] for c in q.get()], ['2', '3'])
+        self.assertEqual(q.dropped, 1)
+
+    def test_queued_bytes(self):
+        q = TaskCommandQueue(maxsize=3, policy='drop_oldest')
+        q.put(output('x' * 100, scope='#a'))
+        q.put(output('y' * 100, scope='#a'))
+        size = q.queued_bytes
+        self.assertGreater(size, 200)
+        q.put(output('z' * 100, scope='#a'))
+        q.put(output('z' * 100, scope='#a'))  # drops the oldest one
+        self.assertEqual(q.queued_bytes, size * 3 // 2)
+        self.assertEqual(q.peak_bytes, size * 3 // 2)
+        q.get()
+        self.assertEqual(q.queued_bytes, 0)
+
+        q = TaskCommandQueue(maxsize=10, policy='collapse')
+        q.put(output('x' * 100, scope='#a'))
+        clear = dict(command='output_ctl', spec=dict(clear='#a'))
+        q.put(clear)  # the output is removed by collapse
+        self.assertEqual(q.queued_bytes, approx_size(clear))
+
+
+if __name__ == '__main__':
+    unittest.main()
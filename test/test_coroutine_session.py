@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from pywebio.session.coroutinebased import CoroutineBasedSession
+
+
+def run_session(main, check, asyncio_task=False):
+    """Run the coroutine-based session of ``main`` , and call ``await check(session)`` in the event loop"""
+    CoroutineBasedSession.asyncio_task = asyncio_task
+
+    async def run():
+        session = CoroutineBasedSession(main, session_info={}, on_task_command=lambda s: None,
+                                        on_session_close=lambda: None)
+        try:
+            await check(session)
+        finally:
+            session.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        CoroutineBasedSession.asyncio_task = False
+
+
+class WaitCommandsTakenTest(unittest.TestCase):
+
+    def _test(self, asyncio_task):
+        log = []
+
+        async def main():
+            session = CoroutineBasedSession.get_current_session()
+            session.send_task_command(dict(command='toast', spec=dict(content='hi')))
+            await session.run_asyncio_coroutine(session.wait_commands_taken())
+            log.append('drained')
+
+        async def check(session):
+            await asyncio.sleep(0.1)
+            self.assertEqual(log, [])
+            self.assertEqual(session.get_task_commands()[0]['command'], 'toast')
+            await asyncio.sleep(0.1)
+            self.assertEqual(log, ['drained'])
+
+        run_session(main, check, asyncio_task)
+
+    def test_wait_commands_taken(self):
+        self._test(asyncio_task=False)
+
+    def test_wait_commands_taken_in_asyncio_task(self):
+        self._test(asyncio_task=True)
+
+    def test_command_queue_bounded(self):
+        """The coroutine can't be blocked, so the queue drops the oldest outputs instead"""
+
+        async def main():
+            session = CoroutineBasedSession.get_current_session()
+            for i in range(10):
+                session.send_task_command(dict(command='output', spec=dict(type='text', content=str(i))))
+
+        async def check(session):
+            await asyncio.sleep(0.1)
+            self.assertEqual(session.unhandled_task_msgs.policy, 'drop_oldest')
+            commands = session.get_task_commands()
+            self.assertEqual(len(commands), 5)
+            self.assertEqual(commands[-1]['command'], 'close_session')
+            self.assertEqual([c['spec']['content'] for c in commands[:-1]], ['6', '7', '8', '9'])
+
+        CoroutineBasedSession.unhandled_task_mq_maxsize, maxsize = 5, CoroutineBasedSession.unhandled_task_mq_maxsize
+        try:
+            run_session(main, check)
+        finally:
+            CoroutineBasedSession.unhandled_task_mq_maxsize = maxsize
+
+
+class AsyncioTaskTest(unittest.TestCase):
+
+    def test_events_queued_while_busy(self):
+        got = []
+
+        async def main():
+            session = CoroutineBasedSession.get_current_session()
+            got.append((await session.next_client_event())['data'])
+            await asyncio.sleep(0.2)  # the events arrive while the task is busy
+            for _ in range(3):
+                got.append((await session.next_client_event())['data'])
+
+        async def check(session):
+            await asyncio.sleep(0.05)
+            task_id, = session.coros
+            for i in range(4):
+                session.send_client_event(dict(event='input_event', task_id=task_id, data=i))
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.3)
+            self.assertEqual(got, [0, 1, 2, 3])
+
+        run_session(main, check, asyncio_task=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import pathlib
+import tempfile
+import time
+import unittest
+
+from pywebio.exceptions import SessionClosedException
+from pywebio.platform.utils import _parse_range, prepare_file_response
+from pywebio.session.file_store import FileStore, StoredFile, file_store
+
+
+class Session:
+    """The minimal session which owns the files in store"""
+
+    def __init__(self):
+        self.internal_save = {}
+        self.deferred_functions = []
+        self.is_closed = False
+
+    def closed(self):
+        return self.is_closed
+
+    def defer_call(self, func):
+        self.deferred_functions.append(func)
+
+    def close(self):
+        self.is_closed = True
+        for func in self.deferred_functions:
+            func()
+
+
+class ParseRangeTest(unittest.TestCase):
+
+    def test_range(self):
+        self.assertEqual(_parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(_parse_range('bytes=100-100', 1000), (100, 100))
+        self.assertEqual(_parse_range(' bytes = 10-19 ', 1000), (10, 19))
+
+    def test_open_ended(self):
+        self.assertEqual(_parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(_parse_range('bytes=500-5000', 1000), (500, 999))
+
+    def test_suffix(self):
+        self.assertEqual(_parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(_parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_not_satisfiable(self):
+        with self.assertRaises(ValueError):
+            _parse_range('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            _parse_range('bytes=200-100', 1000)
+        with self.assertRaises(ValueError):
+            _parse_range('bytes=-0', 1000)
+        with self.assertRaises(ValueError):
+            _parse_range('bytes=0-', 0)
+
+    def test_ignored(self):
+        # the whole file is sent for the multiple ranges and the invalid headers
+        self.assertIsNone(_parse_range('bytes=0-9,20-29', 1000))
+        self.assertIsNone(_parse_range('items=0-9', 1000))
+        self.assertIsNone(_parse_range('bytes=a-b', 1000))
+        self.assertIsNone(_parse_range('bytes=-', 1000))
+        self.assertIsNone(_parse_range('bytes=10', 1000))
+
+
+class FileStoreTest(unittest.TestCase):
+
+    def test_add_and_cleanup(self):
+        store = FileStore()
+        session = Session()
+        token = store.add(session, 'a.txt', b'hello')
+        self.assertEqual(store.get(token).open().read(), b'hello')
+        self.assertIsNone(store.get(token + 'x'))
+
+        other = store.add(Session(), 'b.txt', b'world')
+        session.close()  # the files are removed when their session closes
+        self.assertIsNone(store.get(token))
+        self.assertIsNotNone(store.get(other))
+
+        with self.assertRaises(SessionClosedException):
+            store.add(session, 'c.txt', b'')
+
+    def test_ttl(self):
+        store = FileStore()
+        session = Session()
+        token = store.add(session, 'a.txt', b'hello', ttl=0.5)
+        time.sleep(0.3)
+        self.assertIsNotNone(store.get(token))  # access renews the ttl
+        time.sleep(0.3)
+        self.assertIsNotNone(store.get(token))
+        time.sleep(0.7)
+        self.assertIsNone(store.get(token))
+
+    def test_remove_expired_on_put(self):
+        store = FileStore()
+        session = Session()
+        store.add(session, 'a.txt', b'hello', ttl=0.05)
+        store.add(session, 'b.txt', b'hello', ttl=None)
+        time.sleep(0.1)
+        store.add(session, 'c.txt', b'hello')
+        self.assertEqual(len(store), 2)
+
+    def test_content(self):
+        with self.assertRaises(TypeError):
+            StoredFile('a.txt', 'hello')
+        self.assertEqual(StoredFile('a.txt', bytearray(b'abc')).open(1).read(), b'bc')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / 'a.txt'
+            path.write_bytes(b'0123456789')
+            file = StoredFile('a.txt', path)
+            self.assertEqual(file.stat()[0], 10)
+            with file.open(5) as f:
+                self.assertEqual(f.read(), b'56789')
+
+
+class FileResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Session()
+        self.token = file_store.add(self.session, 'a.txt', b'0123456789')
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_response(self):
+        status, headers, file, start, length = prepare_file_response(self.token, {})
+        self.assertEqual((status, start, length), (200, 0, 10))
+        self.assertEqual(headers['Content-Length'], '10')
+
+        status, headers, file, start, length = prepare_file_response(self.token, {'Range': 'bytes=-3'})
+        self.assertEqual((status, start, length), (206, 7, 3))
+        self.assertEqual(headers['Content-Range'], 'bytes 7-9/10')
+
+        status, headers, file, *_ = prepare_file_response(self.token, {'Range': 'bytes=10-'})
+        self.assertEqual((status, file), (416, None))
+        self.assertEqual(headers['Content-Range'], 'bytes */10')
+
+        etag = headers['ETag']
+        status, _, file, *_ = prepare_file_response(self.token, {'If-None-Match': etag})
+        self.assertEqual((status, file), (304, None))
+
+        # the whole file is sent when it has changed since the `If-Range`
+        status, *_ = prepare_file_response(self.token, {'Range': 'bytes=0-1', 'If-Range': '"other"'})
+        self.assertEqual(status, 200)
+
+    def test_not_found(self):
+        self.session.close()
+        status, _, file, *_ = prepare_file_response(self.token, {})
+        self.assertEqual((status, file), (404, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import asyncio
+import unittest
+
+from pywebio.platform.adaptor import ws
+from pywebio.platform.adaptor.ws import ReplayBuffer, WebSocketConnection, WebSocketHandler
+from pywebio.platform.utils import reconnect_buffer_options
+from pywebio.session import CoroutineBasedSession, register_session_implement_for_target
+
+
+def output(content):
+    return dict(command='output', spec=dict(type='text', content=content))
+
+
+class ReplayBufferTest(unittest.TestCase):
+
+    def test_seq(self):
+        buffer = ReplayBuffer()
+        msgs = buffer.record([output('a'), output('b')])
+        self.assertEqual([m['seq'] for m in msgs], [0, 1])
+        msgs = buffer.record([output('c')])
+        self.assertEqual(msgs[0]['seq'], 2)
+
+    def test_since(self):
+        buffer = ReplayBuffer()
+        buffer.record([output(str(i)) for i in range(5)])
+        self.assertEqual([m['seq'] for m in buffer.since(2)], [3, 4])
+        self.assertEqual([m['seq'] for m in buffer.since(-1)], [0, 1, 2, 3, 4])
+        self.assertEqual(buffer.since(4), [])
+
+    def test_evict_by_count(self):
+        buffer = ReplayBuffer(max_messages=3)
+        buffer.record([output(str(i)) for i in range(5)])
+        self.assertEqual([m['seq'] for m in buffer.messages], [2, 3, 4])
+        self.assertEqual([m['seq'] for m in buffer.since(1)], [2, 3, 4])
+        self.assertIsNone(buffer.since(0))  # the message with seq 1 is lost
+
+    def test_evict_by_bytes(self):
+        buffer = ReplayBuffer(max_bytes=250)
+        buffer.record([output('x' * 100) for _ in range(3)])
+        self.assertEqual([m['seq'] for m in buffer.messages], [1, 2])
+        self.assertEqual(buffer.total_bytes, sum(buffer.sizes))
+        self.assertLessEqual(buffer.total_bytes, 250)
+        self.assertIsNone(buffer.since(-1))
+
+    def test_download_chunk(self):
+        buffer = ReplayBuffer(max_bytes=100)
+        chunk = dict(command='download', spec=dict(id='f1', name='a.bin', content='x' * 1000, offset=0))
+        sent = buffer.record([chunk])
+        self.assertEqual(sent[0]['spec']['content'], 'x' * 1000)  # the message sent to client is not changed
+
+        replay = buffer.since(-1)
+        self.assertEqual(len(replay), 1)
+        self.assertEqual(replay[0], dict(command='download', seq=0, spec=dict(id='f1', name='a.bin', aborted=True)))
+
+        # the download through file store is a small message, kept as is
+        download = dict(command='download', spec=dict(name='a.bin', url='?file=token'))
+        buffer.record([download])
+        self.assertIs(buffer.since(0)[0], download)
+
+    def test_options(self):
+        self.assertEqual(reconnect_buffer_options(None), dict(max_messages=1000, max_bytes=4 * 1024 * 1024))
+        self.assertEqual(reconnect_buffer_options(dict(max_bytes='1K')), dict(max_messages=1000, max_bytes=1024))
+        with self.assertRaises(ValueError):
+            reconnect_buffer_options(dict(size=10))
+
+
+class Connection(WebSocketConnection):
+    """The connection which records the messages sent to client"""
+
+    def __init__(self, session='NEW', seq=None):
+        self.query = dict(session=session, seq=seq)
+        self.messages = []
+        self.is_closed = False
+
+    def get_query_argument(self, name):
+        return self.query.get(name)
+
+    def make_session_info(self):
+        return dict(user_language='en')
+
+    def write_message(self, message):
+        self.messages.extend(message if isinstance(message, list) else [message])
+
+    def closed(self):
+        return self.is_closed
+
+    def close(self):
+        self.is_closed = True
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        ws.set_expire_second(10)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        for session_id in list(ws._reconnect_state.unclosed_sessions):
+            ws.expire_session(session_id)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _start(self):
+        """Start a session which sends 5 messages and waits, return the session id"""
+
+        async def app():
+            session = CoroutineBasedSession.get_current_session()
+            for i in range(5):
+                session.send_task_command(dict(command='output', spec=dict(type='text', content=str(i))))
+            await session.next_client_event()
+
+        register_session_implement_for_target(app)
+        conn = Connection()
+        handler = WebSocketHandler(conn, app, reconnectable=True, ioloop=self.loop,
+                                   reconnect_buffer=dict(max_messages=2, max_bytes=1024))
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual([m['seq'] for m in conn.messages if 'seq' in m], [0, 1, 2, 3, 4])
+        handler.notify_connection_lost()
+        return handler.session_id
+
+    def _reconnect(self, session_id, seq):
+        conn = Connection(session=session_id, seq=str(seq))
+        handler = WebSocketHandler(conn, None, reconnectable=True, ioloop=self.loop)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        return handler, conn
+
+    def test_resend(self):
+        session_id = self._start()
+        handler, conn = self._reconnect(session_id, 2)
+        self.assertEqual([m['seq'] for m in conn.messages], [3, 4])
+        self.assertFalse(conn.closed())
+        self.assertFalse(handler.session.closed())
+
+    def test_lost_messages_evicted(self):
+        session_id = self._start()
+        handler, conn = self._reconnect(session_id, 0)  # the messages with seq 1 and 2 are evicted
+        self.assertEqual([m['command'] for m in conn.messages], ['toast', 'close_session'])
+        self.assertIn('reload the page', conn.messages[0]['spec']['content'])
+        self.assertTrue(conn.closed())
+        self.assertNotIn(session_id, ws._reconnect_state.unclosed_sessions)
+        self.assertNotIn(session_id, ws._reconnect_state.replay_buffers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import threading
+import time
+import unittest
+
+from pywebio.session import register_session_implement_for_target
+from pywebio.session.threadbased import TaskPool, ThreadBasedSession, WAITING_SCOPE
+
+
+def new_session(target, language=''):
+    register_session_implement_for_target(target)  # like the backends, otherwise `hold()` starts script mode
+    return ThreadBasedSession(target, session_info=dict(user_language=language), on_task_command=lambda s: None,
+                              on_session_close=lambda: None)
+
+
+def drain(session):
+    """Take the commands of session like the backend, the session waits the commands taken when closing"""
+    session.get_task_commands()
+    return session.closed()
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class TaskPoolTest(unittest.TestCase):
+
+    def test_queue_and_reject(self):
+        pool = TaskPool(max_workers=1, max_pending=1)
+        release = threading.Event()
+        log = []
+
+        self.assertFalse(pool.busy())
+        self.assertEqual(pool.submit(None, lambda: (release.wait(2), log.append(1))), 0)
+        self.assertTrue(pool.busy())
+        self.assertEqual(pool.submit(None, lambda: log.append(2)), 1)
+        self.assertIsNone(pool.submit(None, lambda: log.append(3)))  # the queue is full
+
+        time.sleep(0.05)
+        release.set()
+        self.assertTrue(wait_for(lambda: log == [1, 2]))
+        metrics = pool.metrics()
+        self.assertEqual((metrics['started'], metrics['rejected'], metrics['waited']), (2, 1, 1))
+
+    def test_discard(self):
+        pool = TaskPool(max_workers=1)
+        release = threading.Event()
+        log = []
+        pool.submit(None, release.wait)
+        pool.submit('session', lambda: log.append('discarded'))
+        pool.discard('session')
+        release.set()
+        self.assertTrue(wait_for(lambda: pool.metrics()['running'] == 0))
+        self.assertEqual(log, [])
+
+    def test_blocking(self):
+        pool = TaskPool(max_workers=1)
+        release = threading.Event()
+        log = []
+
+        def blocked():
+            with pool.blocking():
+                self.assertEqual(pool.metrics()['blocked'], 1)
+                release.wait(2)
+            log.append('blocked')
+
+        pool.submit(None, blocked)
+        pool.submit(None, lambda: (log.append('other'), release.set()))
+        self.assertTrue(wait_for(lambda: log == ['other', 'blocked']))
+        self.assertEqual(pool.metrics()['workers'], 2)
+
+
+class MainTaskPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        ThreadBasedSession.set_main_task_pool(max_workers=1, max_pending=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        ThreadBasedSession.set_main_task_pool(max_workers=0)
+
+    def test_waiting_page(self):
+        running = new_session(lambda: self.release.wait(2))
+        queued = new_session(lambda: None)
+
+        commands = queued.get_task_commands()
+        self.assertEqual(commands[0]['spec']['set_scope'], WAITING_SCOPE[1:])
+        self.assertIn('you are in the queue', commands[1]['spec']['content'])
+
+        self.release.set()
+        self.assertTrue(wait_for(lambda: drain(running)))
+        self.assertTrue(wait_for(lambda: queued.unhandled_task_msgs.qsize() >= 2))
+        # the waiting message is removed when the session starts
+        commands = queued.get_task_commands()
+        self.assertEqual(commands[0], dict(command='output_ctl', spec=dict(remove=WAITING_SCOPE)))
+        self.assertEqual(commands[-1]['command'], 'close_session')
+        self.assertTrue(wait_for(lambda: drain(queued)))
+
+    def test_reject(self):
+        running = new_session(lambda: self.release.wait(2))
+        queued = new_session(lambda: None)
+        rejected = new_session(lambda: None, language='zh-CN')
+
+        # the commands are kept in the closed session for the HTTP backends to fetch
+        self.assertTrue(rejected.closed())
+        commands = rejected.get_task_commands()
+        self.assertIn('服务器繁忙', commands[-2]['spec']['content'])
+        self.assertEqual(commands[-1]['command'], 'close_session')
+        self.assertEqual(ThreadBasedSession.main_task_pool.metrics()['rejected'], 1)
+
+        self.release.set()
+        self.assertTrue(wait_for(lambda: drain(running) and drain(queued)))
+
+
+class CallbackPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        ThreadBasedSession.set_callback_pool(max_workers=1, max_inflight=1)
+
+    def tearDown(self):
+        ThreadBasedSession.set_callback_pool()
+
+    def test_waiting_callback(self):
+        """The callback waiting for user doesn't block the other callbacks"""
+        log = []
+        callbacks = []
+        ready = threading.Event()
+
+        def main():
+            session = ThreadBasedSession.get_current_session()
+
+            def wait_input(data):
+                log.append(('wait', data))
+                log.append(('got', session.next_client_event()['data']))
+
+            callbacks.extend([session.register_callback(wait_input),
+                              session.register_callback(lambda data: log.append(('quick', data)))])
+            ready.set()
+            session.next_client_event()
+
+        session = new_session(main)
+        self.assertTrue(ready.wait(2))
+        session.send_client_event(dict(event='callback', task_id=callbacks[0], data=1))
+        self.assertTrue(wait_for(lambda: log == [('wait', 1)]))
+        session.send_client_event(dict(event='callback', task_id=callbacks[1], data=2))
+        self.assertTrue(wait_for(lambda: log == [('wait', 1), ('quick', 2)]))
+
+        task_id, = session.pooled_callback_tasks
+        session.send_client_event(dict(event='input_event', task_id=task_id, data=3))
+        self.assertTrue(wait_for(lambda: log[-1] == ('got', 3)))
+        session.close(nonblock=True)
+
+    def _start_session(self, *callbacks, serial=()):
+        """Start a session with the callbacks, return the session and the callback ids"""
+        ids = []
+        ready = threading.Event()
+
+        def main():
+            session = ThreadBasedSession.get_current_session()
+            ids.extend(session.register_callback(c, serial_mode=c in serial) for c in callbacks)
+            ready.set()
+            session.next_client_event()
+
+        session = new_session(main)
+        self.assertTrue(ready.wait(2))
+        return session, ids
+
+    def test_queued_callbacks(self):
+        """The callbacks beyond `max_inflight` wait in order, and don't hold up the serial callbacks"""
+        release = threading.Event()
+        log = []
+
+        def slow(data):
+            release.wait(2)
+            log.append(('slow', data))
+
+        session, (slow_id, serial_id) = self._start_session(slow, log.append, serial=[log.append])
+        for i in range(3):
+            session.send_client_event(dict(event='callback', task_id=slow_id, data=i))
+        session.send_client_event(dict(event='callback', task_id=serial_id, data='serial'))
+        self.assertTrue(wait_for(lambda: log == ['serial']))
+        self.assertEqual(len(session._pending_callbacks), 2)
+
+        release.set()
+        self.assertTrue(wait_for(lambda: len(log) == 4))
+        self.assertEqual(log[1:], [('slow', 0), ('slow', 1), ('slow', 2)])
+        self.assertEqual(session._inflight_callbacks, 0)
+        session.close(nonblock=True)
+
+    def test_close_with_waiting_callbacks(self):
+        ThreadBasedSession.set_callback_pool(max_workers=4, max_inflight=4)
+        closed = []
+
+        def wait_input(data):
+            try:
+                ThreadBasedSession.get_current_session().next_client_event()
+            except Exception as e:
+                closed.append(type(e).__name__)
+
+        session, (callback_id,) = self._start_session(wait_input)
+        for i in range(4):
+            session.send_client_event(dict(event='callback', task_id=callback_id, data=i))
+        self.assertTrue(wait_for(lambda: len(session.pooled_callback_tasks) == 4))
+        self.assertEqual(session._inflight_callbacks, 0)  # the waiting callbacks give up their slots
+
+        session.close(nonblock=True)
+        self.assertTrue(wait_for(lambda: closed == ['SessionClosedException'] * 4))
+        self.assertTrue(wait_for(lambda: not session.pooled_callback_tasks))
+        self.assertEqual(session._inflight_callbacks, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
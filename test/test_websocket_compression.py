@@ -0,0 +1,71 @@
+import json
+import logging
+import unittest
+import warnings
+import zlib
+
+from pywebio.exceptions import PyWebIOWarning
+from pywebio.platform.utils import websocket_compression_options, limit_server_window_bits, DeflateMeter
+
+
+class CompressionOptionsTest(unittest.TestCase):
+
+    def test_options(self):
+        self.assertIsNone(websocket_compression_options(False))
+        self.assertEqual(websocket_compression_options(True), {})
+        self.assertEqual(websocket_compression_options(dict(level=1, window_bits=12)), dict(level=1, window_bits=12))
+        for invalid in (dict(level=10), dict(window_bits=8), dict(min_size=-1), dict(unknown=1)):
+            with self.assertRaises(ValueError):
+                websocket_compression_options(invalid)
+
+    def test_unsupported_options(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            options = websocket_compression_options(dict(level=1, min_size=1024), backend='aiohttp',
+                                                    supported=('window_bits',))
+        self.assertEqual(options, {})
+        self.assertEqual(len(caught), 1)
+        self.assertIs(caught[0].category, PyWebIOWarning)
+        self.assertIn("'min_size'", str(caught[0].message))
+
+    def test_limit_server_window_bits(self):
+        headers = {'Sec-WebSocket-Extensions': 'permessage-deflate; client_max_window_bits'}
+        limit_server_window_bits(headers, 12)
+        self.assertEqual(headers['Sec-WebSocket-Extensions'],
+                         'permessage-deflate; client_max_window_bits; server_max_window_bits=12')
+
+        headers = {'Sec-WebSocket-Extensions': 'permessage-deflate; server_max_window_bits=10'}
+        limit_server_window_bits(headers, 12)  # the smaller window offered by client is kept
+        self.assertEqual(headers['Sec-WebSocket-Extensions'], 'permessage-deflate; server_max_window_bits=10')
+
+
+class DeflateMeterTest(unittest.TestCase):
+
+    def test_ratio(self):
+        meter = DeflateMeter(window_bits=12)
+        messages = [json.dumps(dict(command='output', spec=dict(type='text', content=str(i) * 100))).encode('utf8')
+                    for i in range(10)]
+        for message in messages:
+            meter.feed(message)
+        self.assertEqual((meter.messages, meter.raw_bytes), (10, sum(map(len, messages))))
+        self.assertLess(meter.wire_bytes, meter.raw_bytes / 5)
+
+        with self.assertLogs('test', logging.DEBUG) as logs:
+            meter.log(logging.getLogger('test'))
+        self.assertIn('after compression (ratio', logs.output[0])
+
+    def test_same_as_permessage_deflate(self):
+        """The counted frames can be decompressed by the client like the frames of the WebSocket library"""
+        meter = DeflateMeter()
+        decompressor = zlib.decompressobj(-15)
+        for message in (b'hello', b'hello world', b'x' * 1000):
+            size = meter.wire_bytes
+            compressor = meter.compressor.copy()
+            meter.feed(message)
+            frame = (compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+            self.assertEqual(meter.wire_bytes - size, len(frame))
+            self.assertEqual(decompressor.decompress(frame + b'\x00\x00\xff\xff'), message)
+
+
+if __name__ == '__main__':
+    unittest.main()
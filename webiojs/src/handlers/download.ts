@@ -1,15 +1,105 @@
-import {Command} from "../session";
+import {Command, Session} from "../session";
 import {CommandHandler} from "./base";
 import {b64toBlob} from "../utils";
+import {t} from "../i18n";
+
+interface ChunkedDownload {
+    parts: Blob[];
+    received: number;
+    progress: JQuery;
+}
 
 export class DownloadHandler implements CommandHandler {
     accept_command: string[] = ['download'];
 
-    constructor() {
+    // chunked download id -> received chunks
+    private downloads: { [id: string]: ChunkedDownload } = {};
+    // the chunked downloads aborted because some chunks are lost in reconnection
+    private aborted: { [id: string]: boolean } = {};
+
+    constructor(readonly session: Session) {
     }
 
     handle_message(msg: Command) {
-        let blob = b64toBlob(msg.spec.content);
-        saveAs(blob, msg.spec.name, {}, false);
+        if (msg.spec.token !== undefined)  // the file is served by server at a URL
+            return this.download_url(this.session.file_url(msg.spec.token), msg.spec.name);
+
+        if (msg.spec.id !== undefined && this.aborted[msg.spec.id])
+            return;
+        if (msg.spec.aborted)  // the chunk is lost in reconnection, and the server doesn't resend it
+            return this.abort(msg.spec.id);
+
+        // the content is base64 string in JSON messages, or Uint8Array in MessagePack messages
+        let content = msg.spec.content;
+        let blob = typeof content === 'string' ? b64toBlob(content) : new Blob([content]);
+
+        if (msg.spec.id === undefined)  // not chunked download
+            return saveAs(blob, msg.spec.name, {}, false);
+
+        let download = this.downloads[msg.spec.id];
+        if (download === undefined) {
+            download = {parts: [], received: 0, progress: this.make_progress(msg.spec.name)};
+            this.downloads[msg.spec.id] = download;
+        }
+        download.parts.push(blob);
+        download.received += blob.size;
+
+        if (msg.spec.done) {
+            download.progress.remove();
+            delete this.downloads[msg.spec.id];
+            saveAs(new Blob(download.parts), msg.spec.name, {}, false);
+        } else {
+            this.update_progress(download, msg.spec.size);
+        }
+    }
+
+    abort(id: string) {
+        this.aborted[id] = true;
+        let download = this.downloads[id];
+        if (download === undefined)
+            return;
+        delete this.downloads[id];
+        let bar = download.progress.find('.progress-bar');
+        bar.removeClass('bg-info progress-bar-animated').addClass('bg-danger');
+        bar[0].style.width = "100%";
+        bar.text(t('download_interrupted'));
+        setTimeout(() => download.progress.remove(), 5000);
+    }
+
+    download_url(url: string, name: string) {
+        let link = document.createElement('a');
+        link.href = url;
+        link.download = name;  // ignored by cross-origin link, the server sets `Content-Disposition` header
+        link.style.display = 'none';
+        document.body.appendChild(link);
+        link.click();
+        link.remove();
+    }
+
+    make_progress(name: string) {
+        let elem = $(`<div class="card shadow-sm" style="position: fixed; right: 16px; bottom: 16px; width: 260px; z-index: 1070;">
+                        <div class="card-body p-2">
+                            <div class="small text-truncate mb-1"></div>
+                            <div class="progress">
+                                <div class="progress-bar bg-info progress-bar-striped progress-bar-animated" role="progressbar"
+                                     style="width: 100%;" aria-valuenow="0" aria-valuemin="0" aria-valuemax="100"></div>
+                            </div>
+                        </div>
+                    </div>`);
+        elem.find('.text-truncate').text(name);
+        $('body').append(elem);
+        return elem;
+    }
+
+    update_progress(download: ChunkedDownload, size: number | null) {
+        let bar = download.progress.find('.progress-bar');
+        if (size) {
+            let progress = "" + (100.0 * download.received / size).toFixed(1);
+            bar[0].style.width = progress + "%";
+            bar.attr("aria-valuenow", progress);
+            bar.text(progress + "%");
+        } else {  // the total size is unknown
+            bar.text((download.received / 1024 / 1024).toFixed(1) + " MB");
+        }
     }
-}
\ No newline at end of file
+}
@@ -19,6 +19,7 @@ const translations: { [lang: string]: { [msgid: string]: string } } = {
         "browse_file": "Browse",
         "duplicated_scope_name": "Error: The name of this scope is duplicated with the previous one!",
         "file_uploading": "File Uploading...",
+        "download_interrupted": "The download is interrupted by the connection lost, please try again",
     },
     "zh": {
         "disconnected_with_server": "与服务器连接已断开，请刷新页面重新操作",
@@ -33,6 +34,7 @@ const translations: { [lang: string]: { [msgid: string]: string } } = {
         "browse_file": "浏览文件",
         "duplicated_scope_name": "错误: 此scope与已有scope重复!",
         "file_uploading": "文件上传中",
+        "download_interrupted": "由于连接中断，下载失败，请重试",
     },
     "ru": {
         "disconnected_with_server": "Соединение с сервером потеряно, пожалуйста перезагрузите страницу",
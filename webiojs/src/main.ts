@@ -37,7 +37,7 @@ function set_up_session(webio_session: Session, output_container_elem: JQuery, i
     let session_ctrl = new SessionCtrlHandler(webio_session);
     let script_ctrl = new ScriptHandler(webio_session);
     let pin_ctrl = new PinHandler(webio_session);
-    let download_ctrl = new DownloadHandler();
+    let download_ctrl = new DownloadHandler(webio_session);
     let toast_ctrl = new ToastHandler();
     let env_ctrl = new EnvSettingHandler();
 
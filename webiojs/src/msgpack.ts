@@ -0,0 +1,147 @@
+import {Command} from "./session";
+
+/*
+* Minimal MessagePack decoder for the binary frames sent by server.
+* See `msgpack_dumps()` in pywebio/platform/utils.py
+* */
+
+// The command names of the short integer codes, the code of a name is its index + 1.
+// Must be kept in sync with `MSGPACK_COMMAND_CODES` in pywebio/platform/utils.py
+const command_names = [
+    'output', 'output_ctl', 'pin_value', 'pin_update', 'pin_wait', 'pin_onchange',
+    'input_group', 'update_input', 'destroy_form', 'run_script', 'set_env', 'download',
+    'popup', 'close_popup', 'toast', 'close_session', 'set_session_id',
+];
+
+const utf8_decoder = new TextDecoder();
+
+class Decoder {
+    private view: DataView;
+    private pos = 0;
+
+    constructor(private bytes: Uint8Array) {
+        this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    }
+
+    decode(): any {
+        let type = this.bytes[this.pos++];
+        if (type <= 0x7f) return type;  // positive fixint
+        if (type >= 0xe0) return type - 0x100;  // negative fixint
+        if ((type & 0xf0) === 0x80) return this.map(type & 0x0f);  // fixmap
+        if ((type & 0xf0) === 0x90) return this.array(type & 0x0f);  // fixarray
+        if ((type & 0xe0) === 0xa0) return this.str(type & 0x1f);  // fixstr
+        switch (type) {
+            case 0xc0:
+                return null;
+            case 0xc2:
+                return false;
+            case 0xc3:
+                return true;
+            case 0xc4:
+                return this.bin(this.uint(1));
+            case 0xc5:
+                return this.bin(this.uint(2));
+            case 0xc6:
+                return this.bin(this.uint(4));
+            case 0xca:
+                return this.float(4);
+            case 0xcb:
+                return this.float(8);
+            case 0xcc:
+                return this.uint(1);
+            case 0xcd:
+                return this.uint(2);
+            case 0xce:
+                return this.uint(4);
+            case 0xcf:
+                return this.uint(8);
+            case 0xd0:
+                return this.int(1);
+            case 0xd1:
+                return this.int(2);
+            case 0xd2:
+                return this.int(4);
+            case 0xd3:
+                return this.int(8);
+            case 0xd9:
+                return this.str(this.uint(1));
+            case 0xda:
+                return this.str(this.uint(2));
+            case 0xdb:
+                return this.str(this.uint(4));
+            case 0xdc:
+                return this.array(this.uint(2));
+            case 0xdd:
+                return this.array(this.uint(4));
+            case 0xde:
+                return this.map(this.uint(2));
+            case 0xdf:
+                return this.map(this.uint(4));
+        }
+        throw new Error(`Unsupported MessagePack type: 0x${type.toString(16)}`);
+    }
+
+    private uint(size: number): number {
+        let value: number;
+        if (size === 1) value = this.view.getUint8(this.pos);
+        else if (size === 2) value = this.view.getUint16(this.pos);
+        else if (size === 4) value = this.view.getUint32(this.pos);
+        else value = this.view.getUint32(this.pos) * 0x100000000 + this.view.getUint32(this.pos + 4);
+        this.pos += size;
+        return value;
+    }
+
+    private int(size: number): number {
+        let value: number;
+        if (size === 1) value = this.view.getInt8(this.pos);
+        else if (size === 2) value = this.view.getInt16(this.pos);
+        else if (size === 4) value = this.view.getInt32(this.pos);
+        else value = this.view.getInt32(this.pos) * 0x100000000 + this.view.getUint32(this.pos + 4);
+        this.pos += size;
+        return value;
+    }
+
+    private float(size: number): number {
+        let value = size === 4 ? this.view.getFloat32(this.pos) : this.view.getFloat64(this.pos);
+        this.pos += size;
+        return value;
+    }
+
+    private str(length: number): string {
+        let value = utf8_decoder.decode(this.bytes.subarray(this.pos, this.pos + length));
+        this.pos += length;
+        return value;
+    }
+
+    private bin(length: number): Uint8Array {
+        let value = this.bytes.slice(this.pos, this.pos + length);
+        this.pos += length;
+        return value;
+    }
+
+    private array(length: number): any[] {
+        let value = new Array(length);
+        for (let i = 0; i < length; i++)
+            value[i] = this.decode();
+        return value;
+    }
+
+    private map(length: number): { [key: string]: any } {
+        let value: { [key: string]: any } = {};
+        for (let i = 0; i < length; i++) {
+            let key = this.decode();
+            value[key] = this.decode();
+        }
+        return value;
+    }
+}
+
+// Decode a MessagePack frame, the frame is a command or a list of commands
+export function decode_frame(buffer: ArrayBuffer): Command | Command[] {
+    let data = new Decoder(new Uint8Array(buffer)).decode();
+    for (let msg of (Array.isArray(data) ? data : [data])) {
+        if (typeof msg.command === 'number')
+            msg.command = command_names[msg.command - 1];
+    }
+    return data;
+}
@@ -1,11 +1,13 @@
 import {error_alert, randomid, ReliableSender} from "./utils";
 import {state} from "./state";
 import {t} from "./i18n";
+import {decode_frame} from "./msgpack";
 
 export interface Command {
     command: string
     task_id: string
     spec: any
+    seq?: number  // the sequence number of the message in WebSocket session, only present when reconnection is enabled
 }
 
 export interface ClientEvent {
@@ -38,6 +40,9 @@ export interface Session {
     close_session(): void;
 
     closed(): boolean;
+
+    // the URL to fetch the file in file store of server
+    file_url(token: string): string;
 }
 
 function safe_poprun_callbacks(callbacks: (() => void)[], name = 'callback') {
@@ -53,6 +58,7 @@ export class WebSocketSession implements Session {
     ws: WebSocket;
     debug: boolean;
     webio_session_id: string = 'NEW';
+    private _last_seq = -1;  // the seq of the last received message, sent to server to resend the lost messages when reconnect
     private _closed: boolean; // session logic closed (by `close_session` command)
     private _session_create_ts = 0;
     private _session_create_callbacks: (() => void)[] = [];
@@ -72,7 +78,11 @@ export class WebSocketSession implements Session {
             let protocol = url.protocol || window.location.protocol;
             url.protocol = protocol.replace('https', 'wss').replace('http', 'ws');
         }
-        url.search = `?app=${this.app_name}&session=${this.webio_session_id}`;
+        // ask the server to send messages in MessagePack binary frames, the server falls back to JSON text frames
+        // when MessagePack is not available
+        url.search = `?app=${this.app_name}&session=${this.webio_session_id}&protocol=msgpack`;
+        if (this._last_seq >= 0)
+            url.search += `&seq=${this._last_seq}`;
         this.ws_api = url.href;
     }
 
@@ -96,6 +106,7 @@ export class WebSocketSession implements Session {
         this._session_create_ts = Date.now();
         this.debug = debug;
         this.ws = new WebSocket(this.ws_api);
+        this.ws.binaryType = 'arraybuffer';
         this.ws.onopen = () => {
             safe_poprun_callbacks(this._session_create_callbacks, 'session_create_callback');
         };
@@ -114,9 +125,19 @@ export class WebSocketSession implements Session {
             }
         };
         this.ws.onmessage = function (evt) {
-            let msg: Command = JSON.parse(evt.data);
-            if (debug) console.info('>>>', JSON.parse(evt.data));
-            that._on_server_message(msg);
+            // a frame is a command, or a list of commands when the server coalesces the commands
+            let data: Command | Command[] = typeof evt.data === 'string' ? JSON.parse(evt.data) : decode_frame(evt.data);
+            let msgs = Array.isArray(data) ? data : [data];
+            for (let msg of msgs) {
+                if (msg.seq !== undefined) {  // the messages are numbered when reconnection is enabled
+                    if (msg.seq <= that._last_seq) continue;  // already received before reconnect
+                    if (msg.seq > that._last_seq + 1)
+                        console.warn(`Messages ${that._last_seq + 1}~${msg.seq - 1} lost in reconnection`);
+                    that._last_seq = msg.seq;
+                }
+                if (debug) console.info('>>>', msg);
+                that._on_server_message(msg);
+            }
         };
     }
 
@@ -173,6 +194,13 @@ export class WebSocketSession implements Session {
     closed(): boolean {
         return this._closed || this.ws.readyState === WebSocket.CLOSED || this.ws.readyState === WebSocket.CLOSING;
     }
+
+    file_url(token: string): string {
+        let url = new URL(this.ws_api);
+        url.protocol = url.protocol.replace('ws', 'http');
+        url.search = `?file=${token}`;
+        return url.href;
+    }
 }
 
 
@@ -180,6 +208,11 @@ export class HttpSession implements Session {
     interval_pull_id: number = null;
     webio_session_id: string = '';
     debug = false;
+    long_poll = false;  // whether the server holds the pull request until there are new messages
+    event_source: EventSource = null;  // the Server-Sent Events stream used to receive messages
+
+    private pulling = false;  // whether there is a pending pull request
+    private streaming = false;  // whether messages are received from the event stream
 
     private sender: ReliableSender = null;
     private _executed_command_msg_id = -1;
@@ -219,44 +252,103 @@ export class HttpSession implements Session {
     }
 
     pull() {
+        if (this.long_poll && this.pulling)  // in long polling mode, only one pull request at a time
+            return;
         let that = this;
+        let failed = false;
+        this.pulling = true;
         $.ajax({
             type: "GET",
             url: `${this.api_url}&ack=${this._executed_command_msg_id}`,
             contentType: "application/json; charset=utf-8",
             dataType: "json",
             headers: {"webio-session-id": this.webio_session_id},
-            success: function (data: { commands: Command[][], seq: number, event: number, ack: number },
+            success: function (data: {
+                                   commands: Command[][], seq: number, event: number, ack: number,
+                                   long_poll?: boolean, sse?: boolean
+                               },
                                textStatus: string, jqXHR: JQuery.jqXHR) {
                 safe_poprun_callbacks(that._session_create_callbacks, 'session_create_callback');
                 that._on_request_success(data, textStatus, jqXHR);
                 if (that.webio_session_id.startsWith("NEW-")) {
                     that.webio_session_id = that.webio_session_id.substring(4);
                 }
+                if (data.long_poll && !that.long_poll) {  // server enabled long polling, stop interval pulling
+                    that.long_poll = true;
+                    clearInterval(that.interval_pull_id);
+                }
+                if (data.sse && that.event_source === null && window.EventSource && !that.closed())
+                    that.open_event_stream();
+            },
+            error: function () {
+                failed = true;
             }
-        })
+        }).always(() => {
+            this.pulling = false;
+            if (!this.long_poll || this.streaming || this.closed())
+                return;
+            // issue next pull request right away, back off when the request failed
+            if (failed)
+                setTimeout(() => this.pull(), this.pull_interval_ms);
+            else
+                this.pull();
+        });
+    }
+
+    // Receive the messages from server via Server-Sent Events stream,
+    // fall back to pulling when the stream can't be established.
+    open_event_stream() {
+        let source = new EventSource(
+            `${this.api_url}&sse=1&session=${this.webio_session_id}&ack=${this._executed_command_msg_id}`
+        );
+        this.event_source = source;
+        source.onopen = () => {
+            this.streaming = true;
+            clearInterval(this.interval_pull_id);
+        };
+        source.onmessage = (e: MessageEvent) => {
+            let data: { commands: Command[][], seq: number } = JSON.parse(e.data);
+            this._apply_commands(data.commands, data.seq);
+        };
+        source.onerror = () => {
+            if (source.readyState !== EventSource.CLOSED)  // the browser is reconnecting the stream
+                return;
+            this.event_source = null;
+            this.streaming = false;
+            if (this.closed())
+                return;
+            this.pull();
+            if (!this.long_poll)
+                this.change_pull_interval(this.pull_interval_ms);
+        };
     }
 
     private _on_request_success(data: { commands: Command[][], seq: number, ack: number },
                                 textStatus: string, jqXHR: JQuery.jqXHR) {
         this.sender.ack(data.ack);
 
-        let msg_start_idx = this._executed_command_msg_id - data.seq + 1;
-        if (data.commands.length <= msg_start_idx)
-            return;
-        this._executed_command_msg_id = data.seq + data.commands.length - 1;
-
         let sid = jqXHR.getResponseHeader('webio-session-id');
         if (sid)
             this.webio_session_id = sid;
 
-        for (let msgs of data.commands.slice(msg_start_idx)) {
+        this._apply_commands(data.commands, data.seq);
+    };
+
+    // Execute the messages `commands` which start with message id `seq`, skip the executed ones.
+    private _apply_commands(commands: Command[][], seq: number) {
+        let msg_start_idx = this._executed_command_msg_id - seq + 1;
+        // when `msg_start_idx < 0`, there are missing messages before `seq`, they will be resent by server
+        if (msg_start_idx < 0 || commands.length <= msg_start_idx)
+            return;
+        this._executed_command_msg_id = seq + commands.length - 1;
+
+        for (let msgs of commands.slice(msg_start_idx)) {
             for (let msg of msgs) {
                 if (this.debug) console.info('>>>', msg);
                 this._on_server_message(msg);
             }
         }
-    };
+    }
 
     send_message(msg: ClientEvent, onprogress?: (loaded: number, total: number) => void): void {
         if (this.debug) console.info('<<<', msg);
@@ -331,6 +423,8 @@ export class HttpSession implements Session {
         this._closed = true;
         safe_poprun_callbacks(this._session_close_callbacks, 'session_close_callback');
         clearInterval(this.interval_pull_id);
+        if (this.event_source !== null)
+            this.event_source.close();
         this.sender.stop();
     }
 
@@ -338,9 +432,16 @@ export class HttpSession implements Session {
         return this._closed;
     }
 
+    file_url(token: string): string {
+        // the session id is used to route the request to the worker process that owns the session
+        return `${this.api_url}&file=${token}&session=${this.webio_session_id}`;
+    }
+
     change_pull_interval(new_interval: number): void {
-        clearInterval(this.interval_pull_id);
         this.pull_interval_ms = new_interval;
+        if (this.long_poll || this.streaming)  // the interval is only used as the retry delay in these modes
+            return;
+        clearInterval(this.interval_pull_id);
         this.interval_pull_id = setInterval(() => {
             this.pull()
         }, this.pull_interval_ms);